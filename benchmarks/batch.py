@@ -0,0 +1,68 @@
+"""
+Measures per-document cost and peak Python heap of filling a LokiBatch up to
+LOKI_BATCH_SIZE the same way BaseTransfer.process_es_doc does it
+(push + total_size check) for every push mode.
+
+    python -m benchmarks.batch 1 4 16 64
+"""
+import datetime
+import json
+import sys
+import time
+import tracemalloc
+
+from es2loki.loki import JsonLokiBatch, LokiBatch, PbLokiBatch
+from es2loki.utils import size_str
+
+DEFAULT_SIZES_MB = (1, 4, 16, 32)
+BATCH_CLASSES = (("json", JsonLokiBatch), ("pb", PbLokiBatch))
+
+
+def make_entry(i: int) -> str:
+    return json.dumps(
+        {
+            "@timestamp": "2022-11-30T12:00:00.000Z",
+            "level": "INFO",
+            "message": f"request {i} has been processed successfully",
+            "log": {"offset": i},
+        },
+        sort_keys=True,
+    )
+
+
+def fill_batch(batch: LokiBatch, batch_size: int) -> tuple[int, float]:
+    ts = datetime.datetime(2022, 11, 30, 12, 0, 0)
+    labels = [{"app": f"app{i}", "job": "logs"} for i in range(8)]
+
+    docs = 0
+    started = time.perf_counter()
+    while batch.total_size < batch_size:
+        batch.push(
+            labels=labels[docs % len(labels)], timestamp=ts, entry=make_entry(docs)
+        )
+        docs += 1
+    return docs, time.perf_counter() - started
+
+
+def main(argv: list[str]) -> int:
+    sizes_mb = [int(a) for a in argv] or DEFAULT_SIZES_MB
+    for size_mb in sizes_mb:
+        batch_size = size_mb * 1024 * 1024
+        for name, batch_cls in BATCH_CLASSES:
+            docs, elapsed = fill_batch(batch_cls(), batch_size)
+
+            # tracemalloc slows down allocations a lot, so measure memory separately
+            tracemalloc.start()
+            fill_batch(batch_cls(), batch_size)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"mode={name:<4} batch={size_str(batch_size):>10} docs={docs:>8} "
+                f"elapsed={elapsed:.3f}s per_doc={elapsed / docs * 1e6:.2f}us "
+                f"peak_mem={size_str(peak)}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,184 @@
+"""
+Synthetic filebeat- and packetbeat-shaped documents. Documents are
+deterministic for a given seed, so runs of different releases process
+exactly the same data.
+
+    python -m benchmarks.docs filebeat 3
+"""
+import datetime
+import json
+import random
+import sys
+from typing import Callable, Iterator
+
+START = datetime.datetime(2022, 11, 30, tzinfo=datetime.timezone.utc)
+START_MS = int(START.timestamp() * 1000)
+# missing sort values are returned as Long.MAX_VALUE by ES
+MISSING_LONG = 2**63 - 1
+
+HOSTS = [f"web-{i}" for i in range(1, 9)]
+PATHS = ["/api/v1/items", "/api/v1/users", "/api/v1/orders", "/health", "/login"]
+STATUSES = [200, 200, 200, 200, 201, 204, 301, 404, 500]
+AGENTS = ["curl/7.68.0", "python-requests/2.28.1", "Mozilla/5.0 (X11; Linux x86_64)"]
+
+
+def _timestamp(ms: int) -> str:
+    dt = START + datetime.timedelta(milliseconds=ms - START_MS)
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _host(name: str) -> dict:
+    return {
+        "name": name,
+        "hostname": name,
+        "architecture": "x86_64",
+        "os": {
+            "family": "debian",
+            "name": "Ubuntu",
+            "version": "20.04",
+            "kernel": "5.4.0",
+        },
+        "ip": ["10.0.0.1", "fe80::1"],
+        "mac": ["02-42-ac-11-00-02"],
+    }
+
+
+def filebeat_doc(i: int, ts_ms: int, rnd: random.Random) -> dict:
+    host = rnd.choice(HOSTS)
+    path = f"{rnd.choice(PATHS)}/{rnd.randrange(100000)}"
+    status = rnd.choice(STATUSES)
+    client = f"10.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}"
+    return {
+        "@timestamp": _timestamp(ts_ms),
+        "message": (
+            f'{client} - - [30/Nov/2022:10:00:00 +0000] "GET {path} HTTP/1.1" '
+            f'{status} {rnd.randrange(100, 20000)} "-" "{rnd.choice(AGENTS)}"'
+        ),
+        "log": {"offset": i * 180, "file": {"path": "/var/log/nginx/access.log"}},
+        "input": {"type": "log"},
+        "host": _host(host),
+        "agent": {
+            "type": "filebeat",
+            "version": "7.17.0",
+            "name": host,
+            "hostname": host,
+            "id": "6b7c2f9e-3c1b-4c5e-9d3a-2f1e0b8a7c6d",
+            "ephemeral_id": "0e4f8b1c-5a2d-4e7f-8c9b-1d3a5f7e9b2c",
+        },
+        "ecs": {"version": "1.12.0"},
+        "cloud": {
+            "provider": "aws",
+            "region": "eu-west-1",
+            "instance": {"id": "i-0abc"},
+        },
+        "fields": {"env": "prod", "service": "nginx"},
+        "tags": ["nginx", "access"],
+    }
+
+
+def packetbeat_doc(i: int, ts_ms: int, rnd: random.Random) -> dict:
+    host = rnd.choice(HOSTS)
+    status = rnd.choice(STATUSES)
+    duration = rnd.randrange(100_000, 50_000_000)
+    return {
+        "@timestamp": _timestamp(ts_ms),
+        "type": "http",
+        "status": "OK" if status < 500 else "Error",
+        "method": "GET",
+        "query": f"GET {rnd.choice(PATHS)}",
+        "event": {
+            "dataset": "http",
+            "kind": "event",
+            "category": ["network", "web"],
+            "duration": duration,
+            "start": _timestamp(ts_ms),
+            "end": _timestamp(ts_ms + duration // 1_000_000),
+        },
+        "source": {
+            "ip": f"10.0.{rnd.randrange(256)}.{rnd.randrange(256)}",
+            "port": rnd.randrange(1024, 65535),
+            "bytes": rnd.randrange(100, 2000),
+        },
+        "destination": {
+            "ip": "10.0.0.10",
+            "port": 8080,
+            "bytes": rnd.randrange(100, 20000),
+        },
+        "network": {
+            "type": "ipv4",
+            "transport": "tcp",
+            "protocol": "http",
+            "direction": "ingress",
+            "community_id": f"1:{rnd.getrandbits(64):x}=",
+        },
+        "http": {
+            "request": {
+                "method": "GET",
+                "bytes": rnd.randrange(100, 2000),
+                "headers": {"content-length": 0},
+            },
+            "response": {
+                "status_code": status,
+                "bytes": rnd.randrange(100, 20000),
+                "status_phrase": "ok",
+            },
+            "version": "1.1",
+        },
+        "url": {
+            "path": rnd.choice(PATHS),
+            "full": f"http://10.0.0.10:8080{rnd.choice(PATHS)}",
+            "scheme": "http",
+        },
+        "user_agent": {"original": rnd.choice(AGENTS)},
+        "host": _host(host),
+        "agent": {
+            "type": "packetbeat",
+            "version": "7.17.0",
+            "name": host,
+            "hostname": host,
+        },
+        "ecs": {"version": "1.12.0"},
+    }
+
+
+GENERATORS: dict[str, Callable[[int, int, random.Random], dict]] = {
+    "filebeat": filebeat_doc,
+    "packetbeat": packetbeat_doc,
+}
+
+
+def generate_hits(
+    kind: str = "filebeat",
+    count: int = 100_000,
+    step_ms: int = 10,
+    seed: int = 42,
+) -> Iterator[dict]:
+    """
+    Yields ES hits sorted like BaseTransfer.make_es_sort sorts them
+    (by @timestamp and log.offset)
+    """
+    make_doc = GENERATORS[kind]
+    rnd = random.Random(seed)
+    for i in range(count):
+        ts_ms = START_MS + i * step_ms
+        source = make_doc(i, ts_ms, rnd)
+        offset = source.get("log", {}).get("offset", MISSING_LONG)
+        yield {
+            "_index": f"{kind}-7.17.0-2022.11.30",
+            "_id": f"{kind}-{i}",
+            "_score": None,
+            "_source": source,
+            "sort": [ts_ms, offset],
+        }
+
+
+def main(argv: list[str]) -> int:
+    kind = argv[0] if argv else "filebeat"
+    count = int(argv[1]) if len(argv) > 1 else 3
+    for hit in generate_hits(kind, count):
+        print(json.dumps(hit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,186 @@
+"""
+Runs BaseTransfer against local ES and Loki stand-ins (started in a separate
+process so that they do not share CPU with the transfer) and reports docs/s,
+bytes/s, peak RSS and CPU time per document. The transfer is configured with
+the usual environment variables, ELASTIC_HOSTS and LOKI_URL point to the
+stand-ins.
+
+    python -m benchmarks.e2e --docs 200000 --es-latency 0.02 --output results.jsonl
+    LOKI_PUSH_WORKERS=4 LOKI_PUSH_MODE=gzip python -m benchmarks.e2e
+    python -m benchmarks.e2e --files 4
+
+With --files the documents are written to NDJSON files and read with
+SOURCE_FILES instead of the ES stand-in.
+
+CPU time is measured for the main process only, work done by TRANSFORM_WORKERS
+and a process LOKI_ENCODE_EXECUTOR is not included.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import sys
+import tempfile
+import time
+from importlib import metadata
+from urllib.request import urlopen
+
+from benchmarks.docs import generate_hits
+from benchmarks.stand_ins import add_arguments, serve
+from es2loki import BaseTransfer
+from es2loki.utils import size_str
+
+
+def run_stand_ins(args: argparse.Namespace):
+    asyncio.run(
+        serve(
+            kind=args.kind,
+            docs=args.docs,
+            es_port=args.es_port,
+            loki_port=args.loki_port,
+            es_latency=args.es_latency,
+            loki_latency=args.loki_latency,
+        )
+    )
+
+
+def wait_port(port: int, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def peak_rss() -> int:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def version() -> str:
+    try:
+        return metadata.version("es2loki")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def write_files(args: argparse.Namespace, directory: str):
+    files = [
+        open(os.path.join(directory, f"{args.kind}-{i:03d}.ndjson"), "w")
+        for i in range(args.files)
+    ]
+    per_file = -(-args.docs // args.files)
+    for i, hit in enumerate(generate_hits(args.kind, args.docs)):
+        files[i // per_file].write(json.dumps(hit) + "\n")
+    for f in files:
+        f.close()
+
+
+def run_transfer(args: argparse.Namespace) -> dict:
+    os.environ.update(
+        {
+            "ELASTIC_HOSTS": f"http://127.0.0.1:{args.es_port}",
+            "ELASTIC_INDEX": f"{args.kind}-*",
+            "LOKI_URL": f"http://127.0.0.1:{args.loki_port}",
+        }
+    )
+    os.environ.setdefault("STATE_MODE", "none")
+
+    transfer = BaseTransfer()
+    cpu_started = cpu_time()
+    started = time.monotonic()
+    rc = transfer.start()
+    elapsed = time.monotonic() - started
+    cpu = cpu_time() - cpu_started
+
+    with urlopen(f"http://127.0.0.1:{args.loki_port}/stats") as resp:
+        loki_stats = json.load(resp)
+
+    docs = transfer.transferred_docs
+    return {
+        "version": version(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "kind": args.kind,
+        "es_latency": args.es_latency,
+        "loki_latency": args.loki_latency,
+        "files": args.files,
+        "env": {
+            k: v for k, v in sorted(os.environ.items()) if k.startswith(ENV_PREFIXES)
+        },
+        "rc": rc,
+        "docs": docs,
+        "elapsed": elapsed,
+        "docs_per_second": docs / elapsed,
+        "raw_bytes_per_second": transfer.loki_raw_bytes / elapsed,
+        "pushed_bytes_per_second": loki_stats["bytes"] / elapsed,
+        "loki_requests": loki_stats["requests"],
+        "peak_rss": peak_rss(),
+        "cpu_per_doc_us": cpu / docs * 1e6 if docs else 0.0,
+    }
+
+
+ENV_PREFIXES = ("ELASTIC_", "LOKI_", "SOURCE_", "TRANSFORM_", "JSON_", "STATE_")
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.e2e")
+    add_arguments(parser)
+    parser.add_argument("--output", help="append the result as a JSON line")
+    parser.add_argument(
+        "--files", type=int, default=0, help="read documents from this many files"
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    stand_ins = multiprocessing.Process(target=run_stand_ins, args=(args,))
+    stand_ins.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            if args.files:
+                # in a separate process so that generated docs do not count to RSS
+                writer = multiprocessing.Process(
+                    target=write_files, args=(args, directory)
+                )
+                writer.start()
+                writer.join()
+                os.environ["SOURCE_FILES"] = os.path.join(directory, "*.ndjson")
+            wait_port(args.es_port)
+            wait_port(args.loki_port)
+            result = run_transfer(args)
+    finally:
+        stand_ins.terminate()
+        stand_ins.join()
+
+    print(
+        f"{result['kind']}: {result['docs']} docs in {result['elapsed']:.2f}s "
+        f"{result['docs_per_second']:.0f} docs/s "
+        f"lines: {size_str(result['raw_bytes_per_second'])}/s "
+        f"pushed: {size_str(result['pushed_bytes_per_second'])}/s "
+        f"peak_rss: {size_str(result['peak_rss'])} "
+        f"cpu: {result['cpu_per_doc_us']:.1f}us/doc"
+    )
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+    return result["rc"]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
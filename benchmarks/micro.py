@@ -0,0 +1,91 @@
+"""
+Microbenchmarks of the Loki side of the pipeline on synthetic documents:
+filling a LokiBatch, serialize_pb, serialize_json and gzip_encode.
+
+    python -m benchmarks.micro [filebeat|packetbeat] [docs]
+"""
+import sys
+import time
+from typing import Callable
+
+from snappy import snappy
+
+from benchmarks.docs import generate_hits
+from es2loki.loki import JsonLokiBatch, LokiBatch, PbLokiBatch
+from es2loki.serializers import make_serializer
+from es2loki.timestamps import TimestampParser
+from es2loki.utils import gzip_encode, size_str
+
+DOCS = 20_000
+REPEAT = 5
+
+
+def make_entries(kind: str, docs: int) -> list[tuple[dict, int, str]]:
+    serializer = make_serializer()
+    parser = TimestampParser()
+    entries = []
+    for hit in generate_hits(kind, docs):
+        source = hit["_source"]
+        labels = {"host": source["host"]["name"], "imported": "yes"}
+        timestamp = parser.parse(source["@timestamp"])
+        entries.append((labels, timestamp, serializer.dumps(source)))
+    return entries
+
+
+def fill(batch_cls: type, entries: list[tuple[dict, int, str]]) -> LokiBatch:
+    batch = batch_cls()
+    for labels, timestamp, entry in entries:
+        batch.push(labels=labels, timestamp=timestamp, entry=entry)
+    return batch
+
+
+def measure(fn: Callable[[], object]) -> tuple[float, object]:
+    """Returns the best time of REPEAT runs and the result of the last one"""
+    best = float("inf")
+    result = None
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def report(name: str, elapsed: float, docs: int, nbytes: int = 0):
+    line = f"{name:<22} per_doc={elapsed / docs * 1e6:7.3f}us"
+    if nbytes:
+        line += f" {size_str(nbytes / elapsed)}/s"
+    print(line)
+
+
+def main(argv: list[str]) -> int:
+    kind = argv[0] if argv else "filebeat"
+    docs = int(argv[1]) if len(argv) > 1 else DOCS
+    entries = make_entries(kind, docs)
+    raw_size = sum(len(entry) for _, _, entry in entries)
+    serializer = make_serializer()
+    print(f"{kind}: {docs} docs, {size_str(raw_size)} of log lines")
+
+    elapsed, json_batch = measure(lambda: fill(JsonLokiBatch, entries))
+    report("push (json)", elapsed, docs, raw_size)
+    elapsed, pb_batch = measure(lambda: fill(PbLokiBatch, entries))
+    report("push (pb)", elapsed, docs, raw_size)
+
+    elapsed, pb_data = measure(pb_batch.serialize_pb)
+    report("serialize_pb", elapsed, docs, len(pb_data))
+    elapsed, json_data = measure(lambda: json_batch.serialize(serializer))
+    report("serialize_json", elapsed, docs, len(json_data))
+
+    elapsed, snappy_data = measure(lambda: snappy.compress(pb_data))
+    report("snappy (pb)", elapsed, docs, len(pb_data))
+    elapsed, gzip_data = measure(lambda: gzip_encode(json_data))
+    report("gzip_encode (json)", elapsed, docs, len(json_data))
+
+    print(
+        f"compression: pb+snappy {len(pb_data) / len(snappy_data):.2f}x, "
+        f"json+gzip {len(json_data) / len(gzip_data):.2f}x"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
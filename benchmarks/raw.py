@@ -0,0 +1,95 @@
+"""
+Compares per-document cost of turning a search response into log lines:
+decoding the whole response and encoding every _source back to JSON versus
+ELASTIC_RAW_SOURCE passthrough.
+
+    python -m benchmarks.raw
+"""
+import json
+import sys
+import time
+
+from es2loki.raw import parse_raw_response
+from es2loki.serializers import make_serializer
+
+DOCS = 3000
+PAGES = 20
+
+
+def make_source(i: int) -> dict:
+    return {
+        "@timestamp": f"2022-11-30T10:{i // 60 % 60:02d}:{i % 60:02d}.123Z",
+        "message": f'10.0.0.{i % 255} - - "GET /api/v1/items/{i} HTTP/1.1" 200 512',
+        "log": {"offset": i, "file": {"path": "/var/log/nginx/access.log"}},
+        "host": {
+            "name": "web-1",
+            "architecture": "x86_64",
+            "os": {"family": "debian", "name": "Ubuntu", "version": "20.04"},
+            "ip": ["10.0.0.1", "fe80::1"],
+        },
+        "agent": {"type": "filebeat", "version": "7.17.0", "name": "web-1"},
+        "ecs": {"version": "1.12.0"},
+        "fields": {"env": "prod", "service": "nginx"},
+        "tags": ["nginx", "access"],
+    }
+
+
+def make_response(docs: int) -> str:
+    hits = []
+    for i in range(docs):
+        source = make_source(i)
+        hits.append(
+            {
+                "_index": "filebeat-7.17.0-2022.11.30",
+                "_id": str(i),
+                "_score": None,
+                "_source": source,
+                "fields": {
+                    "@timestamp": [source["@timestamp"]],
+                    "host.name": ["web-1"],
+                },
+                "sort": [1669802400000 + i, i],
+            }
+        )
+    return json.dumps(
+        {
+            "took": 5,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"max_score": None, "hits": hits},
+        },
+        separators=(",", ":"),
+    )
+
+
+def decode_encode(text: str) -> float:
+    serializer = make_serializer()
+    started = time.perf_counter()
+    for _ in range(PAGES):
+        for hit in json.loads(text)["hits"]["hits"]:
+            serializer.dumps(hit["_source"])
+    return time.perf_counter() - started
+
+
+def passthrough(text: str) -> float:
+    started = time.perf_counter()
+    for _ in range(PAGES):
+        parse_raw_response(text, 2, with_fields=True)
+    return time.perf_counter() - started
+
+
+def main(argv: list[str]) -> int:
+    docs = int(argv[0]) if argv else DOCS
+    text = make_response(docs)
+    for name, func in (
+        ("decode+encode", decode_encode),
+        ("passthrough", passthrough),
+    ):
+        elapsed = func(text)
+        per_doc = elapsed / (docs * PAGES) * 1e6
+        print(f"{name:<14} docs={docs * PAGES} per_doc={per_doc:.3f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
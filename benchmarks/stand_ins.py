@@ -0,0 +1,212 @@
+"""
+Local aiohttp stand-ins for Elasticsearch and Loki serving synthetic documents
+from benchmarks.docs. Only the API used by a plain transfer is implemented:
+`_count`, `_stats` and `_search` with `search_after` (no point-in-time, slices or
+aggregations) on the ES side and the push endpoint on the Loki side.
+Queries are ignored, every search returns the next page of all documents.
+
+    python -m benchmarks.stand_ins --docs 100000 --es-latency 0.02
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import sys
+import time
+from typing import Optional
+
+from aiohttp import web
+
+from benchmarks.docs import GENERATORS, generate_hits
+
+ES_HEADERS = {
+    "Content-Type": "application/json",
+    "X-Elastic-Product": "Elasticsearch",
+}
+
+
+def _get_field(source: dict, name: str) -> Optional[list]:
+    value = source
+    for part in name.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value if isinstance(value, list) else [value]
+
+
+class FakeElasticsearch:
+    def __init__(self, hits: list[dict], latency: float = 0.0):
+        self.latency = latency
+        self.hits = hits
+        self.sort_keys = [tuple(hit["sort"]) for hit in hits]
+        # hits are encoded once, so that the stand-in spends little CPU per search
+        self._encoded = {(): [json.dumps(hit, separators=(",", ":")) for hit in hits]}
+        self.requests = 0
+
+    def _encoded_hits(self, fields: tuple[str, ...]) -> list[str]:
+        encoded = self._encoded.get(fields)
+        if encoded is None:
+            encoded = []
+            for hit in self.hits:
+                sort = hit["sort"]
+                hit_fields = {}
+                for name in fields:
+                    value = _get_field(hit["_source"], name)
+                    if value is not None:
+                        hit_fields[name] = value
+                # ES puts fields before sort
+                hit = {k: v for k, v in hit.items() if k != "sort"}
+                hit["fields"] = hit_fields
+                hit["sort"] = sort
+                encoded.append(json.dumps(hit, separators=(",", ":")))
+            self._encoded[fields] = encoded
+        return encoded
+
+    async def _body(self, request: web.Request) -> dict:
+        if not request.can_read_body:
+            return {}
+        return await request.json()
+
+    async def info(self, request: web.Request) -> web.Response:
+        body = {
+            "name": "stand-in",
+            "cluster_name": "benchmarks",
+            "version": {"number": "8.5.0", "build_flavor": "default"},
+            "tagline": "You Know, for Search",
+        }
+        return web.Response(text=json.dumps(body), headers=ES_HEADERS)
+
+    async def count(self, request: web.Request) -> web.Response:
+        return web.Response(
+            text=json.dumps({"count": len(self.hits)}), headers=ES_HEADERS
+        )
+
+    async def stats(self, request: web.Request) -> web.Response:
+        docs = {"docs": {"count": len(self.hits), "deleted": 0}}
+        body = {"_all": {"primaries": docs, "total": docs}}
+        return web.Response(text=json.dumps(body), headers=ES_HEADERS)
+
+    async def search(self, request: web.Request) -> web.Response:
+        started = time.monotonic()
+        self.requests += 1
+        body = await self._body(request)
+        size = int(body.get("size", request.query.get("size", 10)))
+        search_after = body.get("search_after")
+        fields = tuple(
+            f if isinstance(f, str) else f["field"] for f in body.get("fields", ())
+        )
+
+        start = 0
+        if search_after:
+            start = bisect.bisect_right(self.sort_keys, tuple(search_after))
+        page = self._encoded_hits(fields)[start : start + size]
+
+        remaining = self.latency - (time.monotonic() - started)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+        took = int((time.monotonic() - started) * 1000)
+        text = (
+            f'{{"took":{took},"timed_out":false,'
+            '"_shards":{"total":1,"successful":1,"skipped":0,"failed":0},'
+            f'"hits":{{"total":{{"value":{len(self.hits)},"relation":"eq"}},'
+            f'"max_score":null,"hits":[{",".join(page)}]}}}}'
+        )
+        return web.Response(text=text, headers=ES_HEADERS)
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_get("/", self.info)
+        app.router.add_route("*", "/{index}/_count", self.count)
+        app.router.add_get("/{index}/_stats/{metric}", self.stats)
+        app.router.add_route("*", "/{index}/_search", self.search)
+        return app
+
+
+class FakeLoki:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = 0
+        self.bytes = 0
+
+    async def push(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.requests += 1
+        # aiohttp decompresses gzip bodies, count what was sent over the wire
+        self.bytes += request.content_length or len(body)
+        return web.Response(status=204)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": self.requests, "bytes": self.bytes})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post("/loki/api/v1/push", self.push)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def serve(
+    kind: str = "filebeat",
+    docs: int = 100_000,
+    es_port: int = 39200,
+    loki_port: int = 33100,
+    es_latency: float = 0.0,
+    loki_latency: float = 0.0,
+    host: str = "127.0.0.1",
+):
+    es = FakeElasticsearch(list(generate_hits(kind, docs)), latency=es_latency)
+    loki = FakeLoki(latency=loki_latency)
+
+    runners = []
+    for app, port in ((es.make_app(), es_port), (loki.make_app(), loki_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+
+    print(
+        f"serving {docs} {kind} docs: es=http://{host}:{es_port} "
+        f"loki=http://{host}:{loki_port}",
+        flush=True,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--kind", choices=sorted(GENERATORS), default="filebeat")
+    parser.add_argument("--docs", type=int, default=100_000)
+    parser.add_argument("--es-port", type=int, default=39200)
+    parser.add_argument("--loki-port", type=int, default=33100)
+    parser.add_argument("--es-latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--loki-latency", type=float, default=0.0, help="seconds")
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.stand_ins")
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(
+            serve(
+                kind=args.kind,
+                docs=args.docs,
+                es_port=args.es_port,
+                loki_port=args.loki_port,
+                es_latency=args.es_latency,
+                loki_latency=args.loki_latency,
+            )
+        )
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,59 @@
+"""
+Compares per-document cost of the timestamp handling done for every ES
+document (parsing, import_month label, conversion to Loki nanoseconds):
+the former datetime.fromisoformat path and TimestampParser.
+
+    python -m benchmarks.timestamps
+"""
+import datetime
+import sys
+import time
+
+from es2loki.timestamps import TimestampParser
+
+DOCS = 200_000
+
+
+def make_values(n: int) -> list[str]:
+    start = datetime.datetime(2022, 11, 30, tzinfo=datetime.timezone.utc)
+    return [
+        (start + datetime.timedelta(milliseconds=i * 37)).strftime(
+            "%Y-%m-%dT%H:%M:%S.%f"
+        )[:-3]
+        + "Z"
+        for i in range(n)
+    ]
+
+
+def parse_fromisoformat(values: list[str]) -> float:
+    started = time.perf_counter()
+    for value in values:
+        ts = datetime.datetime.fromisoformat(value.rstrip("Z"))
+        ts.strftime("%Y%m")
+        int(ts.timestamp() * 1000) * 1_000_000
+    return time.perf_counter() - started
+
+
+def parse_timestamp_parser(values: list[str]) -> float:
+    parser = TimestampParser()
+    started = time.perf_counter()
+    for value in values:
+        ns = parser.parse(value)
+        parser.month(ns)
+    return time.perf_counter() - started
+
+
+def main(argv: list[str]) -> int:
+    docs = int(argv[0]) if argv else DOCS
+    values = make_values(docs)
+    for name, func in (
+        ("fromisoformat", parse_fromisoformat),
+        ("TimestampParser", parse_timestamp_parser),
+    ):
+        elapsed = func(values)
+        print(f"{name:<16} docs={docs} per_doc={elapsed / docs * 1e6:.3f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
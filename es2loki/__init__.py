@@ -1 +1,2 @@
+from .commands.orchestrator import TransferOrchestrator
 from .commands.transfer import BaseTransfer, run_transfer
@@ -1,6 +1,10 @@
+import os
 import sys
 
+from es2loki.commands.orchestrator import TransferOrchestrator
 from es2loki.commands.transfer import BaseTransfer, run_transfer
 
 if __name__ == "__main__":
+    if os.getenv("ELASTIC_INDICES"):
+        sys.exit(run_transfer(TransferOrchestrator(BaseTransfer)))
     sys.exit(run_transfer(BaseTransfer()))
@@ -1,7 +1,8 @@
 import asyncio
 import sys
 from asyncio import Future
-from typing import Coroutine, Optional, Tuple, TypeVar, Union
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Awaitable, Callable, Coroutine, Optional, Tuple, TypeVar, Union
 
 from .tasks import cancel_and_wait
 
@@ -44,3 +45,44 @@ async def wait_task(
             event_wait_task.cancel()
         if not data_task.done():
             data_task.cancel()
+
+
+async def aclose(iterator):
+    """Closes an async iterator if it supports it, e.g. to release ES resources"""
+    close = getattr(iterator, "aclose", None)
+    if close is not None:
+        await close()
+
+
+class Prefetch(AsyncIterator[T]):
+    """
+    Starts fetching the first item of an async iterable right away, so that
+    it is fetched while the caller is busy with something else
+    """
+
+    def __init__(
+        self,
+        iterable: AsyncIterable[T],
+        wrap: Optional[Callable[[Awaitable[T]], Awaitable[T]]] = None,
+    ):
+        self._it = iterable.__aiter__()
+        first = self._it.__anext__()
+        self._first: Optional[asyncio.Future] = asyncio.ensure_future(
+            wrap(first) if wrap is not None else first
+        )
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> T:
+        if self._first is not None:
+            first, self._first = self._first, None
+            return await first
+        return await self._it.__anext__()
+
+    async def aclose(self):
+        """Cancels fetching of the first item if it is pending"""
+        if self._first is not None:
+            first, self._first = self._first, None
+            await cancel_and_wait(first)
+        await aclose(self._it)
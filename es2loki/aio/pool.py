@@ -1,5 +1,6 @@
 import asyncio
 from datetime import datetime, timezone
+from typing import Optional
 
 
 def utc_now():
@@ -11,6 +12,43 @@ class Terminator:
     pass
 
 
+class CompletionTracker:
+    """
+    Tracks completion of sequentially numbered jobs, each consisting of one or
+    more parts which may complete out of order. `watermark` is the highest job
+    number such that it and all jobs before it are completed.
+    """
+
+    def __init__(self):
+        self._next_job = 0
+        self._pending_parts: dict[int, int] = {}
+        self._watermark = -1
+
+    @property
+    def watermark(self) -> int:
+        return self._watermark
+
+    def new_job(self, parts: int = 1) -> int:
+        job = self._next_job
+        self._next_job += 1
+        self._pending_parts[job] = parts
+        self._advance()
+        return job
+
+    def part_done(self, job: int) -> bool:
+        """Marks a part of the job as done. Returns True if watermark has moved"""
+        self._pending_parts[job] -= 1
+        return self._advance()
+
+    def _advance(self) -> bool:
+        moved = False
+        while self._pending_parts.get(self._watermark + 1) == 0:
+            del self._pending_parts[self._watermark + 1]
+            self._watermark += 1
+            moved = True
+        return moved
+
+
 class AsyncPool:
     def __init__(
         self,
@@ -25,6 +63,8 @@ class AsyncPool:
         raise_on_join: bool = False,
         log_every_n: int = None,
         expected_total=None,
+        partitioned: bool = False,
+        on_complete=None,
     ):
         """
         This class will create `num_workers` asyncio tasks to work against a queue of
@@ -45,12 +85,22 @@ class AsyncPool:
         @param raise_on_join: raise on join if any exceptions have occurred, default is False
         @param log_every_n: (optional) set to number of `push`s each time a log statement should be printed (default does not print every-n pushes)
         @param expected_total: (optional) expected total number of jobs (used for `log_event_n` logging)
+        @param partitioned: give each worker its own queue of `load_factor` items. Items pushed with the same
+            `partition` are then processed by the same worker in the order they were pushed
+        @param on_complete: (optional) async callback called with the completion watermark (see `new_job`)
+            each time it moves forward
         @return: instance of AsyncWorkerPool
         """
         self._loop = asyncio.get_running_loop()
         self._num_workers = num_workers
         self._logger = logger
-        self._queue = asyncio.Queue(num_workers * load_factor)
+        self._partitioned = partitioned
+        if partitioned:
+            self._queues = [asyncio.Queue(load_factor) for _ in range(num_workers)]
+        else:
+            self._queues = [asyncio.Queue(num_workers * load_factor)]
+        self._completion = CompletionTracker()
+        self._on_complete = on_complete
         self._workers = None
         self._exceptions = False
         self._job_accept_duration = job_accept_duration
@@ -64,25 +114,29 @@ class AsyncPool:
         self._log_every_n = log_every_n
         self._expected_total = expected_total
 
-    async def _worker_loop(self):
+    async def _worker_loop(self, queue: asyncio.Queue):
         while True:
             got_obj = False
             future = None
 
             try:
-                item = await self._queue.get()
+                item = await queue.get()
                 got_obj = True
 
                 if item.__class__ is Terminator:
                     break
 
-                future, args, kwargs = item
+                future, job, args, kwargs = item
                 # the wait_for will cancel the task (task sees CancelledError) and raises a TimeoutError from here
                 # so be wary of catching TimeoutErrors in this loop
                 result = await asyncio.wait_for(
                     self._worker_co(*args, **kwargs), self._max_task_time
                 )
 
+                if job is not None and self._completion.part_done(job):
+                    if self._on_complete is not None:
+                        await self._on_complete(self._completion.watermark)
+
                 if future:
                     future.set_result(result)
             except (KeyboardInterrupt, MemoryError, SystemExit) as e:
@@ -100,7 +154,7 @@ class AsyncPool:
                     self._logger.exception("Worker call failed")
             finally:
                 if got_obj:
-                    self._queue.task_done()
+                    queue.task_done()
 
     @property
     def exceptions(self):
@@ -110,6 +164,21 @@ class AsyncPool:
     def total_queued(self):
         return self._total_queued
 
+    @property
+    def completed_watermark(self) -> int:
+        return self._completion.watermark
+
+    @property
+    def queue_size(self) -> int:
+        """Number of items waiting in the queues"""
+        return sum(queue.qsize() for queue in self._queues)
+
+    def new_job(self, parts: int = 1) -> int:
+        """Registers a job consisting of `parts` items to be pushed with `job=<returned id>`.
+        Jobs are numbered sequentially and `on_complete` is called once all items of a job
+        and of all jobs before it are processed successfully."""
+        return self._completion.new_job(parts)
+
     async def __aenter__(self):
         self.start()
         return self
@@ -117,9 +186,17 @@ class AsyncPool:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.join()
 
-    async def push(self, *args, **kwargs) -> asyncio.Future:
+    async def push(
+        self,
+        *args,
+        partition: Optional[int] = None,
+        job: Optional[int] = None,
+        **kwargs,
+    ) -> asyncio.Future:
         """Method to push work to `worker_co` passed to `__init__`.
         :param args: position arguments to be passed to `worker_co`
+        :param partition: worker to process the item in a partitioned pool
+        :param job: job (see `new_job`) this item belongs to
         :param kwargs: keyword arguments to be passed to `worker_co`
         :return: future of result"""
         if self._first_push_dt is None:
@@ -136,7 +213,8 @@ class AsyncPool:
             )
 
         future = self._loop.create_future() if self._return_futures else None
-        await self._queue.put((future, args, kwargs))
+        queue = self._queues[(partition or 0) % len(self._queues)]
+        await queue.put((future, job, args, kwargs))
         self._total_queued += 1
 
         if (
@@ -156,9 +234,12 @@ class AsyncPool:
         assert self._workers is None
         self._exceptions = False
 
-        self._workers = [
-            asyncio.ensure_future(self._worker_loop()) for _ in range(self._num_workers)
-        ]
+        if self._partitioned:
+            queues = self._queues
+        else:
+            queues = self._queues * self._num_workers
+
+        self._workers = [asyncio.ensure_future(self._worker_loop(q)) for q in queues]
 
     async def join(self):
         # no-op if workers aren't running
@@ -168,8 +249,12 @@ class AsyncPool:
         self._logger.debug("Joining {}".format(self._name))
         # The Terminators will kick each worker from being blocked against the _queue.get() and allow
         # each one to exit
-        for _ in range(self._num_workers):
-            await self._queue.put(Terminator())
+        if self._partitioned:
+            for queue in self._queues:
+                await queue.put(Terminator())
+        else:
+            for _ in range(self._num_workers):
+                await self._queues[0].put(Terminator())
 
         try:
             await asyncio.gather(*self._workers)
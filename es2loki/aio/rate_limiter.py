@@ -0,0 +1,74 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket which holds at most `burst` tokens and is refilled with
+    `rate` tokens per second. Waiters are served in FIFO order.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+
+        self.rate = rate
+        self.burst = burst or rate
+        self._clock = clock
+        self._tokens = self.burst
+        self._updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float) -> float:
+        """
+        Waits until `amount` tokens are available and takes them.
+        An amount larger than the burst waits for a full bucket and is
+        taken as a whole, leaving a debt (negative tokens) which delays
+        the following acquires. Returns the time spent waiting.
+        """
+        started = self._clock()
+        async with self._lock:
+            self._refill()
+            needed = min(amount, self.burst)
+            if self._tokens < needed:
+                await asyncio.sleep((needed - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+        return self._clock() - started
+
+
+class RateLimiter:
+    """Limits both bytes and lines per second, any of them may be disabled"""
+
+    def __init__(
+        self,
+        bytes_rate: float = 0,
+        bytes_burst: float = 0,
+        lines_rate: float = 0,
+        lines_burst: float = 0,
+    ):
+        self.bytes = TokenBucket(bytes_rate, bytes_burst) if bytes_rate else None
+        self.lines = TokenBucket(lines_rate, lines_burst) if lines_rate else None
+        self.throttled_time = 0.0
+
+    async def acquire(self, nbytes: int, nlines: int):
+        if self.bytes is not None:
+            self.throttled_time += await self.bytes.acquire(nbytes)
+        if self.lines is not None:
+            self.throttled_time += await self.lines.acquire(nlines)
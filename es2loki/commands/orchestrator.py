@@ -0,0 +1,267 @@
+import asyncio
+import collections
+import os
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Any, Optional, Type
+
+import aiohttp
+
+from es2loki.aio.rate_limiter import RateLimiter
+from es2loki.commands import Command
+from es2loki.commands.transfer import BaseTransfer
+from es2loki.metrics import Counter, Gauge, MetricsServer, Registry
+
+
+@dataclass
+class SharedResources:
+    """
+    Connections and limits shared by all jobs of an orchestrator.
+    Clients, executors and the rate limiter are made by the first job with
+    its `make_*` hooks and reused by the rest. The state database is
+    connected by the orchestrator before jobs start.
+    """
+
+    loki_session: aiohttp.ClientSession
+    # FIFO semaphores, so that running jobs take turns
+    es_concurrency: asyncio.Semaphore
+    loki_concurrency: asyncio.Semaphore
+    es: Optional[Any] = None
+    es_raw: Optional[Any] = None
+    encode_executor: Optional[Executor] = None
+    # transforms documents of every job with the hooks of that job
+    transform_executor: Optional[Executor] = None
+    loki_rate_limiter: Optional[RateLimiter] = None
+    db: Optional[Any] = None
+
+    async def close(self):
+        for es in (self.es, self.es_raw):
+            if es is not None:
+                await es.close()
+        await self.loki_session.close()
+        if self.encode_executor is not None:
+            self.encode_executor.shutdown(wait=False)
+        if self.transform_executor is not None:
+            self.transform_executor.shutdown(wait=False, cancel_futures=True)
+        if self.db is not None:
+            from es2loki.state.db import close_db
+
+            await close_db()
+
+
+class TransferOrchestrator(Command):
+    """
+    Runs a transfer job per index pattern of ELASTIC_INDICES in one event loop.
+
+    Every job is an instance of `transfer_cls` configured by the same
+    environment variables except ELASTIC_INDEX, and keeps its own state
+    and progress. At most JOBS_CONCURRENCY jobs run at once and are started
+    in order. ES and Loki clients are shared by jobs (see SharedResources),
+    and the concurrency of their requests is capped globally.
+    """
+
+    def __init__(
+        self,
+        transfer_cls: Type[BaseTransfer] = BaseTransfer,
+        indices: Optional[list[str]] = None,
+        **kwargs,
+    ):
+        kwargs.setdefault("execute_timeout", 128)
+        super().__init__(**kwargs)
+        self.transfer_cls = transfer_cls
+
+        if indices is None:
+            # `,` separates indices of a single job in ES syntax
+            indices = os.getenv("ELASTIC_INDICES", "").split(";")
+        self.indices = [index.strip() for index in indices if index.strip()]
+        if not self.indices:
+            raise ValueError("ELASTIC_INDICES is empty")
+        if len(set(self.indices)) != len(self.indices):
+            raise ValueError("ELASTIC_INDICES contains duplicates")
+
+        self.jobs_concurrency = int(os.getenv("JOBS_CONCURRENCY", 4))
+        self.jobs_es_concurrency = int(
+            os.getenv("JOBS_ES_CONCURRENCY", self.jobs_concurrency)
+        )
+        self.jobs_loki_concurrency = int(
+            os.getenv("JOBS_LOKI_CONCURRENCY", 2 * self.jobs_concurrency)
+        )
+        self.jobs_progress_interval = float(os.getenv("JOBS_PROGRESS_INTERVAL", 30))
+
+        self.state_mode = os.getenv("STATE_MODE", "none")
+        self.state_db_url = os.getenv(
+            "STATE_DB_URL", "postgres://127.0.0.1:5432/postgres"
+        )
+
+        self.metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+        self.metrics_port = int(os.getenv("METRICS_PORT", 0))
+
+        self.shared: Optional[SharedResources] = None
+        self.running: dict[str, BaseTransfer] = {}
+        # transferred and total docs of finished jobs, which are not kept
+        self.finished: dict[str, tuple[int, int]] = {}
+        self.done: set[str] = set()
+        self.failed: dict[str, BaseException] = {}
+
+        self.metrics = self.make_metrics()
+        self.metrics_server = None
+        if self.metrics is not None:
+            self.metrics_server = MetricsServer(
+                self.metrics, host=self.metrics_host, port=self.metrics_port
+            )
+
+    def make_shared_resources(self) -> SharedResources:
+        return SharedResources(
+            loki_session=aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.jobs_loki_concurrency)
+            ),
+            es_concurrency=asyncio.Semaphore(self.jobs_es_concurrency),
+            loki_concurrency=asyncio.Semaphore(self.jobs_loki_concurrency),
+        )
+
+    def make_job(self, index: str) -> BaseTransfer:
+        """Returns a transfer of the index using the shared resources"""
+        return self.transfer_cls(
+            command_kwargs={"es_index": index, "shared": self.shared}
+        )
+
+    def make_metrics(self) -> Optional[Registry]:
+        """
+        Returns a registry of metrics served on METRICS_PORT or None when
+        metrics are disabled. Override it to add custom metrics.
+        """
+        if not self.metrics_port:
+            return None
+
+        registry = Registry()
+        registry.add(
+            Gauge(
+                "es2loki_jobs",
+                "Transfer jobs by status",
+                labelnames=("status",),
+                fn=lambda: {(k,): v for k, v in self._job_counts().items()},
+            )
+        )
+        registry.add(
+            Counter(
+                "es2loki_job_transferred_docs_total",
+                "Documents pushed to Loki by a job including previous runs",
+                labelnames=("job",),
+                fn=lambda: {(k,): v[0] for k, v in self._job_docs().items()},
+            )
+        )
+        registry.add(
+            Gauge(
+                "es2loki_job_total_docs",
+                "Documents to transfer by a job",
+                labelnames=("job",),
+                fn=lambda: {(k,): v[1] for k, v in self._job_docs().items()},
+            )
+        )
+        return registry
+
+    def _job_docs(self) -> dict[str, tuple[int, int]]:
+        docs = dict(self.finished)
+        for index, job in self.running.items():
+            docs[index] = (job.transferred_docs, job.total_docs)
+        return docs
+
+    def _job_counts(self) -> dict[str, int]:
+        return {
+            "pending": len(self.indices) - len(self.running) - len(self.finished),
+            "running": len(self.running),
+            "done": len(self.done),
+            "failed": len(self.failed),
+        }
+
+    async def connect_db(self) -> Optional[Any]:
+        """
+        Connects to the state database once for all jobs, so that they do not
+        initialize Tortoise each. Returns None unless STATE_MODE=db.
+        """
+        if self.state_mode != "db":
+            return None
+        from es2loki.state.db import init_db
+
+        return await init_db(self.state_db_url, self.stop_event, self.logger)
+
+    async def execute(self):
+        self.shared = self.make_shared_resources()
+        pending = collections.deque(self.indices)
+        stopper = asyncio.create_task(self._stop_jobs())
+        progress = asyncio.create_task(self._log_progress())
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+        try:
+            # before jobs are started, so that their tasks see the connection
+            self.shared.db = await self.connect_db()
+            await asyncio.gather(
+                *(
+                    self._job_worker(pending)
+                    for _ in range(min(self.jobs_concurrency, len(self.indices)))
+                )
+            )
+        finally:
+            stopper.cancel()
+            progress.cancel()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            await self.shared.close()
+
+        self.log_progress()
+        if self.failed:
+            raise RuntimeError(
+                f"{len(self.failed)} of {len(self.indices)} jobs failed: "
+                f"{', '.join(self.failed)}"
+            )
+
+    async def _job_worker(self, pending: collections.deque):
+        while pending and self.is_running:
+            await self.run_job(pending.popleft())
+
+    async def run_job(self, index: str):
+        self.logger.info("starting job %s", index)
+        job = None
+        try:
+            job = self.make_job(index)
+            self.running[index] = job
+            await job.execute()
+        except Exception as e:
+            self.logger.exception("job %s failed: %s", index, e)
+            self.failed[index] = e
+        else:
+            # a stopped job is neither done nor failed and resumes on restart
+            if self.is_running:
+                self.done.add(index)
+                self.logger.info("job %s done: %d docs", index, job.transferred_docs)
+        finally:
+            self.running.pop(index, None)
+            if job is None:
+                self.finished[index] = (0, 0)
+            else:
+                self.finished[index] = (job.transferred_docs, job.total_docs)
+
+    async def _stop_jobs(self):
+        await self.stop_event.wait()
+        for job in self.running.values():
+            job.stop_event.set()
+
+    async def _log_progress(self):
+        while True:
+            await asyncio.sleep(self.jobs_progress_interval)
+            self.log_progress()
+
+    def log_progress(self):
+        docs = self._job_docs().values()
+        transferred = sum(d[0] for d in docs)
+        total = sum(d[1] for d in docs)
+        self.logger.info(
+            "jobs: %s. progress of started jobs: %d/%d (%.2f%%)",
+            ", ".join(f"{v} {k}" for k, v in self._job_counts().items()),
+            transferred,
+            total,
+            min(100.0, transferred / total * 100) if total else 0.0,
+        )
+        for index, job in sorted(self.running.items()):
+            self.logger.info("  %s: %s", index, job.get_printable_progress())
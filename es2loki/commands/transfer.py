@@ -1,76 +1,250 @@
 import asyncio
+import collections
+import contextvars
 import datetime
-import json
 import logging
 import os
+import pickle
 import time
 from collections.abc import AsyncIterable
-from typing import MutableMapping, Optional
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Awaitable, MutableMapping, Optional, Union
+from urllib.parse import quote
 
-from elasticsearch import AsyncElasticsearch
-
-from es2loki.aio import wait_task
+from es2loki.aio import Prefetch, aclose, wait_task
 from es2loki.aio.pool import AsyncPool
+from es2loki.aio.rate_limiter import RateLimiter
+from es2loki.aio.tasks import cancel_and_wait
 from es2loki.commands import Command
-from es2loki.es import ElasticsearchScroller
-from es2loki.loki import Loki, LokiBatch
+from es2loki.dead_letter import DeadLetter
+from es2loki.es import (
+    MINIMAL_FILTER_PATH,
+    ElasticsearchScroller,
+    SearchStats,
+    SlicedElasticsearchScroller,
+    TimeWindow,
+    make_time_windows,
+    sort_fields,
+)
+from es2loki.files import FileScroller, estimate_docs, expand_paths
+from es2loki.loki import Backoff, Loki, LokiBatch
+from es2loki.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+from es2loki.page_size import PageSizeController
+from es2loki.profiler import StageProfiler
+from es2loki.raw import RAW_SOURCE_FIELD, make_raw_serializers
+from es2loki.serializers import make_serializer
+from es2loki.spool import Spool, SpooledBatch
+from es2loki.startup import StartupTimer
 from es2loki.state import StateStore
-from es2loki.state.db import DBStateStore
+from es2loki.state.checkpoint import Checkpointer
 from es2loki.state.dummy import DummyStateStore
+from es2loki.state.file import FileStateStore
 from es2loki.state.types import State
+from es2loki.timestamps import TimestampParser, ns_to_datetime
+from es2loki.transform import init_worker, transform_hits
 from es2loki.utils import seconds_to_str, size_str
 
+if TYPE_CHECKING:
+    from es2loki.commands.orchestrator import SharedResources
+
+# time window transferred by the current task, which has its own batch and state
+_current_window: contextvars.ContextVar[Optional[TimeWindow]] = contextvars.ContextVar(
+    "es2loki_current_window", default=None
+)
+
 
 class BaseTransfer(Command):
     state_store: StateStore
 
+    # not sent to transform worker processes (see __getstate__)
+    _runtime_attrs = (
+        "_loop",
+        "_stop_event",
+        "_execute_task",
+        "_flush_lock",
+        "_state_stores",
+        "checkpointer",
+        "_pending_jobs",
+        "_eta_calc",
+        "_warm_up",
+        "_scroller",
+        "_total_docs_refresh",
+        "_spool_feeder",
+        "es",
+        "es_raw",
+        "loki",
+        "loki_rate_limiter",
+        "dead_letter",
+        "_loki_batch",
+        "loki_pool",
+        "state_store",
+        "encode_executor",
+        "transform_executor",
+        "metrics",
+        "metrics_server",
+        "profiler",
+        "spool",
+        "shared",
+        "_command_kwargs",
+    )
+
     def __init__(self, *args, **kwargs):
+        self.startup = StartupTimer()
         kwargs.setdefault("execute_timeout", 128)
         super().__init__(*args, **kwargs)
 
         self.dry_run = os.getenv("DRY_RUN") == "1"
+        # set when the transfer is a job of TransferOrchestrator
+        self.shared: Optional["SharedResources"] = self.get_command_kwarg("shared")
 
         es_hosts = os.getenv("ELASTIC_HOSTS", "http://localhost:9200")
         es_user = os.getenv("ELASTIC_USER")
         es_password = os.getenv("ELASTIC_PASSWORD")
-        self.es_index = os.getenv("ELASTIC_INDEX")
+        self.es_index = self.get_command_kwarg("es_index") or os.getenv("ELASTIC_INDEX")
         self.es_batch_size = int(os.getenv("ELASTIC_BATCH_SIZE", 3000))
+        self.es_adaptive_batch_size = bool(int(os.getenv("ELASTIC_ADAPTIVE_BATCH", 0)))
+        self.es_min_batch_size = int(os.getenv("ELASTIC_MIN_BATCH_SIZE", 100))
+        self.es_max_batch_size = int(os.getenv("ELASTIC_MAX_BATCH_SIZE", 10000))
+        self.es_target_latency = float(os.getenv("ELASTIC_TARGET_LATENCY", 5))
+        self.es_target_size_mb = float(os.getenv("ELASTIC_TARGET_SIZE_MB", 32))
+        self.es_max_memory_mb = int(os.getenv("ELASTIC_MAX_MEMORY_MB", 0))
         self.es_timeout = int(os.getenv("ELASTIC_TIMEOUT", 120))
         self.es_max_date = os.getenv("ELASTIC_MAX_DATE")
         self.es_timestamp_field = os.getenv("ELASTIC_TIMESTAMP_FIELD", "@timestamp")
+        self.es_slices = int(os.getenv("ELASTIC_SLICES", 0))
+        self.es_pit_keep_alive = os.getenv("ELASTIC_PIT_KEEP_ALIVE", "5m")
+        self.es_source_includes = os.getenv("ELASTIC_SOURCE_INCLUDES")
+        self.es_source_excludes = os.getenv("ELASTIC_SOURCE_EXCLUDES")
+        self.es_trim_response = bool(int(os.getenv("ELASTIC_TRIM_RESPONSE", 0)))
+        self.es_raw_source = bool(int(os.getenv("ELASTIC_RAW_SOURCE", 0)))
+        self.es_raw_fields = os.getenv("ELASTIC_RAW_FIELDS")
+        self.es_window_interval = os.getenv("ELASTIC_WINDOW_INTERVAL")
+        self.es_window_min_docs = int(os.getenv("ELASTIC_WINDOW_MIN_DOCS", 0))
+        self.es_window_workers = int(os.getenv("ELASTIC_WINDOW_WORKERS", 1))
+        self.es_count_mode = os.getenv("ELASTIC_COUNT_MODE", "count")
+        self.es_count_interval = float(os.getenv("ELASTIC_COUNT_INTERVAL", 300))
+        if self.es_count_mode not in ("count", "remaining", "stats"):
+            raise ValueError(
+                "Unknown ELASTIC_COUNT_MODE. Possible values are: (count, remaining, stats)"
+            )
+
+        self.source_files = os.getenv("SOURCE_FILES")
+        self.source_files_workers = int(os.getenv("SOURCE_FILES_WORKERS", 1))
 
         loki_url = os.getenv("LOKI_URL", "http://localhost:3100")
         loki_username = os.getenv("LOKI_USERNAME")
         loki_password = os.getenv("LOKI_PASSWORD")
         loki_tenant_id = os.getenv("LOKI_TENANT_ID")
         self.loki_batch_size = int(os.getenv("LOKI_BATCH_SIZE", 1 * 1024 * 1024))
+        self.loki_backoff_base = float(os.getenv("LOKI_BACKOFF_BASE", 0.5))
+        self.loki_backoff_max = float(os.getenv("LOKI_BACKOFF_MAX", 60))
+        self.loki_rate_limit_retries = int(os.getenv("LOKI_RATE_LIMIT_RETRIES", 10))
+        self.loki_dead_letter_file = os.getenv("LOKI_DEAD_LETTER_FILE")
+        self.loki_max_dropped = int(os.getenv("LOKI_MAX_DROPPED", 1000))
         self.loki_pool_load_factor = int(os.getenv("LOKI_POOL_LOAD_FACTOR", 10))
+        self.loki_push_workers = int(os.getenv("LOKI_PUSH_WORKERS", 1))
+        self.loki_labels_cache_size = int(os.getenv("LOKI_LABELS_CACHE_SIZE", 10000))
         self.loki_push_mode = os.getenv("LOKI_PUSH_MODE", "pb")
         self.loki_wait_timeout = float(os.getenv("LOKI_WAIT_TIMEOUT", 0))
+        self.loki_ingestion_rate_mb = float(os.getenv("LOKI_INGESTION_RATE_MB", 0))
+        self.loki_ingestion_burst_mb = float(
+            os.getenv("LOKI_INGESTION_BURST_MB", self.loki_ingestion_rate_mb)
+        )
+        self.loki_lines_rate_limit = float(os.getenv("LOKI_LINES_RATE_LIMIT", 0))
+        self.loki_lines_burst = float(
+            os.getenv("LOKI_LINES_BURST", self.loki_lines_rate_limit)
+        )
+        self.loki_encode_executor = os.getenv("LOKI_ENCODE_EXECUTOR", "none")
+        self.loki_encode_workers = int(
+            os.getenv("LOKI_ENCODE_WORKERS", min(4, os.cpu_count() or 1))
+        )
+        self.transform_workers = int(os.getenv("TRANSFORM_WORKERS", 0))
+        self.transform_page_size = int(os.getenv("TRANSFORM_PAGE_SIZE", 1000))
+
+        self.json_encoder = os.getenv("JSON_ENCODER", "auto")
+        self.loki_line_sort_keys = bool(int(os.getenv("LOKI_LINE_SORT_KEYS", 1)))
+        self.loki_line_compact = bool(int(os.getenv("LOKI_LINE_COMPACT", 0)))
+        self.serializer = make_serializer(
+            self.json_encoder,
+            sort_keys=self.loki_line_sort_keys,
+            compact=self.loki_line_compact,
+        )
+
+        self.metrics_host = os.getenv("METRICS_HOST", "0.0.0.0")
+        self.metrics_port = int(os.getenv("METRICS_PORT", 0))
+        self.profile = bool(int(os.getenv("PROFILE", 0)))
+        self.profile_interval = float(os.getenv("PROFILE_INTERVAL", 30))
+        self.profile_dump_dir = os.getenv("PROFILE_DUMP_DIR", ".")
+
+        self.spool_dir = os.getenv("SPOOL_DIR")
+        self.spool_segment_mb = int(os.getenv("SPOOL_SEGMENT_MB", 64))
+        self.spool_max_size_mb = int(os.getenv("SPOOL_MAX_SIZE_MB", 1024))
 
         self.state_start_over = bool(int(os.getenv("STATE_START_OVER", 0)))
         self.state_mode = os.getenv("STATE_MODE", "none")
         self.state_db_url = os.getenv(
             "STATE_DB_URL", "postgres://127.0.0.1:5432/postgres"
         )
+        self.state_dir = os.getenv("STATE_DIR", "state")
+        self.state_fsync_interval = float(os.getenv("STATE_FSYNC_INTERVAL", 1))
+        self.state_save_interval = float(os.getenv("STATE_SAVE_INTERVAL", 1))
+        self.state_save_batches = int(os.getenv("STATE_SAVE_BATCHES", 100))
 
-        if self.state_mode == "db":
-            self.state_store = DBStateStore(
-                name=self.es_index,
-                url=self.state_db_url,
-                dry_run=self.dry_run,
-            )
-        elif self.state_mode == "none":
-            self.state_store = DummyStateStore(
-                dry_run=self.dry_run,
+        if self.shared is not None:
+            # metrics and profiles of jobs are served by the orchestrator
+            self._logger = logging.getLogger(
+                f"{self.__class__.__name__}[{self.es_index}]"
             )
-        else:
-            raise ValueError("Unknown STATE_MODE. Possible values are: (db, none)")
+            self.metrics_port = 0
+            self.profile = False
+            if self.spool_dir:
+                self.spool_dir = os.path.join(
+                    self.spool_dir, quote(self.es_index, safe="")
+                )
+
+        self.state_store = self.make_state_store(self.es_index)
+        self._state_stores = [self.state_store]
 
-        self.es = self.make_elastic_client(
-            hosts=es_hosts,
-            user=es_user,
-            password=es_password,
+        self.ts_parser = TimestampParser()
+        self._enrich_labels_wants_datetime = (
+            type(self).enrich_labels is not BaseTransfer.enrich_labels
+        )
+
+        self.encode_executor = self._get_shared(
+            "encode_executor", self.make_encode_executor
+        )
+        self.transform_executor = None
+
+        self.es = None
+        if not self.source_files:
+            self.es = self._get_shared(
+                "es",
+                lambda: self.make_elastic_client(
+                    hosts=es_hosts,
+                    user=es_user,
+                    password=es_password,
+                ),
+            )
+        self.es_raw = None
+        if self.es_raw_source and not self.source_files:
+            self.es_raw = self._get_shared(
+                "es_raw",
+                lambda: self.make_elastic_client(
+                    hosts=es_hosts,
+                    user=es_user,
+                    password=es_password,
+                    serializers=make_raw_serializers(),
+                ),
+            )
+        # made by every job as it may lower LOKI_BATCH_SIZE, but the tenant
+        # limits apply to all jobs, so the limiter of the first one is shared
+        self.loki_rate_limiter = self.make_loki_rate_limiter()
+        if self.shared is not None:
+            self.loki_rate_limiter = self._get_shared(
+                "loki_rate_limiter", lambda: self.loki_rate_limiter
+            )
+        self.dead_letter = DeadLetter(
+            path=self.loki_dead_letter_file, max_entries=self.loki_max_dropped
         )
         self.loki = Loki(
             url=loki_url,
@@ -80,58 +254,386 @@ class BaseTransfer(Command):
             use_gzip=self.loki_push_mode == "gzip",
             use_pb=self.loki_push_mode == "pb",
             dry_run=self.dry_run,
+            executor=self.encode_executor,
+            labels_cache_size=self.loki_labels_cache_size,
+            serializer=self.serializer,
+            batch_size=self.loki_batch_size,
+            rate_limiter=self.loki_rate_limiter,
+            dead_letter=self.dead_letter,
+            rate_limit_retries=self.loki_rate_limit_retries,
+            backoff=Backoff(
+                base=self.loki_backoff_base, max_delay=self.loki_backoff_max
+            ),
+            session=self.shared.loki_session if self.shared else None,
+            concurrency=self.shared.loki_concurrency if self.shared else None,
         )
+        self.es_stats = SearchStats()
+        self.es_page_size = self.make_es_page_size()
         self.total_docs = 0
         self.transferred_docs = 0
+        self.dropped_docs = 0
         self._speed = 0
         self._eta = 0
         self._eta_calc = None
+        self._total_docs_refresh = None
+        self._warm_up: Optional[asyncio.Task] = None
+        self._scroller: Optional[Prefetch] = None
+        self._spool_feeder: Optional[asyncio.Task] = None
+        self._push_error: Optional[Exception] = None
 
-        self.loki_batch = LokiBatch()
+        self.loki_batch = self.loki.make_batch()
         self._latest_state = None
         self.loki_pool = None
+        self._pending_jobs: dict[int, tuple[State, int, Optional[TimeWindow]]] = {}
+        self._acked_docs = 0
+        self._acked_timestamp: Optional[str] = None
+        self._acked_ts: Optional[int] = None
+        self.loki_raw_bytes = 0
+        self.loki_encoded_bytes = 0
+        self.loki_batch_streams: Optional[Histogram] = None
+        self.spool = self.make_spool()
+
+        self.profiler = self.make_profiler()
+        self.checkpointer = Checkpointer(
+            interval=self.state_save_interval,
+            max_jobs=self.state_save_batches,
+            on_saved=self.on_states_saved,
+            profiler=self.profiler,
+        )
+        self.metrics = self.make_metrics()
+        self.metrics_server = None
+        if self.metrics is not None:
+            self.metrics_server = MetricsServer(
+                self.metrics, host=self.metrics_host, port=self.metrics_port
+            )
 
         self._flush_lock = asyncio.Lock()
+        self.startup.add("init", self.startup.started)
+
+    @property
+    def loki_batch(self) -> LokiBatch:
+        window = _current_window.get()
+        return self._loki_batch if window is None else window.batch
+
+    @loki_batch.setter
+    def loki_batch(self, batch: LokiBatch):
+        window = _current_window.get()
+        if window is None:
+            self._loki_batch = batch
+        else:
+            window.batch = batch
 
     @property
     def latest_state(self) -> State:
-        return self._latest_state
+        window = _current_window.get()
+        return self._latest_state if window is None else window.latest_state
+
+    @latest_state.setter
+    def latest_state(self, state: State):
+        window = _current_window.get()
+        if window is None:
+            self._latest_state = state
+        else:
+            window.latest_state = state
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self._runtime_attrs:
+            state.pop(name, None)
+        # stages are not profiled in transform worker processes
+        state["profiler"] = None
+        return state
+
+    def _get_shared(self, name: str, make):
+        """
+        Makes a resource of the transfer. Jobs of an orchestrator share
+        the one made by the first job.
+        """
+        if self.shared is None:
+            return make()
+        resource = getattr(self.shared, name)
+        if resource is None:
+            resource = make()
+            setattr(self.shared, name, resource)
+        return resource
 
     @staticmethod
     def make_elastic_client(
         hosts: str,
         user: str,
         password: str,
+        **kwargs,
     ):
-        kwargs = {
-            "hosts": hosts.split(","),
-        }
+        kwargs["hosts"] = hosts.split(",")
         if user and password:
             kwargs["http_auth"] = (user, password)
 
+        from elasticsearch import AsyncElasticsearch
+
         return AsyncElasticsearch(**kwargs)
 
-    async def _get_total_docs(self):
-        body = None
+    def make_loki_rate_limiter(self) -> Optional[RateLimiter]:
+        """
+        Limits the rate of log lines sent to Loki. Should match `ingestion_rate_mb`
+        and `ingestion_burst_size_mb` limits of the tenant.
+        """
+        if not self.loki_ingestion_rate_mb and not self.loki_lines_rate_limit:
+            return None
+
+        bytes_burst = int(self.loki_ingestion_burst_mb * 1024 * 1024)
+        if bytes_burst and self.loki_batch_size > bytes_burst:
+            self.logger.warning(
+                "LOKI_BATCH_SIZE is lowered to LOKI_INGESTION_BURST_MB (%s)",
+                size_str(bytes_burst),
+            )
+            self.loki_batch_size = bytes_burst
+
+        return RateLimiter(
+            bytes_rate=self.loki_ingestion_rate_mb * 1024 * 1024,
+            bytes_burst=bytes_burst,
+            lines_rate=self.loki_lines_rate_limit,
+            lines_burst=self.loki_lines_burst,
+        )
+
+    def make_profiler(self) -> Optional[StageProfiler]:
+        """Returns a profiler of pipeline stages when PROFILE is enabled"""
+        if not self.profile:
+            return None
+
+        profiler = StageProfiler(
+            interval=self.profile_interval, dump_dir=self.profile_dump_dir
+        )
+
+        def stages():
+            stages = {
+                "es_fetch": self.es_stats.duration,
+                "es_decode": max(0.0, self.es_stats.elapsed - self.es_stats.duration),
+                "serialize": self.loki.serialize_time,
+                "compress": self.loki.compress_time,
+                "loki_push": self.loki.push_time,
+            }
+            if self.loki_rate_limiter is not None:
+                stages["loki_throttled"] = self.loki_rate_limiter.throttled_time
+            return stages
+
+        profiler.add_source(stages)
+        return profiler
+
+    def make_metrics(self) -> Optional[Registry]:
+        """
+        Returns a registry of metrics served on METRICS_PORT or None when
+        metrics are disabled. Override it to add custom metrics.
+        """
+        if not self.metrics_port:
+            return None
+
+        registry = Registry()
+        self.es_stats.latency = registry.add(
+            Histogram("es2loki_es_search_seconds", "ES search request latency")
+        )
+        self.loki.push_latency = registry.add(
+            Histogram("es2loki_loki_push_seconds", "Loki push request latency")
+        )
+        self.loki_batch_streams = registry.add(
+            Histogram(
+                "es2loki_loki_batch_streams",
+                "Streams in a batch pushed to Loki",
+                buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000),
+            )
+        )
+
+        def counter(name, doc, fn, labelnames=()):
+            registry.add(Counter(name, doc, labelnames=labelnames, fn=fn))
+
+        def gauge(name, doc, fn):
+            registry.add(Gauge(name, doc, fn=fn))
+
+        counter(
+            "es2loki_es_requests_total",
+            "ES search requests",
+            lambda: self.es_stats.requests,
+        )
+        counter(
+            "es2loki_es_docs_total",
+            "Documents fetched from ES",
+            lambda: self.es_stats.docs,
+        )
+        counter(
+            "es2loki_es_response_bytes_total",
+            "Size of ES search responses",
+            lambda: self.es_stats.bytes,
+        )
+        counter(
+            "es2loki_transferred_docs_total",
+            "Documents pushed to Loki including previous runs",
+            lambda: self.transferred_docs,
+        )
+        counter(
+            "es2loki_loki_raw_bytes_total",
+            "Size of log lines pushed to Loki",
+            lambda: self.loki_raw_bytes,
+        )
+        counter(
+            "es2loki_loki_encoded_bytes_total",
+            "Size of encoded Loki push requests",
+            lambda: self.loki_encoded_bytes,
+        )
+        counter(
+            "es2loki_loki_retries_total",
+            "Retried Loki pushes",
+            lambda: {(k,): v for k, v in self.loki.retries.items()},
+            labelnames=("reason",),
+        )
+        counter(
+            "es2loki_loki_dropped_entries_total",
+            "Entries rejected by Loki and written to the dead letter",
+            lambda: self.dead_letter.dropped,
+        )
+        counter(
+            "es2loki_state_saves_total",
+            "Coalesced state checkpoints",
+            lambda: self.checkpointer.saves,
+        )
+        gauge(
+            "es2loki_loki_compression_ratio",
+            "Raw to encoded size of pushed batches",
+            lambda: self.loki_raw_bytes / (self.loki_encoded_bytes or 1),
+        )
+        gauge(
+            "es2loki_loki_pool_queue_size",
+            "Batches waiting for Loki push workers",
+            lambda: self.loki_pool.queue_size if self.loki_pool else 0,
+        )
+        gauge(
+            "es2loki_total_docs",
+            "Documents to transfer",
+            lambda: self.total_docs,
+        )
+        gauge(
+            "es2loki_speed_docs_per_second",
+            "Transfer speed over the last 10 seconds",
+            lambda: self._speed,
+        )
+        gauge(
+            "es2loki_lag_seconds",
+            "Time between the last saved document and ELASTIC_MAX_DATE (or now)",
+            self._lag,
+        )
+        if self.loki_rate_limiter is not None:
+            counter(
+                "es2loki_loki_throttled_seconds_total",
+                "Time spent waiting for the Loki rate limiter",
+                lambda: self.loki_rate_limiter.throttled_time,
+            )
+        if self.profiler is not None:
+            self.profiler.lag = registry.add(
+                Histogram("es2loki_event_loop_lag_seconds", "Event loop lag")
+            )
+            counter(
+                "es2loki_stage_seconds_total",
+                "Time spent in pipeline stages",
+                lambda: {(k,): v for k, v in self.profiler.snapshot().items()},
+                labelnames=("stage",),
+            )
+        if self.spool is not None:
+            gauge(
+                "es2loki_spool_bytes",
+                "Size of spooled Loki payloads on disk",
+                lambda: self.spool.size,
+            )
+            gauge(
+                "es2loki_spool_pending_records",
+                "Spooled Loki payloads not yet queued for push workers",
+                lambda: self.spool.pending,
+            )
+        if self.es_page_size is not None:
+            gauge(
+                "es2loki_es_page_size",
+                "Current ES page size",
+                lambda: self.es_page_size.size,
+            )
+            counter(
+                "es2loki_es_page_size_changes_total",
+                "ES page size changes",
+                lambda: {(k,): v for k, v in self.es_page_size.changes.items()},
+                labelnames=("reason",),
+            )
+        return registry
+
+    def _lag(self) -> float:
+        if self._acked_ts is None:
+            return 0
         if self.es_max_date:
-            query = {"range": {self.es_timestamp_field: {"lt": self.es_max_date}}}
-            body = {"query": query}
-        while self.is_running:
-            try:
-                return (await self.es.count(index=self.es_index, body=body))["count"]
-            except Exception as e:
-                self.logger.error("error retrieving total docs count: %s", e)
-                await asyncio.sleep(1.0)
+            until = self.ts_parser.parse(self.es_max_date)
+        else:
+            until = time.time_ns()
+        return max(0, until - self._acked_ts) / 1e9
 
-    async def execute(self):
-        self.loki_pool = AsyncPool(
-            num_workers=1,  # should not write to Loki in parallel
-            name="loki_pool",
-            logger=self.logger,
-            worker_co=self.send_to_loki,
-            load_factor=self.loki_pool_load_factor,
+    def make_state_store(self, name: str) -> StateStore:
+        if self.state_mode == "db":
+            # tortoise is imported only when it is used
+            from es2loki.state.db import DBStateStore
+
+            return DBStateStore(
+                name=name,
+                url=self.state_db_url,
+                dry_run=self.dry_run,
+                connection=self.shared.db if self.shared is not None else None,
+            )
+        if self.state_mode == "file":
+            return FileStateStore(
+                name=name,
+                directory=self.state_dir,
+                fsync_interval=self.state_fsync_interval,
+                dry_run=self.dry_run,
+            )
+        if self.state_mode == "none":
+            return DummyStateStore(
+                dry_run=self.dry_run,
+            )
+        raise ValueError("Unknown STATE_MODE. Possible values are: (db, file, none)")
+
+    def make_spool(self) -> Optional[Spool]:
+        if not self.spool_dir:
+            return None
+        return Spool(
+            directory=self.spool_dir,
+            segment_size=self.spool_segment_mb * 1024 * 1024,
+            max_size=self.spool_max_size_mb * 1024 * 1024,
+        )
+
+    def make_encode_executor(self) -> Optional[Executor]:
+        if self.loki_encode_executor == "thread":
+            return ThreadPoolExecutor(
+                max_workers=self.loki_encode_workers, thread_name_prefix="loki_encode"
+            )
+        if self.loki_encode_executor == "process":
+            return ProcessPoolExecutor(max_workers=self.loki_encode_workers)
+        if self.loki_encode_executor == "none":
+            return None
+        raise ValueError(
+            "Unknown LOKI_ENCODE_EXECUTOR. Possible values are: (none, thread, process)"
+        )
+
+    def make_transform_executor(self) -> Optional[Executor]:
+        if self.transform_workers <= 0:
+            return None
+        return ProcessPoolExecutor(
+            max_workers=self.transform_workers, initializer=init_worker
         )
 
+    async def warm_up(self):
+        """
+        Connects to ES and Loki ahead of the first search and push.
+        Errors are ignored here, the requests report and retry them anyway.
+        """
+        coros = [self.loki.warm_up()]
+        for es in (self.es, self.es_raw):
+            if es is not None:
+                coros.append(es.ping())
+        await asyncio.gather(*coros, return_exceptions=True)
+
+    async def load_state(self):
         await self.state_store.init(stop_event=self.stop_event)
         if self.stop_event.is_set():
             return
@@ -140,41 +642,240 @@ class BaseTransfer(Command):
             await self.state_store.cleanup()
 
         self._latest_state = await self.state_store.load()
+        if self.spool is not None:
+            loop = asyncio.get_running_loop()
+            if self.state_start_over:
+                await loop.run_in_executor(None, self.spool.purge)
+            last = await loop.run_in_executor(None, self.spool.open)
+            if last is not None:
+                # spooled batches are replayed, ES is read after the last of them
+                self._latest_state = State(
+                    timestamp=last["state"]["timestamp"],
+                    transferred=self.latest_state.transferred,
+                    value=last["state"]["value"],
+                )
         self.transferred_docs = self.latest_state.transferred
+        self._acked_docs = self.latest_state.transferred
+        self._acked_timestamp = self.latest_state.timestamp
         self.logger.info("starting from state %s", self.latest_state)
 
-        self.total_docs, _ = await wait_task(
-            self._get_total_docs(), event=self.stop_event
+    async def _get_total_docs(self) -> int:
+        """Counts documents to transfer according to ELASTIC_COUNT_MODE"""
+        if self.source_files:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, estimate_docs, self.make_source_files()
+            )
+
+        if self.es_count_mode == "stats":
+            # instant on any number of indices, but ELASTIC_MAX_DATE is ignored
+            stats = await self.es.indices.stats(index=self.es_index, metric="docs")
+            return stats["_all"]["primaries"]["docs"]["count"]
+
+        transferred = 0
+        ts_range = {}
+        if self.es_max_date:
+            ts_range["lt"] = self.es_max_date
+        if self.es_count_mode == "remaining" and self._acked_timestamp:
+            # only documents after the acknowledged ones are counted
+            transferred = self._acked_docs
+            ts_range["gte"] = self._acked_timestamp
+
+        body = None
+        if ts_range:
+            body = {"query": {"range": {self.es_timestamp_field: ts_range}}}
+        result = await self.es.count(index=self.es_index, body=body)
+        return transferred + result["count"]
+
+    async def _refresh_total_docs(self):
+        """
+        Counts documents in the background, so that the transfer is not
+        delayed, and refreshes the total every ELASTIC_COUNT_INTERVAL seconds
+        """
+        started = time.monotonic()
+        delay = 1.0
+        while self.is_running:
+            try:
+                total_docs = await self._get_total_docs()
+            except Exception as e:
+                self.logger.error("error retrieving total docs count: %s", e)
+                await wait_task(asyncio.sleep(delay), event=self.stop_event)
+                delay = min(delay * 2, 60)
+                continue
+
+            delay = 1.0
+            if started is not None:
+                self.startup.add("count", started)
+                started = None
+                self.total_docs = total_docs
+                self.logger.info(
+                    "progress: %d/%d (%.2f%%)",
+                    self.transferred_docs,
+                    self.total_docs,
+                    self._progress(),
+                )
+            elif total_docs != self.total_docs:
+                self.logger.info(
+                    "total docs changed from %d to %d", self.total_docs, total_docs
+                )
+                self.total_docs = total_docs
+
+            # files do not change during the transfer
+            if not self.es_count_interval or self.source_files:
+                return
+            await wait_task(
+                asyncio.sleep(self.es_count_interval), event=self.stop_event
+            )
+
+    def _progress(self) -> float:
+        """Percentage of transferred documents, 0 until they are counted"""
+        if not self.total_docs:
+            return 0.0
+        return min(100.0, self._done_docs / self.total_docs * 100)
+
+    @property
+    def _done_docs(self) -> int:
+        """Documents either transferred or dropped to the dead letter"""
+        return self.transferred_docs + self.dropped_docs
+
+    def get_printable_progress(self) -> str:
+        return (
+            f"{self.transferred_docs}/{self.total_docs} docs "
+            f"({self._progress():.2f}%) eta: {seconds_to_str(self._eta)} "
+            f"speed: {self._speed:.2f} docs/s"
+        )
+
+    async def execute(self):
+        try:
+            await self.transfer()
+        finally:
+            if self._warm_up is not None:
+                self._warm_up.cancel()
+            if self._scroller is not None:
+                # pages may still be fetched after an early exit or an error
+                await aclose(self._scroller)
+            for task in (self._eta_calc, self._total_docs_refresh):
+                if task is not None:
+                    task.cancel()
+            if self._spool_feeder is not None:
+                await cancel_and_wait(self._spool_feeder)
+            if self.spool is not None:
+                self.spool.close()
+            if self.metrics_server is not None:
+                await self.metrics_server.stop()
+            if self.profiler is not None:
+                await self.profiler.stop()
+            if self.transform_executor is not None and self.shared is None:
+                self.transform_executor.shutdown(wait=False, cancel_futures=True)
+            self.dead_letter.close()
+            # states acknowledged before a stop or an error are saved too
+            await self.checkpointer.close()
+            for store in self._state_stores:
+                await store.close()
+            self.startup.report(self.logger, "exit")
+
+    async def transfer(self):
+        self.loki_pool = AsyncPool(
+            num_workers=self.loki_push_workers,
+            name="loki_pool",
+            logger=self.logger,
+            worker_co=self.send_to_loki,
+            load_factor=self.loki_pool_load_factor,
+            # each stream is pushed by a single worker to keep its entries in order
+            partitioned=True,
+            on_complete=self.on_loki_jobs_complete,
         )
+
+        # connections are opened while the state is loaded
+        self._warm_up = asyncio.create_task(
+            self.startup.timed("connect", self.warm_up())
+        )
+        await self.startup.timed("state", self.load_state())
         if not self.is_running:
             return
 
-        if self.total_docs == 0:
-            self.logger.info("no docs found in es")
-            return
+        if self.es_window_interval and self.source_files:
+            raise ValueError("ELASTIC_WINDOW_INTERVAL cannot be used with SOURCE_FILES")
 
-        self.logger.info(
-            "progress: %d/%d (%.2f%%)",
-            self.transferred_docs,
-            self.total_docs,
-            self.transferred_docs / self.total_docs * 100,
-        )
+        if self.es_window_interval and self.spool is not None:
+            raise ValueError("ELASTIC_WINDOW_INTERVAL cannot be used with SPOOL_DIR")
+
+        if self.es_window_interval and self.es_count_mode == "remaining":
+            raise ValueError(
+                "ELASTIC_COUNT_MODE=remaining cannot be used with ELASTIC_WINDOW_INTERVAL"
+            )
+
+        if self.es_window_interval and not self.latest_state.iszero:
+            raise ValueError(
+                "ELASTIC_WINDOW_INTERVAL cannot be used to continue a transfer "
+                "which has been started without time windows"
+            )
+
+        # the transfer does not wait for documents to be counted
+        self._total_docs_refresh = asyncio.create_task(self._refresh_total_docs())
+        if not self.es_window_interval:
+            self._scroller = Prefetch(
+                self.make_es_scroller(),
+                wrap=lambda first: self.startup.timed("first_page", first),
+            )
 
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        if self.profiler is not None:
+            self.profiler.start(docs=lambda: self.transferred_docs)
+
+        self.transform_executor = self._get_shared(
+            "transform_executor", self.make_transform_executor
+        )
         self.loki_pool.start()
+        self.checkpointer.start()
         self._eta_calc = asyncio.create_task(self._calc_eta())
+        if self.spool is not None:
+            self._spool_feeder = asyncio.create_task(self._feed_from_spool())
 
-        await self.es_scroll()
+        if self.es_window_interval:
+            await self.es_scroll_windows()
+        else:
+            await self.es_scroll(self._scroller)
         self.logger.info("finished es_scroll")
 
         if self.is_running and self.loki_batch.total_docs > 0:
             self.logger.info("%d rows left in batch", self.loki_batch.total_docs)
             await self.flush_batch()
 
+        if self._spool_feeder is not None:
+            await self.spool.finish()
+            self.logger.info("waiting for %d spooled records", self.spool.pending)
+            await self._spool_feeder
+
         self.logger.info("waiting for loki pool to finish")
         await self.loki_pool.join()
 
+        # background tasks, the spool and the profiler are stopped by execute
         self.stop_event.set()
-        self._eta_calc.cancel()
+        if self._push_error is not None:
+            raise self._push_error
+
+        self.logger.info("es search: %s", self.es_stats.get_printable_stats())
+        if self.es_page_size is not None:
+            self.logger.info(
+                "es page size: %s", self.es_page_size.get_printable_stats()
+            )
+        if self.transform_workers <= 0:
+            # labels are interned by transform workers otherwise
+            self.logger.info("labels cache: %s", self.loki.labels.get_printable_stats())
+        if self.dead_letter.dropped:
+            self.logger.warning(
+                "%d entries rejected by loki were dropped", self.dead_letter.dropped
+            )
+
+        if self.encode_executor is not None:
+            if self.shared is None:
+                self.encode_executor.shutdown(wait=False)
+            self.logger.info(
+                "saved %.3fs of event loop time by encoding batches in %s executor",
+                self.loki.offloaded_encode_time,
+                self.loki_encode_executor,
+            )
 
     def make_es_sort(self) -> list:
         return [
@@ -182,64 +883,494 @@ class BaseTransfer(Command):
             {"log.offset": {"order": "asc"}},
         ]
 
-    def make_es_search_after(self) -> Optional[list]:
+    def make_es_search_after(self) -> Optional[Union[list, dict]]:
         state = self.latest_state
         if not state or state.iszero:
             return None
         return state.value
 
-    def make_es_scroller(self) -> AsyncIterable[tuple[dict, State]]:
-        return ElasticsearchScroller(
+    def make_es_source_includes(self) -> Optional[list[str]]:
+        """
+        Fields of _source to fetch. All fields by default. The timestamp and
+        sort fields are always fetched, as states are built from them.
+        """
+        if not self.es_source_includes:
+            return None
+        includes = self.es_source_includes.split(",")
+        for field in [self.es_timestamp_field, *sort_fields(self.make_es_sort())]:
+            if field not in includes:
+                includes.append(field)
+        return includes
+
+    def make_es_source_excludes(self) -> Optional[list[str]]:
+        """Fields of _source not to fetch"""
+        if not self.es_source_excludes:
+            return None
+        return self.es_source_excludes.split(",")
+
+    def make_es_filter_path(self) -> Optional[list[str]]:
+        """
+        filter_path of search requests. Override it if you need hit metadata
+        like `_index` or `_id` with ELASTIC_TRIM_RESPONSE enabled.
+        """
+        if not self.es_trim_response:
+            return None
+        return MINIMAL_FILTER_PATH
+
+    def make_es_raw_fields(self) -> list[str]:
+        """
+        Fields requested with ELASTIC_RAW_SOURCE enabled. Only these fields
+        are available in the source passed to extract_doc_ts and extract_doc_labels
+        """
+        fields = [self.es_timestamp_field]
+        if self.es_raw_fields:
+            fields.extend(self.es_raw_fields.split(","))
+        return fields
+
+    def make_es_page_size(self) -> Optional[PageSizeController]:
+        """
+        Returns a controller adapting ES page size or None to always request
+        ELASTIC_BATCH_SIZE documents
+        """
+        if not self.es_adaptive_batch_size:
+            return None
+
+        return PageSizeController(
+            size=self.es_batch_size,
+            min_size=self.es_min_batch_size,
+            max_size=self.es_max_batch_size,
+            target_latency=self.es_target_latency,
+            target_bytes=int(self.es_target_size_mb * 1024 * 1024),
+            max_memory=self.es_max_memory_mb * 1024 * 1024,
+        )
+
+    def _es_scroller_kwargs(self) -> dict:
+        return dict(
             es=self.es,
             es_index=self.es_index,
             es_batch_size=self.es_batch_size,
             stop_event=self.stop_event,
             es_timeout=self.es_timeout,
-            max_date=self.es_max_date,
             make_sort=self.make_es_sort,
-            make_search_after=self.make_es_search_after,
             timestamp_field=self.es_timestamp_field,
+            source_includes=self.make_es_source_includes(),
+            source_excludes=self.make_es_source_excludes(),
+            filter_path=self.make_es_filter_path(),
+            stats=self.es_stats,
+            raw_es=self.es_raw,
+            raw_fields=self.make_es_raw_fields() if self.es_raw_source else None,
+            page_size=self.es_page_size,
+            concurrency=self.shared.es_concurrency if self.shared else None,
+        )
+
+    def make_source_files(self) -> list[str]:
+        """Files to read documents from instead of ES"""
+        return expand_paths(self.source_files.split(","))
+
+    def make_es_scroller(self) -> AsyncIterable[tuple[dict, State]]:
+        if self.source_files:
+            return FileScroller(
+                paths=self.make_source_files(),
+                stop_event=self.stop_event,
+                timestamp_field=self.es_timestamp_field,
+                state=self.latest_state,
+                workers=self.source_files_workers,
+                serializer=self.serializer,
+                stats=self.es_stats,
+            )
+
+        if self.es_slices > 1:
+            return SlicedElasticsearchScroller(
+                max_date=self.es_max_date,
+                make_search_after=self.make_es_search_after,
+                slices=self.es_slices,
+                pit_keep_alive=self.es_pit_keep_alive,
+                **self._es_scroller_kwargs(),
+            )
+
+        return ElasticsearchScroller(
+            max_date=self.es_max_date,
+            make_search_after=self.make_es_search_after,
+            **self._es_scroller_kwargs(),
         )
 
-    async def es_scroll(self):
-        scroller = self.make_es_scroller()
+    async def es_scroll(
+        self, scroller: Optional[AsyncIterable[tuple[dict, State]]] = None
+    ):
+        if scroller is None:
+            scroller = self.make_es_scroller()
+
+        try:
+            if self.transform_executor is not None:
+                await self._es_scroll_parallel(scroller)
+                return
+
+            async for doc, state in scroller:
+                await self.process_es_doc(doc, state)
+        finally:
+            # cancels pages fetched in background and releases the
+            # point-in-time of a sliced scroll
+            await aclose(scroller)
+
+    async def es_scroll_windows(self):
+        windows = None
+        while self.is_running:
+            try:
+                windows, _ = await wait_task(
+                    make_time_windows(
+                        es=self.es,
+                        es_index=self.es_index,
+                        timestamp_field=self.es_timestamp_field,
+                        interval=self.es_window_interval,
+                        max_date=self.es_max_date,
+                        min_docs=self.es_window_min_docs,
+                        es_timeout=self.es_timeout,
+                    ),
+                    event=self.stop_event,
+                )
+                break
+            except Exception as e:
+                self.logger.error("error building time windows: %s", e)
+                await wait_task(asyncio.sleep(2), event=self.stop_event)
+        if not windows:
+            return
+
+        self.logger.info(
+            "transferring %d time windows, %d at once",
+            len(windows),
+            self.es_window_workers,
+        )
+
+        queue = collections.deque(windows)
+
+        async def window_worker():
+            while queue and self.is_running:
+                await self.transfer_window(queue.popleft())
+
+        await asyncio.gather(*(window_worker() for _ in range(self.es_window_workers)))
+
+    async def transfer_window(self, window: TimeWindow):
+        """
+        Transfers a single time window with its own scroller, batch and state.
+        Failed windows are retried from their latest saved state.
+        """
+        window.state_store = self.make_state_store(f"{self.es_index}@{window.name}")
+        self._state_stores.append(window.state_store)
+        if self.state_start_over:
+            await window.state_store.cleanup()
+
+        state = await window.state_store.load()
+        window.transferred = state.transferred
+        self.transferred_docs += state.transferred
+
+        while self.is_running:
+            try:
+                await self._transfer_window(window, state)
+                return
+            except Exception as e:
+                self.logger.exception(
+                    "error transferring window %s: %s", window.name, e
+                )
+                await wait_task(asyncio.sleep(2), event=self.stop_event)
+                state = await window.state_store.load()
+
+    async def _transfer_window(self, window: TimeWindow, state: State):
+        """
+        Scrolls the window through the same pipeline as the whole index
+        (process_es_doc or transform workers). `loki_batch` and `latest_state`
+        refer to the batch and the state of the window while it is scrolled.
+        """
+        scroller = ElasticsearchScroller(
+            min_date=window.start,
+            max_date=window.end,
+            make_search_after=lambda: None if state.iszero else state.value,
+            **self._es_scroller_kwargs(),
+        )
+
+        window.batch = self.loki.make_batch()
+        window.latest_state = state
+        window.flush_lock = asyncio.Lock()
+        token = _current_window.set(window)
+        try:
+            await self.es_scroll(scroller)
+            if self.is_running:
+                await self.flush_batch()
+                self.logger.info("finished window %s", window.name)
+        finally:
+            _current_window.reset(token)
+
+    async def _es_scroll_parallel(self, scroller: AsyncIterable[tuple[dict, State]]):
+        """
+        Sends pages of ES hits to transform worker processes and merges
+        the resulting stream chunks into the batch in the original order
+        """
+        loop = asyncio.get_running_loop()
+        batch_cls = type(self.loki_batch)
+        # workers may be shared by jobs, so each page names its job and
+        # carries the transfer, which is unpickled once per worker
+        job = self.es_index
+        transfer = pickle.dumps(self)
+        max_pending = 2 * self.transform_workers
+        pending = collections.deque()
+        page = []
+
+        def submit_page():
+            fut = loop.run_in_executor(
+                self.transform_executor, transform_hits, page, batch_cls, job, transfer
+            )
+            pending.append((fut, state))
+
+        async def process_oldest() -> bool:
+            fut, chunk_state = pending.popleft()
+            chunk, finished = await wait_task(fut, event=self.stop_event)
+            if finished:
+                return False
+            await self.process_es_chunk(chunk, chunk_state)
+            return True
+
         async for doc, state in scroller:
-            await self.process_es_doc(doc, state)
+            page.append(doc)
+            if len(page) < self.transform_page_size:
+                continue
+
+            submit_page()
+            page = []
+            if len(pending) >= max_pending and not await process_oldest():
+                return
+
+        if page and self.is_running:
+            submit_page()
+
+        while pending:
+            if not await process_oldest():
+                return
 
     async def process_es_doc(self, doc: dict, state: State):
-        source = doc["_source"]
-        if not source:
+        if not self.transform_doc(doc, self.loki_batch):
             return
 
+        self.latest_state = state
+        await self.flush_batch_if_full()
+
+    async def process_es_chunk(self, chunk: LokiBatch, state: State):
+        """
+        Merges a chunk made by a transform worker into the batch. The chunk is
+        cut so that pushed batches stay within LOKI_BATCH_SIZE, and batches
+        flushed in the middle of it are saved with the state of the previous chunk.
+        """
+        limit = self.loki.batch_size_limit
+        while self.loki_batch.total_size + chunk.total_size > limit and self.is_running:
+            head, chunk = chunk.cut(
+                limit - self.loki_batch.total_size,
+                min_docs=0 if self.loki_batch.total_docs else 1,
+            )
+            self.loki_batch.merge(head)
+            await self.renew_batch()
+
+        self.loki_batch.merge(chunk)
+        self.latest_state = state
+        await self.flush_batch_if_full()
+
+    def transform_doc(self, doc: dict, batch: LokiBatch) -> bool:
+        """
+        Converts ES document to a Loki entry and pushes it to the batch.
+        May run in a transform worker process when TRANSFORM_WORKERS > 0.
+        """
+        source = doc["_source"]
+        raw_source = doc.get(RAW_SOURCE_FIELD)
+        if not source and not raw_source:
+            return False
+
+        profiler = self.profiler
+        if profiler is not None:
+            started = time.perf_counter()
+
         timestamp = self.extract_doc_ts(source)
-        if not timestamp:
-            return
+        if profiler is not None:
+            started = profiler.lap("extract_doc_ts", started)
+        if timestamp is None:
+            return False
 
         labels = self.extract_doc_labels(source) or {}
-        self.enrich_labels(timestamp, labels)
-        entry = json.dumps(source, sort_keys=True)
+        if self._enrich_labels_wants_datetime and timestamp.__class__ is int:
+            # overridden enrich_labels from before nanosecond timestamps
+            self.enrich_labels(ns_to_datetime(timestamp), labels)
+        else:
+            self.enrich_labels(timestamp, labels)
+        if profiler is not None:
+            started = profiler.lap("extract_doc_labels", started)
 
-        self.loki_batch.push(labels=labels, timestamp=timestamp, entry=entry)
-        self._latest_state = state
+        if raw_source:
+            entry = raw_source
+        else:
+            entry = self.serializer.dumps(source)
+        if profiler is not None:
+            started = profiler.lap("encode_line", started)
 
-        if self.loki_batch.total_size >= self.loki_batch_size:
-            async with self._flush_lock:
-                await self.flush_batch()
-                self.loki_batch = LokiBatch()
+        batch.push(labels=labels, timestamp=timestamp, entry=entry)
+        if profiler is not None:
+            profiler.lap("batch_push", started)
+        return True
+
+    async def flush_batch_if_full(self):
+        if self.loki_batch.total_size >= self.loki.batch_size_limit:
+            await self.renew_batch()
+
+    async def renew_batch(self):
+        """Pushes the batch and starts a new one"""
+        window = _current_window.get()
+        lock = self._flush_lock if window is None else window.flush_lock
+        async with lock:
+            await self.flush_batch()
+            self.loki_batch = self.loki.make_batch()
 
     async def flush_batch(self):
-        if not self.loki_batch.total_docs:
+        await self.push_batch(self.loki_batch, self.latest_state, _current_window.get())
+
+    async def push_batch(
+        self, batch: LokiBatch, state: State, window: Optional[TimeWindow] = None
+    ):
+        """
+        Splits the batch between Loki push workers by streams and queues it.
+        The state is saved once all parts of this and all previous batches are
+        acknowledged by Loki (see on_loki_jobs_complete).
+        """
+        if not batch.total_docs:
             return
 
-        await wait_task(
-            self.loki_pool.push(self.loki_batch, self.latest_state),
-            event=self.stop_event,
-        )
+        parts = batch.split(self.loki_push_workers)
+        if self.spool is not None:
+            await self.spool_batch(batch, parts, state)
+            return
+
+        job = self.loki_pool.new_job(len(parts))
+        self._pending_jobs[job] = (state, batch.total_docs, window)
+
+        for worker, part in parts:
+            data = self.loki.encode(part)
+            _, finished = await wait_task(
+                self.loki_pool.push(part, state, data, partition=worker, job=job),
+                event=self.stop_event,
+            )
+            if finished:
+                return
+
+    async def spool_batch(
+        self, batch: LokiBatch, parts: list[tuple[int, LokiBatch]], state: State
+    ):
+        """Appends encoded parts of the batch to the spool instead of the pool"""
+        await self.spool.wait_for_space(self.stop_event)
+        if not self.is_running:
+            return
+
+        for i, (worker, part) in enumerate(parts):
+            data = await self.loki.encode(part)
+            meta = {
+                "part": i,
+                "parts": len(parts),
+                "partition": worker,
+                "docs": batch.total_docs,
+                "lines": part.total_docs,
+                "size": part.total_size,
+                "streams": part.streams_count,
+                "state": {"timestamp": state.timestamp, "value": state.value},
+            }
+            await self.spool.append(meta, data)
 
-    async def send_to_loki(self, batch: LokiBatch, state: State):
-        _, transferred_size = await self.loki.push(batch, stop_event=self.stop_event)
+    async def _feed_from_spool(self):
+        """Pushes spooled parts to the pool as fast as Loki accepts them"""
+        job = None
+        while True:
+            record = await self.spool.read(self.stop_event)
+            if record is None:
+                return
+
+            meta, data, segment = record
+            state = State(**meta["state"])
+            if meta["part"] == 0:
+                job = self.loki_pool.new_job(meta["parts"])
+                self._pending_jobs[job] = (state, meta["docs"], None)
+            self.spool.mark(segment, job)
+
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result(data)
+            _, finished = await wait_task(
+                self.loki_pool.push(
+                    SpooledBatch(meta),
+                    state,
+                    fut,
+                    partition=meta["partition"],
+                    job=job,
+                ),
+                event=self.stop_event,
+            )
+            if finished:
+                return
+
+    async def on_loki_jobs_complete(self, watermark: int):
+        """
+        Hands states of the acknowledged jobs to the checkpointer, which
+        saves them in the background without holding push workers
+        """
+        for job in list(self._pending_jobs):
+            if job > watermark:
+                break
+
+            state, docs, window = self._pending_jobs.pop(job)
+            if window is None:
+                self._acked_docs += docs
+                self._acked_timestamp = state.timestamp
+                self.checkpointer.add(
+                    None, self.state_store, state, self._acked_docs, watermark
+                )
+            else:
+                window.transferred += docs
+                self.checkpointer.add(
+                    window, window.state_store, state, window.transferred, watermark
+                )
+
+    def on_states_saved(self, watermark: int, states: dict):
+        saved = states.get(None)
+        if saved is not None:
+            _, state, _ = saved
+            if state.timestamp:
+                self._acked_ts = self.ts_parser.parse(state.timestamp)
 
-        self.transferred_docs += batch.total_docs
+        if self.spool is not None:
+            # spooled payloads are not needed once their state is saved
+            self.spool.release(watermark)
+
+    async def send_to_loki(
+        self,
+        batch: LokiBatch,
+        state: State,
+        data: Optional[Awaitable[bytes]] = None,
+    ):
+        dropped = 0
+
+        def on_dropped(n: int):
+            nonlocal dropped
+            dropped += n
+
+        try:
+            _, transferred_size = await self.loki.push(
+                batch, stop_event=self.stop_event, data=data, on_dropped=on_dropped
+            )
+        except Exception as e:
+            # the state is not saved past this batch, so stop and let it be retried
+            self.logger.error("loki push failed, stopping: %r", e)
+            self._push_error = e
+            self.stop_event.set()
+            raise
+
+        self.startup.report(self.logger, "the first push")
+        # entries dropped to the dead letter are done, but not transferred
+        self.transferred_docs += batch.total_docs - dropped
+        self.dropped_docs += dropped
+        self.loki_raw_bytes += batch.total_size
+        self.loki_encoded_bytes += transferred_size
+        if self.loki_batch_streams is not None:
+            self.loki_batch_streams.observe(batch.streams_count)
         self.logger.info(
             "transferred %d streams of %s (enc: %s). total: %d/%d docs (%.2f%%) eta: %s speed: %.2f docs/s",
             batch.streams_count,
@@ -247,11 +1378,10 @@ class BaseTransfer(Command):
             size_str(transferred_size),
             self.transferred_docs,
             self.total_docs,
-            self.transferred_docs / self.total_docs * 100,
+            self._progress(),
             seconds_to_str(self._eta),
             self._speed,
         )
-        await self.state_store.save(state, self.transferred_docs)
 
         if self.loki_wait_timeout:
             await wait_task(
@@ -261,24 +1391,32 @@ class BaseTransfer(Command):
     def extract_doc_labels(self, source: dict) -> Optional[MutableMapping[str, str]]:
         return {}
 
-    def extract_doc_ts(self, source: dict) -> Optional[datetime.datetime]:
+    def extract_doc_ts(self, source: dict) -> Optional[Union[datetime.datetime, int]]:
+        """
+        Returns document timestamp either as a datetime or as integer
+        nanoseconds since epoch (the default, which keeps full precision)
+        """
         timestamp_val = source.get(self.es_timestamp_field)
         if not timestamp_val:
             return None
 
-        iso_dt = timestamp_val.rstrip("Z")
-        return datetime.datetime.fromisoformat(iso_dt)
+        return self.ts_parser.parse(timestamp_val)
 
     def enrich_labels(
-        self, timestamp: datetime.datetime, labels: MutableMapping[str, str]
+        self,
+        timestamp: Union[datetime.datetime, int],
+        labels: MutableMapping[str, str],
     ):
         labels["imported"] = "yes"
-        labels["import_month"] = timestamp.strftime("%Y%m")
+        if timestamp.__class__ is int:
+            labels["import_month"] = self.ts_parser.month(timestamp)
+        else:
+            labels["import_month"] = f"{timestamp.year:04d}{timestamp.month:02d}"
 
     async def _calc_eta(self):
         while self.is_running:
             last_ts = time.monotonic()
-            last_transferred_value = self.transferred_docs
+            last_transferred_value = self._done_docs
 
             _, finished = await wait_task(asyncio.sleep(10), event=self.stop_event)
             if finished:
@@ -286,17 +1424,14 @@ class BaseTransfer(Command):
 
             now = time.monotonic()
             time_delta = now - last_ts
-            docs_added = self.transferred_docs - last_transferred_value
+            docs_added = self._done_docs - last_transferred_value
 
             self._speed = docs_added / time_delta
-            self._eta = (
-                (self.total_docs - self.transferred_docs) / self._speed
-                if self._speed > 0
-                else 0
-            )
+            remaining = max(0, self.total_docs - self._done_docs)
+            self._eta = remaining / self._speed if self._speed > 0 else 0
 
 
-def run_transfer(cmd: BaseTransfer, setup_logging: bool = True) -> int:
+def run_transfer(cmd: Command, setup_logging: bool = True) -> int:
     if setup_logging:
         logging.basicConfig(
             format="%(created)f %(asctime)s.%(msecs)03d [%(name)s] %(levelname)s: %(message)s",
@@ -0,0 +1,71 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetter:
+    """
+    Keeps entries permanently rejected by Loki. They are appended to `path`
+    as JSON lines or only logged when no path is given. Once `max_entries`
+    entries are dropped the dead letter is full and rejections stop the transfer.
+    The file is written by a thread, so that the event loop is not blocked.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 1000):
+        self.path = path
+        self.max_entries = max_entries
+        self.dropped = 0
+        # made on the first rejection, which most transfers never have
+        self._writer: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def full(self) -> bool:
+        return self.dropped >= self.max_entries
+
+    async def write(self, batch, status: int, error: str):
+        records = [
+            {
+                "labels": labels.labels,
+                "timestamp": timestamp,
+                "line": line,
+                "status": status,
+                "error": error,
+            }
+            for labels, timestamp, line in batch.iter_entries()
+        ]
+        self.dropped += len(records)
+
+        if not self.path:
+            for record in records:
+                logger.error("dropped loki entry: %s", record)
+            return
+
+        if self._writer is None:
+            self._writer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="dead_letter"
+            )
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._writer, self._append, records)
+        logger.error(
+            "dropped %d loki entries rejected with %d (%s) to %s",
+            len(records),
+            status,
+            error,
+            self.path,
+        )
+
+    def _append(self, records: list[dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+
+    def close(self):
+        # waits for the writes in progress
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
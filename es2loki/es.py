@@ -1,27 +1,150 @@
 import asyncio
 import collections
+import datetime
+import json
 import logging
+import time
 from collections.abc import AsyncIterable
-from typing import Callable, Optional
-
-from elasticsearch import AsyncElasticsearch
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional, Union
 
 from es2loki.aio import wait_task
+from es2loki.aio.tasks import cancel_and_wait
+from es2loki.metrics import Histogram
+from es2loki.page_size import PageSizeController
+from es2loki.raw import parse_raw_response
+from es2loki.state import StateStore
 from es2loki.state.types import State
+from es2loki.utils import interval_to_ms, size_str
+
+if TYPE_CHECKING:
+    # imported by the ES client itself, so that reading files does not load it
+    from elasticsearch import AsyncElasticsearch
+
+    from es2loki.loki import LokiBatch
+
+
+def make_range_query(
+    timestamp_field: str, min_date: Optional[str], max_date: Optional[str]
+) -> Optional[dict]:
+    date_range = {}
+    if min_date:
+        date_range["gte"] = min_date
+    if max_date:
+        date_range["lt"] = max_date
+    if not date_range:
+        return None
+    return {"range": {timestamp_field: date_range}}
+
+
+# the largest `_shard_doc` value, sorts after every document with the same
+# values of the other sort fields
+MAX_SHARD_DOC = 2**63 - 1
+
+# the only parts of a search response used by the scroller
+MINIMAL_FILTER_PATH = [
+    "hits.hits._source",
+    "hits.hits.sort",
+    "hits.hits.fields",
+    "_shards",
+    "timed_out",
+    "error",
+    "pit_id",
+]
+
+
+def sort_fields(sort: list) -> list[str]:
+    """Names of the document fields of an ES sort, without `_doc`, `_shard_doc`, ..."""
+    fields = []
+    for item in sort:
+        name = item if isinstance(item, str) else next(iter(item))
+        if not name.startswith("_"):
+            fields.append(name)
+    return fields
+
+
+def is_pit_missing(error: Union[Exception, dict]) -> bool:
+    """
+    Tells whether a search error (an exception or a shard failure) is caused
+    by a point-in-time which has expired or has been closed
+    """
+    if isinstance(error, dict):
+        return "search_context_missing_exception" in json.dumps(error)
+    from elasticsearch import ApiError
+
+    return (
+        isinstance(error, ApiError)
+        and error.status_code == 404
+        and "search_context_missing_exception" in f"{error} {error.body}"
+    )
+
+
+def response_size(result) -> int:
+    """Size of the response body in bytes or 0 if unknown"""
+    meta = getattr(result, "meta", None)
+    if meta is None:
+        return 0
+    return int(meta.headers.get("content-length", 0))
+
+
+@dataclass
+class SearchStats:
+    requests: int = 0
+    docs: int = 0
+    bytes: int = 0
+    duration: float = 0.0
+    # wall time of search calls including decoding of responses
+    elapsed: float = 0.0
+    latency: Optional[Histogram] = None
+
+    def add(self, result, docs: int, elapsed: float = 0.0):
+        self.requests += 1
+        self.docs += docs
+        self.elapsed += elapsed
+
+        meta = getattr(result, "meta", None)
+        if meta is not None:
+            self.duration += meta.duration
+            self.bytes += response_size(result)
+            if self.latency is not None:
+                self.latency.observe(meta.duration)
+
+    @property
+    def bytes_per_doc(self) -> float:
+        return self.bytes / self.docs if self.docs else 0.0
+
+    def get_printable_stats(self) -> str:
+        return (
+            f"requests: {self.requests} docs: {self.docs} "
+            f"received: {size_str(self.bytes)} ({self.bytes_per_doc:.1f} bytes/doc) "
+            f"search time: {self.duration:.3f}s"
+        )
 
 
 class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
     def __init__(
         self,
-        es: AsyncElasticsearch,
+        es: "AsyncElasticsearch",
         es_index: str,
         es_batch_size: int,
         stop_event: asyncio.Event,
         make_sort: Callable[[], list],
-        make_search_after: Callable[[], Optional[list]],
+        make_search_after: Callable[[], Optional[Union[list, dict]]],
         timestamp_field: str,
         max_date: Optional[str] = None,
         es_timeout: int = 120,
+        min_date: Optional[str] = None,
+        pit: Optional[dict] = None,
+        slice_: Optional[dict] = None,
+        source_includes: Optional[list[str]] = None,
+        source_excludes: Optional[list[str]] = None,
+        filter_path: Optional[list[str]] = None,
+        stats: Optional[SearchStats] = None,
+        raw_es: Optional["AsyncElasticsearch"] = None,
+        raw_fields: Optional[list[str]] = None,
+        page_size: Optional[PageSizeController] = None,
+        concurrency: Optional[asyncio.Semaphore] = None,
+        reopen_pit: Optional[Callable[[dict], Awaitable[Optional[dict]]]] = None,
     ):
         self.es = es
         self.es_index = es_index
@@ -29,10 +152,30 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
         self.es_timeout = es_timeout
         self.stop_event = stop_event
         self._max_date = max_date
+        self._min_date = min_date
         self._timestamp_field = timestamp_field
 
         self._sort = make_sort()
         self._search_after = make_search_after()
+        if isinstance(self._search_after, dict):
+            raise ValueError(
+                "state has been saved by a sliced scroll with %d slices"
+                % len(self._search_after.get("slices", []))
+            )
+
+        self._pit = pit
+        # called with the expired point-in-time, returns a new one
+        self._reopen_pit = reopen_pit
+        self._slice = slice_
+        self._source_includes = source_includes
+        self._source_excludes = source_excludes
+        self._filter_path = filter_path
+        self.stats = stats or SearchStats()
+        self._raw_es = raw_es
+        self._raw_fields = raw_fields
+        self._page_size = page_size
+        # limits concurrent searches, e.g. of all jobs of an orchestrator
+        self._concurrency = concurrency
 
         self.logger = logging.getLogger("es_scroller")
         self._buffer = collections.deque()
@@ -64,7 +207,7 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
 
         if (
             self._buffer_refill_coro is None
-            and len(self._buffer) < 2 * self.es_batch_size // 3
+            and len(self._buffer) < 2 * self.page_size // 3
         ):
             self._refill_buffer_bg()
 
@@ -74,6 +217,22 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
             value=doc["sort"],
         )
 
+    @property
+    def pit(self) -> Optional[dict]:
+        return self._pit
+
+    @property
+    def page_size(self) -> int:
+        if self._page_size is None:
+            return self.es_batch_size
+        return self._page_size.size
+
+    def prefetch(self) -> bool:
+        """Starts fetching the next page in background"""
+        if len(self._buffer) > 0:
+            return False
+        return self._refill_buffer_bg()
+
     def _refill_buffer_bg(self) -> bool:
         if not self.is_running:
             return False
@@ -94,24 +253,79 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
         self._buffer_refill_coro.add_done_callback(on_done)
         return True
 
+    async def aclose(self):
+        """Cancels fetching of the next page in background"""
+        task, self._buffer_refill_coro = self._buffer_refill_coro, None
+        if task is not None and not task.done():
+            await cancel_and_wait(task)
+
+    async def _search(self, **kwargs):
+        if self._concurrency is None:
+            return await self._do_search(**kwargs)
+        async with self._concurrency:
+            return await self._do_search(**kwargs)
+
+    @property
+    def _hit_sort_size(self) -> int:
+        """
+        Number of sort values of a hit. Searches over a point-in-time get
+        an implicit `_shard_doc` tiebreaker unless the sort has one.
+        """
+        size = len(self._sort)
+        if self._pit is not None and not any("_shard_doc" in s for s in self._sort):
+            size += 1
+        return size
+
+    async def _do_search(self, **kwargs):
+        if self._raw_es is None:
+            return await self.es.search(**kwargs)
+
+        if self._raw_fields:
+            kwargs["fields"] = self._raw_fields
+        response = await self._raw_es.search(**kwargs)
+        try:
+            body = parse_raw_response(
+                response.body, self._hit_sort_size, with_fields=bool(self._raw_fields)
+            )
+        except ValueError as e:
+            self.logger.warning("falling back to decoding sources: %s", e)
+            body = json.loads(response.body)
+        from elastic_transport import ObjectApiResponse
+
+        return ObjectApiResponse(body=body, meta=response.meta)
+
     async def _refill_buffer(self):
         async with self._buffer_lock:
             result = None
             while self.is_running:
                 try:
-                    query = None
-                    if self._max_date:
-                        query = {
-                            "range": {self._timestamp_field: {"lt": self._max_date}}
-                        }
+                    query = make_range_query(
+                        self._timestamp_field, self._min_date, self._max_date
+                    )
+                    kwargs = {}
+                    if self._pit is not None:
+                        kwargs["pit"] = self._pit
+                        if self._slice is not None:
+                            kwargs["slice"] = self._slice
+                    else:
+                        kwargs["index"] = self.es_index
+                    if self._source_includes:
+                        kwargs["source_includes"] = self._source_includes
+                    if self._source_excludes:
+                        kwargs["source_excludes"] = self._source_excludes
+                    if self._filter_path:
+                        kwargs["filter_path"] = self._filter_path
+
+                    page_size = self.page_size
+                    started = time.monotonic()
                     result, finished = await wait_task(
-                        self.es.search(
-                            index=self.es_index,
-                            size=self.es_batch_size,
+                        self._search(
+                            size=page_size,
                             query=query,
                             search_after=self._search_after,
                             sort=self._sort,
                             request_timeout=self.es_timeout,
+                            **kwargs,
                         ),
                         event=self.stop_event,
                     )
@@ -134,6 +348,8 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
                             self.es_index,
                             self._search_after,
                         )
+                        if self._page_size is not None:
+                            self._page_size.on_timeout()
                         await wait_task(asyncio.sleep(2), event=self.stop_event)
                         continue
 
@@ -151,10 +367,15 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
                             self.es_index,
                             self._search_after,
                         )
+                        if self._page_size is not None:
+                            self._page_size.on_partial_shards()
                         await wait_task(asyncio.sleep(2), event=self.stop_event)
                         continue
 
                     failures = shards.get("failures", [])
+                    if failures and any(is_pit_missing(f) for f in failures):
+                        await self._on_pit_missing(failures)
+                        continue
                     if failures:
                         self.logger.error(
                             "got failures for index=%s search_after=%s: %s",
@@ -162,20 +383,345 @@ class ElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
                             self._search_after,
                             failures,
                         )
+                        if self._page_size is not None:
+                            self._page_size.on_partial_shards()
                         await wait_task(asyncio.sleep(2), event=self.stop_event)
                         continue
                     break
                 except Exception as e:
+                    if is_pit_missing(e):
+                        await self._on_pit_missing(e)
+                        continue
                     self.logger.exception(e)
+                    if self._page_size is not None:
+                        from elastic_transport import ConnectionTimeout
+                        from elasticsearch import ApiError
+
+                        if isinstance(e, ConnectionTimeout):
+                            self._page_size.on_timeout()
+                        elif isinstance(e, ApiError) and e.status_code == 429:
+                            self._page_size.on_rejected()
                     await wait_task(asyncio.sleep(2), event=self.stop_event)
                     continue
 
             if not result:
                 return
 
+            if self._pit is not None and result.get("pit_id"):
+                self._pit = {**self._pit, "id": result["pit_id"]}
+
             hits = result.get("hits", {}).get("hits", [])
+            latency = time.monotonic() - started
+            self.stats.add(result, len(hits), latency)
+            if self._page_size is not None and page_size == self._page_size.size:
+                self._page_size.on_success(
+                    docs=len(hits),
+                    latency=latency,
+                    nbytes=response_size(result),
+                )
             if not hits:
                 return
 
             self._buffer.extend(hits)
             self._search_after = hits[-1]["sort"]
+
+    async def _on_pit_missing(self, error):
+        if self._reopen_pit is None:
+            raise RuntimeError(f"point-in-time has expired: {error}")
+        self.logger.warning(
+            "point-in-time has expired, reopening it. search_after=%s",
+            self._search_after,
+        )
+        pit = await self._reopen_pit(self._pit)
+        if pit is not None:
+            self._pit = pit
+
+
+class SlicedElasticsearchScroller(AsyncIterable[tuple[dict, State]]):
+    """
+    Reads the index through a point-in-time with `slices` concurrent sliced
+    `search_after` cursors. Yielded states contain positions of all slices:
+    `{"slices": [search_after_0, search_after_1, ...]}`, so that a restart
+    resumes every slice exactly where it has stopped.
+    """
+
+    def __init__(
+        self,
+        es: "AsyncElasticsearch",
+        es_index: str,
+        es_batch_size: int,
+        stop_event: asyncio.Event,
+        make_sort: Callable[[], list],
+        make_search_after: Callable[[], Optional[Union[list, dict]]],
+        timestamp_field: str,
+        slices: int,
+        max_date: Optional[str] = None,
+        es_timeout: int = 120,
+        pit_keep_alive: str = "5m",
+        source_includes: Optional[list[str]] = None,
+        source_excludes: Optional[list[str]] = None,
+        filter_path: Optional[list[str]] = None,
+        stats: Optional[SearchStats] = None,
+        raw_es: Optional["AsyncElasticsearch"] = None,
+        raw_fields: Optional[list[str]] = None,
+        page_size: Optional[PageSizeController] = None,
+        concurrency: Optional[asyncio.Semaphore] = None,
+    ):
+        self.es = es
+        self.es_index = es_index
+        self.es_batch_size = es_batch_size
+        self.es_timeout = es_timeout
+        self.stop_event = stop_event
+        self.slices = slices
+        self.pit_keep_alive = pit_keep_alive
+        self._max_date = max_date
+        self._timestamp_field = timestamp_field
+        self._make_sort = make_sort
+        self._cursors = self._initial_cursors(make_search_after())
+        self._source_includes = source_includes
+        self._source_excludes = source_excludes
+        self._filter_path = filter_path
+        self.stats = stats or SearchStats()
+        self._raw_es = raw_es
+        self._raw_fields = raw_fields
+        self._page_size = page_size
+        self._concurrency = concurrency
+
+        self.logger = logging.getLogger("es_sliced_scroller")
+        self._scrollers: list[Optional[ElasticsearchScroller]] = []
+        self._current = 0
+        self._pit_id = None
+        self._pit_lock = asyncio.Lock()
+        self._expired_pits: set[str] = set()
+
+    def _initial_cursors(self, search_after: Optional[Union[list, dict]]) -> list:
+        if search_after is None:
+            return [None] * self.slices
+
+        if isinstance(search_after, dict):
+            cursors = search_after.get("slices", [])
+            if len(cursors) != self.slices:
+                raise ValueError(
+                    f"state has been saved with {len(cursors)} slices, "
+                    f"but {self.slices} are configured"
+                )
+            return list(cursors)
+
+        # state of a non-sliced scroll: continue every slice after it. Slices
+        # search over a point-in-time, which adds a `_shard_doc` tiebreaker
+        # to the sort, so the largest tiebreaker value skips the documents
+        # with the saved sort values as the non-sliced scroll would
+        sort = self._make_sort()
+        if len(search_after) == len(sort) and not any("_shard_doc" in s for s in sort):
+            search_after = [*search_after, MAX_SHARD_DOC]
+        return [search_after] * self.slices
+
+    @property
+    def is_running(self) -> bool:
+        return not self.stop_event.is_set()
+
+    def __aiter__(self):
+        return self
+
+    async def _open_pit(self) -> bool:
+        while self.is_running:
+            try:
+                result, finished = await wait_task(
+                    self.es.open_point_in_time(
+                        index=self.es_index, keep_alive=self.pit_keep_alive
+                    ),
+                    event=self.stop_event,
+                )
+                if finished:
+                    return False
+                self._pit_id = result["id"]
+                return True
+            except Exception as e:
+                self.logger.error("error opening point-in-time: %s", e)
+                await wait_task(asyncio.sleep(2), event=self.stop_event)
+        return False
+
+    async def _reopen_pit(self, expired: dict) -> Optional[dict]:
+        """
+        Opens a new point-in-time for all slices once the current one has
+        expired (e.g. the transfer has waited for Loki longer than its
+        keep alive). Slices continue from their search_after positions.
+        """
+        async with self._pit_lock:
+            expired_id = expired.get("id")
+            if expired_id == self._pit_id or expired_id not in self._expired_pits:
+                # not reopened yet by another slice
+                self._expired_pits.update((expired_id, self._pit_id))
+                if not await self._open_pit():
+                    return None
+            return {"id": self._pit_id, "keep_alive": self.pit_keep_alive}
+
+    async def _open(self):
+        if not await self._open_pit():
+            return
+
+        pit = {"id": self._pit_id, "keep_alive": self.pit_keep_alive}
+        for slice_id in range(self.slices):
+            scroller = ElasticsearchScroller(
+                es=self.es,
+                es_index=self.es_index,
+                es_batch_size=self.es_batch_size,
+                stop_event=self.stop_event,
+                make_sort=self._make_sort,
+                make_search_after=lambda i=slice_id: self._cursors[i],
+                timestamp_field=self._timestamp_field,
+                max_date=self._max_date,
+                es_timeout=self.es_timeout,
+                pit=pit,
+                slice_={"id": slice_id, "max": self.slices},
+                source_includes=self._source_includes,
+                source_excludes=self._source_excludes,
+                filter_path=self._filter_path,
+                stats=self.stats,
+                raw_es=self._raw_es,
+                raw_fields=self._raw_fields,
+                page_size=self._page_size,
+                concurrency=self._concurrency,
+                reopen_pit=self._reopen_pit,
+            )
+            scroller.prefetch()
+            self._scrollers.append(scroller)
+
+        self.logger.info(
+            "opened point-in-time for index=%s with %d slices",
+            self.es_index,
+            self.slices,
+        )
+
+    async def aclose(self):
+        """Closes the point-in-time, also when the scroll has been stopped"""
+        for scroller in self._scrollers:
+            if scroller is not None:
+                await scroller.aclose()
+        if self._pit_id is None:
+            return
+        pit_id, self._pit_id = self._pit_id, None
+        try:
+            await self.es.close_point_in_time(id=pit_id)
+        except Exception as e:
+            self.logger.warning("error closing point-in-time: %s", e)
+
+    async def __anext__(self) -> tuple[dict, State]:
+        if not self.is_running:
+            await self.aclose()
+            raise StopAsyncIteration()
+
+        if not self._scrollers:
+            await self._open()
+            if not self._scrollers:
+                raise StopAsyncIteration()
+
+        # round-robin over slices that still have documents
+        while any(s is not None for s in self._scrollers):
+            slice_id = self._current
+            self._current = (self._current + 1) % self.slices
+
+            scroller = self._scrollers[slice_id]
+            if scroller is None:
+                continue
+
+            try:
+                doc, _ = await scroller.__anext__()
+            except StopAsyncIteration:
+                if not self.is_running:
+                    raise
+                if scroller.pit:
+                    self._pit_id = scroller.pit["id"]
+                self._scrollers[slice_id] = None
+                continue
+
+            self._cursors[slice_id] = doc["sort"]
+            return doc, State(
+                timestamp=doc.get("_source", {}).get(self._timestamp_field),
+                value={"slices": list(self._cursors)},
+            )
+
+        await self.aclose()
+        raise StopAsyncIteration()
+
+
+@dataclass(eq=False)
+class TimeWindow:
+    """
+    A `[start, end)` range of the timestamp field that is transferred
+    with its own scroller and its own persisted state.
+    """
+
+    start: str
+    end: Optional[str]
+    docs: int = 0
+
+    state_store: Optional[StateStore] = None
+    transferred: int = 0
+    # the batch being filled and the state of its latest document
+    batch: Optional["LokiBatch"] = None
+    latest_state: Optional[State] = None
+    flush_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def name(self) -> str:
+        return f"{self.start}..{self.end or ''}"
+
+
+async def make_time_windows(
+    es: "AsyncElasticsearch",
+    es_index: str,
+    timestamp_field: str,
+    interval: str,
+    max_date: Optional[str] = None,
+    min_docs: int = 0,
+    es_timeout: int = 120,
+) -> list[TimeWindow]:
+    """
+    Splits `[min(timestamp_field), max_date)` into windows of `interval`
+    (ES fixed_interval, e.g. `1d` or `6h`) using a date_histogram. Empty
+    intervals are skipped. Consecutive intervals are joined until a window
+    has at least `min_docs` documents.
+    """
+    result = await es.search(
+        index=es_index,
+        size=0,
+        query=make_range_query(timestamp_field, None, max_date),
+        aggs={
+            "windows": {
+                "date_histogram": {
+                    "field": timestamp_field,
+                    "fixed_interval": interval,
+                    "min_doc_count": 1,
+                }
+            }
+        },
+        request_timeout=es_timeout,
+    )
+    buckets = result.get("aggregations", {}).get("windows", {}).get("buckets", [])
+
+    interval_ms = interval_to_ms(interval)
+    windows: list[TimeWindow] = []
+    for bucket in buckets:
+        start, end = bucket["key"], bucket["key"] + interval_ms
+        last = windows[-1] if windows else None
+        if last is not None and last.docs < min_docs and last.end == _ms_to_iso(start):
+            last.end = _ms_to_iso(end)
+            last.docs += bucket["doc_count"]
+            continue
+
+        windows.append(
+            TimeWindow(
+                start=_ms_to_iso(start), end=_ms_to_iso(end), docs=bucket["doc_count"]
+            )
+        )
+
+    if windows:
+        # documents newer than the histogram belong to the last window
+        windows[-1].end = max_date
+    return windows
+
+
+def _ms_to_iso(ms: int) -> str:
+    dt = datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+    return dt.isoformat()
@@ -0,0 +1,279 @@
+import asyncio
+import collections
+import glob
+import gzip
+import io
+import logging
+import os
+import time
+from collections.abc import AsyncIterable
+from typing import BinaryIO, Optional
+
+from es2loki.aio import wait_task
+from es2loki.es import SearchStats
+from es2loki.serializers import JsonSerializer, make_serializer
+from es2loki.state import State
+
+# [byte offset of the next line, hits of that line already read]
+Position = list[int]
+# offset of a file which has been read completely
+DONE = -1
+
+
+def expand_paths(patterns: list[str]) -> list[str]:
+    paths = set()
+    for pattern in patterns:
+        matched = glob.glob(pattern)
+        if not matched:
+            raise ValueError(f"no files match {pattern}")
+        paths.update(matched)
+    return sorted(paths)
+
+
+def open_file(path: str) -> BinaryIO:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb", buffering=1024 * 1024)
+
+
+def line_hits(obj: dict) -> list[dict]:
+    """
+    Returns ES hits of a line: the hit itself (elasticdump), hits of a search
+    response or a bare document which becomes _source of a hit
+    """
+    if "_source" in obj:
+        return [obj]
+    hits = obj.get("hits")
+    if isinstance(hits, dict):
+        return hits.get("hits", [])
+    return [{"_source": obj}]
+
+
+def estimate_docs(paths: list[str], sample_size: int = 1024 * 1024) -> int:
+    """
+    Estimates the number of documents in files by counting them in the first
+    `sample_size` bytes of every file. Sizes of gzipped files are compared
+    in compressed bytes.
+    """
+    serializer = make_serializer()
+    total = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        with open(path, "rb") as raw:
+            f = gzip.GzipFile(fileobj=raw) if path.endswith(".gz") else raw
+            docs = 0
+            read = 0
+            for line in f:
+                read += len(line)
+                line = line.strip()
+                if line:
+                    docs += len(line_hits(serializer.loads(line)))
+                if read >= sample_size:
+                    break
+            sampled = raw.tell()
+        if sampled:
+            total += round(docs * size / sampled)
+    return total
+
+
+class FileReader:
+    """Reads pages of hits from a file starting at a saved position"""
+
+    def __init__(self, path: str, position: Position, serializer: JsonSerializer):
+        self.path = path
+        self.offset, self.skip = position
+        self.serializer = serializer
+        self.f: Optional[BinaryIO] = None
+
+    def open(self):
+        self.f = open_file(self.path)
+        if self.offset:
+            # gzip files are decompressed up to the offset
+            self.f.seek(self.offset, io.SEEK_SET)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def read_page(
+        self, page_size: int
+    ) -> tuple[list[tuple[dict, Position]], int, bool]:
+        """
+        Returns hits with positions after each of them, the number of bytes
+        read and whether the end of the file has been reached
+        """
+        loads = self.serializer.loads
+        page = []
+        read = 0
+        while read < page_size:
+            line = self.f.readline()
+            if not line:
+                return page, read, True
+
+            start = self.offset
+            self.offset += len(line)
+            read += len(line)
+            line = line.strip()
+            if not line:
+                continue
+
+            hits = line_hits(loads(line))
+            last = len(hits) - 1
+            for i in range(self.skip, len(hits)):
+                position = [self.offset, 0] if i == last else [start, i + 1]
+                page.append((hits[i], position))
+            self.skip = 0
+        return page, read, False
+
+
+class FileScroller(AsyncIterable[tuple[dict, State]]):
+    """
+    Reads ES hits from NDJSON files (elasticdump output, search responses
+    or bare documents per line, optionally gzipped) in sorted order, up to
+    `workers` files at once.
+
+    State value keeps the last file read completely along with all files
+    before it and positions in files read after it, so that a transfer
+    continues from the last saved document:
+    {"completed": path, "files": {path: [offset, skip]}}.
+    """
+
+    def __init__(
+        self,
+        paths: list[str],
+        stop_event: asyncio.Event,
+        timestamp_field: str = "@timestamp",
+        state: Optional[State] = None,
+        workers: int = 1,
+        page_size: int = 1024 * 1024,
+        serializer: Optional[JsonSerializer] = None,
+        stats: Optional[SearchStats] = None,
+    ):
+        self.paths = sorted(paths)
+        self.stop_event = stop_event
+        self.workers = workers
+        self.page_size = page_size
+        self.serializer = serializer or make_serializer()
+        self.stats = stats or SearchStats()
+        self._timestamp_field = timestamp_field
+
+        value = state.value if state is not None and not state.iszero else {}
+        if not isinstance(value, dict) or "files" not in value:
+            if value:
+                raise ValueError("state has not been saved by a file source")
+            value = {"completed": None, "files": {}}
+        self._completed: Optional[str] = value["completed"]
+        self._positions: dict[str, Position] = dict(value["files"])
+        self._finished: set[str] = set()
+
+        self.logger = logging.getLogger("file_scroller")
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+        self._tasks: list[asyncio.Task] = []
+        self._readers_left = 0
+        self._page = collections.deque()
+        self._page_path: Optional[str] = None
+
+    @property
+    def is_running(self) -> bool:
+        return not self.stop_event.is_set()
+
+    def _pending_paths(self) -> list[str]:
+        paths = []
+        for path in self.paths:
+            if self._completed is not None and path <= self._completed:
+                continue
+            if self._positions.get(path, [0])[0] == DONE:
+                self._finished.add(path)
+                continue
+            paths.append(path)
+        return paths
+
+    def _start(self):
+        pending = collections.deque(self._pending_paths())
+        self.logger.info(
+            "reading %d of %d files, %d at once",
+            len(pending),
+            len(self.paths),
+            self.workers,
+        )
+
+        async def worker():
+            try:
+                while pending and self.is_running:
+                    await self._read_file(pending.popleft())
+            finally:
+                self._readers_left -= 1
+                if self._readers_left == 0:
+                    await self._put(None)
+
+        self._readers_left = self.workers
+        self._tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+
+    async def _read_file(self, path: str):
+        loop = asyncio.get_running_loop()
+        reader = FileReader(path, self._positions.get(path, [0, 0]), self.serializer)
+        self.logger.info("reading %s from offset %d", path, reader.offset)
+        await loop.run_in_executor(None, reader.open)
+        try:
+            while self.is_running:
+                started = time.monotonic()
+                page, read, eof = await loop.run_in_executor(
+                    None, reader.read_page, self.page_size
+                )
+                self.stats.add(None, len(page), time.monotonic() - started)
+                self.stats.bytes += read
+
+                if page and not await self._put((path, page)):
+                    return
+                if eof:
+                    await self._put((path, None))
+                    return
+        finally:
+            reader.close()
+
+    async def _put(self, item) -> bool:
+        _, finished = await wait_task(self._queue.put(item), event=self.stop_event)
+        return not finished
+
+    def _finish(self, path: str):
+        self.logger.info("finished %s", path)
+        self._positions[path] = [DONE, 0]
+        self._finished.add(path)
+        for p in self.paths:
+            if self._completed is not None and p <= self._completed:
+                continue
+            if p not in self._finished:
+                break
+            self._completed = p
+            self._finished.discard(p)
+            self._positions.pop(p, None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> tuple[dict, State]:
+        if not self._tasks:
+            self._start()
+
+        while not self._page:
+            if not self.is_running:
+                raise StopAsyncIteration()
+
+            item, finished = await wait_task(self._queue.get(), event=self.stop_event)
+            if finished or item is None:
+                raise StopAsyncIteration()
+
+            path, page = item
+            if page is None:
+                self._finish(path)
+                continue
+            self._page_path = path
+            self._page.extend(page)
+
+        hit, position = self._page.popleft()
+        self._positions[self._page_path] = position
+        return hit, State(
+            timestamp=hit.get("_source", {}).get(self._timestamp_field),
+            value={"completed": self._completed, "files": dict(self._positions)},
+        )
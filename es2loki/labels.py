@@ -0,0 +1,107 @@
+import re
+from collections import OrderedDict
+from typing import Mapping, Union
+
+LABEL_RE = re.compile(r'(\w+)="([^"]*)"')
+
+
+def labels_to_str(labels: Mapping[str, str]) -> str:
+    arr = []
+    for key, value in labels.items():
+        arr.append(f'{key}="{value}"')
+
+    arr.sort()
+    return "{" + ", ".join(arr) + "}"
+
+
+def str_to_labels(labels_str: str) -> dict[str, str]:
+    """Parses a selector rendered by labels_to_str back to labels"""
+    return dict(LABEL_RE.findall(labels_str))
+
+
+class StreamLabels:
+    """
+    Interned label set of a Loki stream with its pre-rendered selector.
+    Equal label sets are equal streams regardless of the interned id.
+    """
+
+    __slots__ = ("id", "labels", "labels_str", "_hash")
+
+    def __init__(self, id: int, labels: Mapping[str, str], labels_str: str):
+        self.id = id
+        self.labels = labels
+        self.labels_str = labels_str
+        self._hash = hash(labels_str)
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if other.__class__ is not StreamLabels:
+            return NotImplemented
+        return self.labels_str == other.labels_str
+
+    def __reduce__(self):
+        # string hashes differ between processes, so recalculate it on unpickle
+        return StreamLabels, (self.id, self.labels, self.labels_str)
+
+    def __repr__(self):
+        return f"StreamLabels({self.id}, {self.labels_str})"
+
+
+class LabelsInterner:
+    """
+    Bounded LRU cache mapping label dicts to interned StreamLabels, so that
+    a known label set costs one dict lookup instead of building and
+    rendering it for every document.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._cache: OrderedDict[tuple, StreamLabels] = OrderedDict()
+        self._next_id = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def cardinality(self) -> int:
+        return len(self._cache)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def intern(self, labels: Union[Mapping[str, str], StreamLabels]) -> StreamLabels:
+        if labels.__class__ is StreamLabels:
+            return labels
+
+        key = tuple(labels.items())
+        stream = self._cache.get(key)
+        if stream is not None:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return stream
+
+        self.misses += 1
+        stream = StreamLabels(self._next_id, dict(labels), labels_to_str(labels))
+        self._next_id += 1
+
+        self._cache[key] = stream
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        return stream
+
+    def get_printable_stats(self) -> str:
+        return (
+            f"hit rate: {self.hit_rate * 100:.2f}% cardinality: {self.cardinality} "
+            f"evictions: {self.evictions}"
+        )
+
+
+default_interner = LabelsInterner()
@@ -1,46 +1,218 @@
 import asyncio
+import collections
 import datetime
+import email.utils
+import gzip
 import json
 import logging
+import random
+import re
+import time
+import warnings
 from asyncio import CancelledError
+from concurrent.futures import Executor
 from functools import cached_property
-from typing import Mapping, Optional, cast
+from typing import Awaitable, Callable, Iterator, Mapping, Optional, Union
 
 import aiohttp
-from frozendict import frozendict
-from snappy import snappy
 from yarl import URL
 
-from es2loki.proto.logproto_pb2 import PushRequest, StreamAdapter
+from es2loki.aio import wait_task
+from es2loki.aio.rate_limiter import RateLimiter
+from es2loki.dead_letter import DeadLetter
+from es2loki.labels import LabelsInterner, StreamLabels, default_interner, str_to_labels
+from es2loki.metrics import Histogram
+from es2loki.serializers import JsonSerializer
+from es2loki.timestamps import datetime_to_ns
 from es2loki.utils import gzip_encode, size_str
 
 logger = logging.getLogger(__name__)
 
 
 class LokiBatch:
-    def __init__(self):
-        self._streams: dict[Mapping[str, str], list[tuple[str, str]]] = {}
-        self._pb_streams: dict[Mapping[str, str], StreamAdapter] = {}
-        self._req = PushRequest()
+    """
+    Batch of Loki streams which can be serialized to both JSON and protobuf.
+    Subclasses made by `Loki.make_batch` keep only the data needed by
+    the serializer of a particular push mode.
+    """
+
+    def __init__(self, interner: Optional[LabelsInterner] = None):
+        self._interner = interner or default_interner
+        self._streams: dict[StreamLabels, list[tuple]] = {}
+        self._stream_sizes: dict[StreamLabels, int] = {}
+        self._total_size = 0
+        self._total_docs = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_interner"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._interner = default_interner
 
     def push(
-        self, *, labels: Mapping[str, str], timestamp: datetime.datetime, entry: str
+        self,
+        *,
+        labels: Union[Mapping[str, str], StreamLabels],
+        timestamp: Union[datetime.datetime, int],
+        entry: str,
     ):
-        labels = frozendict(labels)
+        """
+        Pushes an entry to the batch. `timestamp` is either a datetime
+        or integer nanoseconds since epoch.
+        """
+        labels = self._interner.intern(labels)
+
+        stream = self._streams.get(labels)
+        if stream is None:
+            stream = self._streams[labels] = []
+            self._stream_sizes[labels] = 0
+
+        if timestamp.__class__ is int:
+            timestamp_nano = timestamp
+        else:
+            timestamp_nano = datetime_to_ns(timestamp)
+        stream.append(self._make_value(timestamp_nano, entry))
+
+        entry_size = len(entry)
+        self._stream_sizes[labels] += entry_size
+        self._total_size += entry_size
+        self._total_docs += 1
+
+    def merge(self, other: "LokiBatch"):
+        """
+        Appends all streams of *other* batch (of the same type) to this one
+        """
+        for labels, values in other._streams.items():
+            stream = self._streams.get(labels)
+            if stream is None:
+                stream = self._streams[labels] = []
+                self._stream_sizes[labels] = 0
+
+            stream.extend(values)
+            self._stream_sizes[labels] += other._stream_sizes[labels]
+
+        self._total_size += other._total_size
+        self._total_docs += other._total_docs
+
+    def split(self, n: int) -> list[tuple[int, "LokiBatch"]]:
+        """
+        Splits streams into `n` batches by a hash of their labels, so that
+        a stream always lands in the same part. Only non-empty parts are
+        returned together with their index.
+        """
+        if n <= 1:
+            return [(0, self)]
+
+        parts = [type(self)(self._interner) for _ in range(n)]
+        for labels, values in self._streams.items():
+            parts[hash(labels) % n]._add_stream(
+                labels, values, self._stream_sizes[labels]
+            )
+
+        return [(i, part) for i, part in enumerate(parts) if part.total_docs]
+
+    def bisect(self) -> tuple["LokiBatch", "LokiBatch"]:
+        """
+        Splits the batch in two halves: by streams if there are several of them,
+        otherwise by entries of the only stream
+        """
+        first = type(self)(self._interner)
+        second = type(self)(self._interner)
+
+        streams = list(self._streams.items())
+        if len(streams) > 1:
+            half = len(streams) // 2
+            for i, (labels, values) in enumerate(streams):
+                part = first if i < half else second
+                part._add_stream(labels, values, self._stream_sizes[labels])
+        else:
+            labels, values = streams[0]
+            half = len(values) // 2
+            first._add_stream(labels, values[:half])
+            second._add_stream(labels, values[half:])
+
+        return first, second
+
+    def cut(self, size: int, min_docs: int = 0) -> tuple["LokiBatch", "LokiBatch"]:
+        """
+        Splits off leading entries of at most `size` bytes (but at least
+        `min_docs` entries). Returns them and the rest of the batch.
+        """
+        head = type(self)(self._interner)
+        tail = type(self)(self._interner)
+
+        for labels, values in self._streams.items():
+            if tail.total_docs:
+                tail._add_stream(labels, values, self._stream_sizes[labels])
+                continue
+
+            taken = 0
+            taken_size = 0
+            for value in values:
+                entry_size = len(value[1])
+                over = head.total_size + taken_size + entry_size > size
+                if over and head.total_docs + taken >= min_docs:
+                    break
+                taken += 1
+                taken_size += entry_size
+
+            if taken:
+                head._add_stream(labels, values[:taken], taken_size)
+            if taken < len(values):
+                tail._add_stream(
+                    labels, values[taken:], self._stream_sizes[labels] - taken_size
+                )
 
-        if labels not in self._streams:
-            self._streams[labels] = []
-            stream = StreamAdapter()
-            stream.labels = self._labels_to_str(labels)
-            self._pb_streams[labels] = stream
+        return head, tail
 
-        timestamp_nano = int(timestamp.timestamp() * 1000) * 1_000_000
+    def _add_stream(self, labels: StreamLabels, values: list, size: int = -1):
+        if size < 0:
+            size = sum(len(value[1]) for value in values)
+        self._streams[labels] = values
+        self._stream_sizes[labels] = size
+        self._total_size += size
+        self._total_docs += len(values)
 
-        self._streams[labels].append((str(timestamp_nano), entry))
+    def iter_entries(self) -> Iterator[tuple[StreamLabels, int, str]]:
+        """Yields (labels, timestamp in nanoseconds, line) of all entries"""
+        for labels, values in self._streams.items():
+            for timestamp, line in values:
+                yield labels, int(timestamp), line
 
-        pb_entry = self._pb_streams[labels].entries.add()
-        pb_entry.timestamp.FromNanoseconds(timestamp_nano)
-        pb_entry.line = entry
+    def _make_value(self, timestamp_nano: int, entry: str) -> tuple:
+        return timestamp_nano, entry
+
+    def serialize_json(self):
+        return {
+            "streams": [
+                {
+                    "stream": labels.labels,
+                    "values": [(str(timestamp), line) for timestamp, line in values],
+                }
+                for labels, values in self._streams.items()
+            ]
+        }
+
+    def serialize_pb(self) -> bytes:
+        from es2loki.proto.logproto_pb2 import PushRequest
+
+        req = PushRequest()
+        for labels, values in self._streams.items():
+            stream = req.streams.add()
+            stream.labels = labels.labels_str
+            for timestamp_nano, line in values:
+                pb_entry = stream.entries.add()
+                pb_entry.timestamp.FromNanoseconds(int(timestamp_nano))
+                pb_entry.line = line
+        return req.SerializeToString()
+
+    def serialize(self, serializer: Optional[JsonSerializer] = None) -> bytes:
+        if serializer is None:
+            return json.dumps(self.serialize_json()).encode("utf-8")
+        return serializer.dumps_bytes(self.serialize_json())
 
     @property
     def streams_count(self) -> int:
@@ -48,48 +220,169 @@ class LokiBatch:
 
     @property
     def total_size(self) -> int:
-        total = 0
-        for stream in self._streams.values():
-            total += sum((len(entry[1]) for entry in stream))
-        return total
+        return self._total_size
 
     @property
     def total_docs(self) -> int:
-        return sum((len(stream) for stream in self._streams.values()))
+        return self._total_docs
+
+    def get_printable_stats(self):
+        lines = []
+        for labels, stream in self._streams.items():
+            labels_str = labels.labels_str
+            stream_size = self._stream_sizes[labels]
+            line = f"{labels_str} => count={len(stream)} size={size_str(stream_size)}"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+class JsonLokiBatch(LokiBatch):
+    def _make_value(self, timestamp_nano: int, entry: str) -> tuple:
+        return str(timestamp_nano), entry
 
     def serialize_json(self):
+        # timestamps are kept as strings already
         return {
             "streams": [
                 {
-                    "stream": dict(labels),
+                    "stream": labels.labels,
                     "values": values,
                 }
                 for labels, values in self._streams.items()
             ]
         }
 
-    def serialize_pb(self) -> bytes:
-        req = PushRequest()
-        req.streams.extend(list(self._pb_streams.values()))
-        return req.SerializeToString()
 
-    @staticmethod
-    def _labels_to_str(labels: Mapping[str, str]):
-        arr = []
-        for key, value in labels.items():
-            arr.append(f'{key}="{value}"')
+class PbLokiBatch(LokiBatch):
+    """
+    Protobuf messages are built only in serialize_pb so that the batch stays
+    cheap to fill and can be pickled to an encoding process pool.
+    """
+
+    def serialize(self, serializer: Optional[JsonSerializer] = None) -> bytes:
+        return self.serialize_pb()
+
+
+def encode_batch(
+    batch: LokiBatch,
+    use_pb: bool,
+    use_gzip: bool,
+    serializer: Optional[JsonSerializer] = None,
+) -> tuple[bytes, float, float]:
+    """
+    Serializes and compresses the batch according to the push mode.
+    Returns the encoded payload and the CPU time serialization and compression
+    took. It is a module-level function so that it can be sent to a process pool.
+    """
+    # CPU time of the calling thread only: process_time would count encoding
+    # in the other threads of a thread pool as well
+    started = time.thread_time()
+    data = batch.serialize(serializer)
+    serialized = time.thread_time()
+    if use_pb:
+        from snappy import snappy
 
-        arr.sort()
-        return "{" + ", ".join(arr) + "}"
+        data = snappy.compress(data)
+    elif use_gzip:
+        data = gzip_encode(data)
+    return data, serialized - started, time.thread_time() - serialized
+
+
+def decode_batch(data: bytes, use_pb: bool, use_gzip: bool) -> LokiBatch:
+    """Rebuilds a batch from a payload encoded by encode_batch"""
+    if use_pb:
+        from snappy import snappy
+
+        from es2loki.proto.logproto_pb2 import PushRequest
+
+        req = PushRequest.FromString(snappy.decompress(data))
+        batch = PbLokiBatch()
+        for stream in req.streams:
+            labels = str_to_labels(stream.labels)
+            for entry in stream.entries:
+                batch.push(
+                    labels=labels,
+                    timestamp=entry.timestamp.ToNanoseconds(),
+                    entry=entry.line,
+                )
+        return batch
 
-    def get_printable_stats(self):
-        lines = []
-        for labels, stream in self._streams.items():
-            labels_str = self._labels_to_str(labels)
-            stream_size = sum((len(entry[1]) for entry in stream))
-            line = f"{labels_str} => count={len(stream)} size={size_str(stream_size)}"
-            lines.append(line)
-        return "\n".join(lines)
+    if use_gzip:
+        data = gzip.decompress(data)
+    batch = JsonLokiBatch()
+    for stream in json.loads(data)["streams"]:
+        for timestamp, line in stream["values"]:
+            batch.push(labels=stream["stream"], timestamp=int(timestamp), entry=line)
+    return batch
+
+
+class LokiPushError(Exception):
+    """Loki has rejected a push request with a non-retryable status"""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"loki push failed with status {status}: {body}")
+        self.status = status
+        self.body = body
+
+
+# statuses of requests with invalid or too large entries, which are split
+# to find the entries to drop
+SPLITTABLE_STATUSES = (400, 413)
+
+
+def is_retryable_status(status: int) -> bool:
+    return status == 408 or status == 429 or status >= 500
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parses Retry-After header (either seconds or an HTTP date)"""
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+_RATE_LIMIT_RE = re.compile(r"limit: ([\d.]+) ?(bytes|[KMGT]i?B|B)/sec")
+_RATE_LIMIT_UNITS = {"bytes": 1, "B": 1, "KB": 1000, "MB": 1000**2, "GB": 1000**3}
+_RATE_LIMIT_UNITS.update({"KiB": 1024, "MiB": 1024**2, "GiB": 1024**3})
+
+
+def parse_rate_limit(body: str) -> Optional[int]:
+    """
+    Extracts the limit from Loki rate limit errors, e.g.
+    "Ingestion rate limit exceeded (limit: 4194304 bytes/sec) ..." or
+    "Per stream rate limit exceeded (limit: 3MB/sec) ..."
+    """
+    m = _RATE_LIMIT_RE.search(body)
+    if m is None:
+        return None
+    return int(float(m.group(1)) * _RATE_LIMIT_UNITS.get(m.group(2), 1))
+
+
+class Backoff:
+    """Exponential backoff with equal jitter"""
+
+    def __init__(self, base: float = 0.5, max_delay: float = 60.0, factor: float = 2.0):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        # the power overflows a float long after max_delay is reached
+        delay = min(self.max_delay, self.base * self.factor ** min(attempt, 64))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
 
 
 class Loki:
@@ -102,13 +395,43 @@ class Loki:
         use_gzip: bool = True,
         use_pb: bool = True,
         dry_run: bool = False,
+        executor: Optional[Executor] = None,
+        labels_cache_size: int = 10000,
+        serializer: Optional[JsonSerializer] = None,
+        batch_size: int = 1 * 1024 * 1024,
+        backoff: Optional[Backoff] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        dead_letter: Optional[DeadLetter] = None,
+        rate_limit_retries: int = 10,
+        session: Optional[aiohttp.ClientSession] = None,
+        concurrency: Optional[asyncio.Semaphore] = None,
     ):
         self.url = url
         self.username = username
         self.password = password
         self.tenant_id = tenant_id
-        self._session = None
+        self._session = session
+        # limits concurrent push requests, e.g. of all jobs of an orchestrator
+        self._concurrency = concurrency
         self._dry_run = dry_run
+        self._executor = executor
+        self.offloaded_encode_time = 0.0
+        # cumulative times of encoding stages and push requests
+        self.serialize_time = 0.0
+        self.compress_time = 0.0
+        self.push_time = 0.0
+        self.labels = LabelsInterner(max_size=labels_cache_size)
+        self._serializer = serializer
+        self._backoff = backoff or Backoff()
+        self._rate_limiter = rate_limiter
+        self._dead_letter = dead_letter
+        self._rate_limit_retries = rate_limit_retries
+        self.retries = collections.Counter()
+        self.push_latency: Optional[Histogram] = None
+
+        # upper limit of the batch size lowered when Loki reports rate or size limits
+        self.batch_size = batch_size
+        self.batch_size_limit = batch_size
 
         if self.username and self.password:
             self._auth = aiohttp.BasicAuth(login=self.username, password=self.password)
@@ -135,25 +458,165 @@ class Loki:
             self._session = aiohttp.ClientSession()
         return self._session
 
+    async def warm_up(self):
+        """
+        Opens a connection to Loki in advance, so that the first push does
+        not wait for it. The response does not matter.
+        """
+        if self._dry_run:
+            return
+        try:
+            async with self.session.get(
+                URL(self.url) / "ready",
+                auth=self._auth,
+                headers={
+                    k: v for k, v in self._headers.items() if k == "X-Scope-OrgId"
+                },
+            ) as resp:
+                await resp.read()
+        except Exception as e:
+            logger.debug("error connecting to loki: %r", e)
+
+    def make_batch(self) -> LokiBatch:
+        if self._use_pb:
+            return PbLokiBatch(self.labels)
+        return JsonLokiBatch(self.labels)
+
     @cached_property
     def api_push_url(self):
         return URL(self.url) / "loki/api/v1/push"
 
+    def _limit_batch_size(self, size: int, reason: str):
+        size = max(1024, min(self.batch_size_limit, size))
+        if size == self.batch_size_limit:
+            return
+        logger.info(
+            "lowering loki batch size limit %s -> %s (%s)",
+            size_str(self.batch_size_limit),
+            size_str(size),
+            reason,
+        )
+        self.batch_size_limit = size
+
+    def _on_push_rejected(self, status: int, body: str, batch: LokiBatch):
+        if status == 429:
+            rate_limit = parse_rate_limit(body)
+            if rate_limit is not None:
+                self._limit_batch_size(rate_limit, "rate limit")
+            else:
+                self._limit_batch_size(batch.total_size * 3 // 4, "rate limit")
+        elif status == 413:
+            self._limit_batch_size(batch.total_size // 2, "size limit")
+
+    def _on_push_accepted(self):
+        # additive increase back to the configured batch size
+        if self.batch_size_limit < self.batch_size:
+            self.batch_size_limit = min(
+                self.batch_size, self.batch_size_limit + self.batch_size // 16
+            )
+
     async def _push(
+        self,
+        data: bytes,
+        batch: LokiBatch,
+        stop_event: asyncio.Event,
+        on_dropped: Optional[Callable[[int], None]] = None,
+    ) -> tuple[int, int]:
+        try:
+            return await self._push_with_retries(data, batch, stop_event)
+        except LokiPushError as e:
+            # rate limits are transient, rate limited entries are never dropped
+            rate_limited = e.status == 429
+            if not rate_limited and (
+                e.status not in SPLITTABLE_STATUSES or self._dead_letter is None
+            ):
+                raise
+            if not isinstance(batch, LokiBatch):
+                # only the payload of spooled batches is kept
+                batch = decode_batch(data, self._use_pb, self._use_gzip)
+            if rate_limited:
+                return await self._push_parts(batch, stop_event, on_dropped)
+            return await self._push_rejected(batch, e, stop_event, on_dropped)
+
+    async def _push_rejected(
+        self,
+        batch: LokiBatch,
+        error: LokiPushError,
+        stop_event: asyncio.Event,
+        on_dropped: Optional[Callable[[int], None]] = None,
+    ) -> tuple[int, int]:
+        """
+        Bisects a rejected batch until the entries Loki does not accept are
+        isolated, sends the rest and writes those entries to the dead letter.
+        Entries of a rejected request may have been partially ingested already,
+        Loki drops exact duplicates when they are sent again.
+        """
+        if self._dead_letter.full:
+            logger.error(
+                "too many rejected entries (%d), stopping", self._dead_letter.dropped
+            )
+            raise error
+
+        if batch.total_docs == 1:
+            await self._dead_letter.write(batch, error.status, error.body)
+            if on_dropped is not None:
+                on_dropped(batch.total_docs)
+            return error.status, 0
+
+        logger.warning(
+            "loki rejected %d entries of %d streams with %d, splitting",
+            batch.total_docs,
+            batch.streams_count,
+            error.status,
+        )
+        return await self._push_parts(batch, stop_event, on_dropped)
+
+    async def _push_parts(
+        self,
+        batch: LokiBatch,
+        stop_event: asyncio.Event,
+        on_dropped: Optional[Callable[[int], None]] = None,
+    ) -> tuple[int, int]:
+        """Pushes halves of the batch one after another"""
+        transferred_size = 0
+        for part in batch.bisect():
+            _, size = await self._push(
+                await self.encode(part), part, stop_event, on_dropped
+            )
+            transferred_size += size
+        return 200, transferred_size
+
+    async def _push_with_retries(
         self, data: bytes, batch: LokiBatch, stop_event: asyncio.Event
     ) -> tuple[int, int]:
-        status = None
-        while status is None or status < 200 or status > 300:
+        attempt = 0
+        rate_limited = 0
+        while True:
             if stop_event.is_set():
                 raise CancelledError("stopping loki push")
 
+            if self._rate_limiter is not None:
+                # every attempt is charged: Loki counts only accepted requests,
+                # so a retry must not be sent before its tokens are available
+                await wait_task(
+                    self._rate_limiter.acquire(batch.total_size, batch.total_docs),
+                    event=stop_event,
+                )
+                if stop_event.is_set():
+                    raise CancelledError("stopping loki push")
+
             if self._dry_run:
                 logger.info(
                     "[DRY_RUN] sending loki push request to %s", self.api_push_url
                 )
-                status = 200
-            else:
+                return 200, len(data)
+
+            retry_after = None
+            try:
+                if self._concurrency is not None:
+                    await self._concurrency.acquire()
                 try:
+                    started = time.monotonic()
                     async with self.session.request(
                         "POST",
                         self.api_push_url,
@@ -162,46 +625,133 @@ class Loki:
                         auth=self._auth,
                     ) as result:
                         status = result.status
-
-                        if not (200 <= status < 300):
-                            resp = await result.text()
-                            logger.info(
-                                "loki push - %d: %s. stats:\n%s",
-                                status,
-                                resp,
-                                batch.get_printable_stats(),
-                            )
-                            await asyncio.sleep(2.0)
-                            continue
-                except Exception as e:
-                    logger.exception("error while sending to loki: %s", e)
-                    await asyncio.sleep(2.0)
-                    continue
-
-            return cast(int, status), len(data)
+                        elapsed = time.monotonic() - started
+                        self.push_time += elapsed
+                        if self.push_latency is not None:
+                            self.push_latency.observe(elapsed)
+                        if 200 <= status < 300:
+                            self._on_push_accepted()
+                            return status, len(data)
+
+                        resp = await result.text()
+                        retry_after = parse_retry_after(
+                            result.headers.get("Retry-After")
+                        )
+                finally:
+                    if self._concurrency is not None:
+                        self._concurrency.release()
+            except Exception as e:
+                logger.exception("error while sending to loki: %s", e)
+                self.retries["connection"] += 1
+            else:
+                self._on_push_rejected(status, resp, batch)
+                if not is_retryable_status(status):
+                    logger.error(
+                        "loki push - %d: %s. stats:\n%s",
+                        status,
+                        resp,
+                        batch.get_printable_stats(),
+                    )
+                    raise LokiPushError(status, resp)
+
+                if status == 429:
+                    rate_limited += 1
+                    if rate_limited > self._rate_limit_retries and batch.total_docs > 1:
+                        # e.g. the batch is larger than the tenant burst, so it
+                        # is retried in parts. A single entry is retried as is
+                        logger.warning(
+                            "loki push - 429 %d times in a row: %s", rate_limited, resp
+                        )
+                        raise LokiPushError(status, resp)
+                self.retries["rate_limited" if status == 429 else "server_error"] += 1
+                logger.info("loki push - %d: %s", status, resp)
+
+            delay = self._backoff.delay(attempt, retry_after)
+            attempt += 1
+            logger.info("retrying loki push in %.2fs (attempt %d)", delay, attempt)
+            await wait_task(asyncio.sleep(delay), event=stop_event)
+
+    def encode(self, batch: LokiBatch) -> "asyncio.Future[bytes]":
+        """
+        Starts encoding of the batch. When an executor is configured the work
+        is done there and the event loop keeps running, otherwise the batch is
+        encoded right away.
+        """
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            fut = loop.create_future()
+            data, serialize_time, compress_time = encode_batch(
+                batch, self._use_pb, self._use_gzip, self._serializer
+            )
+            self.serialize_time += serialize_time
+            self.compress_time += compress_time
+            fut.set_result(data)
+            return fut
+
+        def on_encoded(f):
+            if f.cancelled() or f.exception() is not None:
+                return
+            _, serialize_time, compress_time = f.result()
+            self.serialize_time += serialize_time
+            self.compress_time += compress_time
+            self.offloaded_encode_time += serialize_time + compress_time
+
+        encode_fut = loop.run_in_executor(
+            self._executor,
+            encode_batch,
+            batch,
+            self._use_pb,
+            self._use_gzip,
+            self._serializer,
+        )
+        encode_fut.add_done_callback(on_encoded)
+
+        async def wait_encoded() -> bytes:
+            data, _, _ = await encode_fut
+            return data
+
+        return asyncio.ensure_future(wait_encoded())
 
     async def push_json(
         self, batch: LokiBatch, stop_event: asyncio.Event
     ) -> tuple[int, int]:
+        """Deprecated: `push` encodes the batch according to the push mode"""
+        warnings.warn(
+            "Loki.push_json is deprecated, use Loki.push", DeprecationWarning, 2
+        )
         data = batch.serialize_json()
-        data_encoded = json.dumps(data).encode("utf-8")
-
+        if self._serializer is None:
+            data_encoded = json.dumps(data).encode("utf-8")
+        else:
+            data_encoded = self._serializer.dumps_bytes(data)
         if self._use_gzip:
             data_encoded = gzip_encode(data_encoded)
-
         return await self._push(data_encoded, batch, stop_event)
 
     async def push_pb(
         self, batch: LokiBatch, stop_event: asyncio.Event
     ) -> tuple[int, int]:
-        data = batch.serialize_pb()
-        data = snappy.compress(data)
+        """Deprecated: `push` encodes the batch according to the push mode"""
+        warnings.warn(
+            "Loki.push_pb is deprecated, use Loki.push", DeprecationWarning, 2
+        )
+        from snappy import snappy
 
-        return await self._push(data, batch, stop_event)
+        return await self._push(
+            snappy.compress(batch.serialize_pb()), batch, stop_event
+        )
 
     async def push(
-        self, batch: LokiBatch, stop_event: asyncio.Event
+        self,
+        batch: LokiBatch,
+        stop_event: asyncio.Event,
+        data: Optional[Awaitable[bytes]] = None,
+        on_dropped: Optional[Callable[[int], None]] = None,
     ) -> tuple[int, int]:
-        if self._use_pb:
-            return await self.push_pb(batch, stop_event)
-        return await self.push_json(batch, stop_event)
+        """
+        Pushes the batch. Entries Loki rejects are written to the dead letter
+        and their number is passed to `on_dropped`.
+        """
+        if data is None:
+            data = self.encode(batch)
+        return await self._push(await data, batch, stop_event, on_dropped)
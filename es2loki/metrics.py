@@ -0,0 +1,180 @@
+import bisect
+import logging
+import math
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Union
+
+if TYPE_CHECKING:
+    from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# seconds
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Value = Union[int, float]
+LabelValues = tuple[str, ...]
+
+
+def _format_value(value: Value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: LabelValues = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    def samples(self) -> Iterable[tuple[str, LabelValues, LabelValues, Value]]:
+        """Yields (name suffix, label names, label values, value)"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, names, values, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(names, values)} "
+                f"{_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class _ValueMetric(Metric):
+    """
+    Metric with a value per label set. The values are either updated
+    directly or read from `fn` on every scrape. `fn` returns a number or,
+    for metrics with labels, a mapping of label values tuples to numbers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: LabelValues = (),
+        fn: Optional[Callable[[], Union[Value, dict[LabelValues, Value]]]] = None,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self._fn = fn
+        self._values: dict[LabelValues, Value] = {}
+
+    def _key(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        values = self._values
+        if self._fn is not None:
+            values = self._fn()
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            yield "", self.labelnames, key, value
+
+
+class Counter(_ValueMetric):
+    type = "counter"
+
+    def inc(self, amount: Value = 1, **labels: str):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_ValueMetric):
+    type = "gauge"
+
+    def set(self, value: Value, **labels: str):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value: Value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sum += value
+        self._count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self._counts):
+            cumulative += count
+            yield "_bucket", ("le",), (_format_value(bound),), cumulative
+        yield "_sum", (), (), self._sum
+        yield "_count", (), (), self._count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self._metrics.values()) + "\n"
+
+
+class MetricsServer:
+    """Serves metrics of the registry in Prometheus text format on /metrics"""
+
+    def __init__(self, registry: Registry, host: str = "0.0.0.0", port: int = 9090):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional["web.AppRunner"] = None
+
+    async def _handle_metrics(self, request: "web.Request") -> "web.Response":
+        from aiohttp import web
+
+        return web.Response(
+            body=self.registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def start(self):
+        # aiohttp.web is loaded only when metrics are enabled
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("serving metrics on http://%s:%d/metrics", self.host, self.port)
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,97 @@
+import collections
+import logging
+from typing import Optional
+
+from es2loki.utils import current_rss, size_str
+
+
+class PageSizeController:
+    """
+    Chooses the size of ES search pages.
+
+    The page grows by `growth` while both the search latency and the response
+    size stay well below their targets, is scaled down when one of them
+    is exceeded and is halved on timeouts, partial shard results, rejected
+    requests and when the process uses more than `max_memory` bytes.
+    """
+
+    # a page grows only while latency and size are below this share of targets
+    HEADROOM = 0.7
+
+    def __init__(
+        self,
+        size: int,
+        min_size: int = 100,
+        max_size: int = 10000,
+        target_latency: float = 5.0,
+        target_bytes: int = 32 * 1024 * 1024,
+        max_memory: int = 0,
+        growth: float = 1.5,
+    ):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+        self.max_memory = max_memory
+        self.growth = growth
+
+        self.size = self._clamp(size)
+        self.last_reason: Optional[str] = None
+        self.changes = collections.Counter()
+        self.logger = logging.getLogger("es_page_size")
+
+    def _clamp(self, size: float) -> int:
+        return max(self.min_size, min(self.max_size, int(size)))
+
+    def _set(self, size: float, reason: str):
+        size = self._clamp(size)
+        if size == self.size:
+            return
+
+        self.logger.info("es page size %d -> %d (%s)", self.size, size, reason)
+        self.size = size
+        self.last_reason = reason
+        self.changes[reason] += 1
+
+    def on_success(self, docs: int, latency: float, nbytes: int = 0):
+        """
+        Called for every successful page. nbytes is 0 when the response
+        size is unknown.
+        """
+        if self.max_memory and current_rss() > self.max_memory:
+            self._set(self.size / 2, "memory")
+            return
+
+        if latency > self.target_latency:
+            self._set(self.size * self.target_latency / latency, "latency")
+            return
+
+        if nbytes > self.target_bytes:
+            self._set(self.size * self.target_bytes / nbytes, "bytes")
+            return
+
+        if docs < self.size:
+            # the last page says nothing about the cost of a full one
+            return
+
+        if latency < self.target_latency * self.HEADROOM and (
+            nbytes < self.target_bytes * self.HEADROOM
+        ):
+            self._set(self.size * self.growth, "grow")
+
+    def on_timeout(self):
+        self._set(self.size / 2, "timeout")
+
+    def on_partial_shards(self):
+        self._set(self.size / 2, "partial_shards")
+
+    def on_rejected(self):
+        self._set(self.size / 2, "rejected")
+
+    def get_printable_stats(self) -> str:
+        changes = " ".join(f"{k}={v}" for k, v in sorted(self.changes.items()))
+        return (
+            f"size: {self.size} last change: {self.last_reason or '-'} "
+            f"changes: {changes or '-'} "
+            f"targets: {self.target_latency}s/{size_str(self.target_bytes)}"
+        )
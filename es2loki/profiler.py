@@ -0,0 +1,179 @@
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from es2loki.metrics import Histogram
+from es2loki.utils import seconds_to_str
+
+StageSource = Callable[[], dict[str, float]]
+
+
+class StageProfiler:
+    """
+    Accumulates time spent in pipeline stages and measures event loop lag.
+
+    Stage times are either added with `add`/`lap` or read from cumulative
+    counters of other components registered with `add_source`. A breakdown
+    of the stages is logged every `interval` seconds. Stages may run
+    concurrently (ES reads overlap Loki pushes), so their shares of the wall
+    time do not have to add up to 100%.
+
+    SIGUSR1 starts collecting cProfile and tracemalloc data, the next SIGUSR1
+    writes them to `dump_dir`.
+    """
+
+    def __init__(
+        self,
+        interval: float = 30.0,
+        lag_interval: float = 0.1,
+        dump_dir: str = ".",
+    ):
+        self.interval = interval
+        self.lag_interval = lag_interval
+        self.dump_dir = dump_dir
+        self.stages: dict[str, float] = collections.defaultdict(float)
+        self.lag: Optional[Histogram] = None
+        self.logger = logging.getLogger("profiler")
+
+        self._sources: list[StageSource] = []
+        self._docs: Callable[[], int] = lambda: 0
+        self._lag_sum = 0.0
+        self._lag_max = 0.0
+        self._lag_count = 0
+        self._tasks: list[asyncio.Task] = []
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._started = 0.0
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] += seconds
+
+    def lap(self, stage: str, started: float) -> float:
+        """Adds the time since `started` to the stage and returns the current time"""
+        now = time.perf_counter()
+        self.stages[stage] += now - started
+        return now
+
+    def add_source(self, fn: StageSource):
+        self._sources.append(fn)
+
+    def snapshot(self) -> dict[str, float]:
+        stages = dict(self.stages)
+        for fn in self._sources:
+            stages.update(fn())
+        return stages
+
+    def start(self, docs: Callable[[], int]):
+        self._docs = docs
+        self._started = time.monotonic()
+        self._tasks = [
+            asyncio.create_task(self._monitor_lag()),
+            asyncio.create_task(self._report_periodically()),
+        ]
+        if os.name != "nt":
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, self.toggle_dump
+            )
+
+    async def stop(self):
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if os.name != "nt":
+            asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+
+        if self._started:
+            self.logger.info(
+                "stages of the whole run: %s",
+                self.format_breakdown(
+                    self.snapshot(), time.monotonic() - self._started, self._docs()
+                ),
+            )
+
+    async def _monitor_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, time.monotonic() - started - self.lag_interval)
+            self._lag_sum += lag
+            self._lag_count += 1
+            self._lag_max = max(self._lag_max, lag)
+            if self.lag is not None:
+                self.lag.observe(lag)
+
+    async def _report_periodically(self):
+        prev_stages = self.snapshot()
+        prev_docs = self._docs()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            stages = self.snapshot()
+            docs = self._docs()
+            delta = {k: v - prev_stages.get(k, 0.0) for k, v in stages.items()}
+
+            self.logger.info(
+                "stages: %s",
+                self.format_breakdown(
+                    delta, time.monotonic() - started, docs - prev_docs
+                ),
+            )
+            self.logger.info(
+                "event loop lag: avg %.1fms max %.1fms",
+                self._lag_sum / (self._lag_count or 1) * 1000,
+                self._lag_max * 1000,
+            )
+
+            prev_stages = stages
+            prev_docs = docs
+            self._lag_sum = self._lag_max = 0.0
+            self._lag_count = 0
+
+    @staticmethod
+    def format_breakdown(stages: dict[str, float], elapsed: float, docs: int) -> str:
+        parts = [f"{docs} docs in {seconds_to_str(elapsed)}"]
+        for stage, seconds in sorted(stages.items(), key=lambda x: -x[1]):
+            per_doc = f" {seconds / docs * 1e6:.1f}us/doc" if docs else ""
+            parts.append(
+                f"{stage} {seconds:.3f}s ({seconds / (elapsed or 1) * 100:.1f}%{per_doc})"
+            )
+        return ", ".join(parts)
+
+    def toggle_dump(self):
+        if self._cprofile is None:
+            self.logger.warning(
+                "collecting cProfile and tracemalloc data until the next SIGUSR1"
+            )
+            tracemalloc.start()
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            return
+
+        self._cprofile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        prefix = os.path.join(self.dump_dir, f"es2loki-{int(time.time())}")
+        self._cprofile.dump_stats(f"{prefix}.prof")
+        snapshot.dump(f"{prefix}.tracemalloc")
+
+        out = io.StringIO()
+        pstats.Stats(self._cprofile, stream=out).sort_stats("cumulative").print_stats(
+            20
+        )
+        self._cprofile = None
+        self.logger.warning("cProfile dumped to %s.prof:\n%s", prefix, out.getvalue())
+        self.logger.warning(
+            "tracemalloc snapshot dumped to %s.tracemalloc. top allocations:\n%s",
+            prefix,
+            "\n".join(str(s) for s in snapshot.statistics("lineno")[:10]),
+        )
@@ -0,0 +1,149 @@
+import json
+import re
+from typing import Optional
+
+# hit key holding the verbatim `_source` JSON in raw mode
+RAW_SOURCE_FIELD = "_raw_source"
+
+_HITS = '"hits":['
+_SOURCE = '"_source":'
+_FIELDS = ',"fields":{'
+_SORT = ',"sort":['
+
+_decoder = json.JSONDecoder()
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+
+
+def make_raw_serializers() -> dict:
+    """
+    Returns ES client serializers which return JSON responses as text, so
+    that a search response may be split into hits without decoding the
+    documents (see parse_raw_response)
+    """
+    from elasticsearch.serializer import JsonSerializer
+
+    class RawJsonSerializer(JsonSerializer):
+        def loads(self, data: bytes) -> str:
+            if isinstance(data, bytes):
+                return data.decode("utf-8")
+            return data
+
+    return {
+        "application/json": RawJsonSerializer(),
+        "application/vnd.elasticsearch+json": RawJsonSerializer(),
+    }
+
+
+def fields_to_source(fields: dict) -> dict:
+    """
+    Builds a partial `_source` out of the `fields` of a hit:
+    {"host.name": ["a"]} -> {"host": {"name": "a"}}
+    """
+    source = {}
+    for name, values in fields.items():
+        value = values[0] if len(values) == 1 else values
+        if "." not in name:
+            source[name] = value
+            continue
+        *path, key = name.split(".")
+        obj = source
+        for part in path:
+            obj = obj.setdefault(part, {})
+            if not isinstance(obj, dict):
+                break
+        else:
+            obj[key] = value
+    return source
+
+
+def _parse_hit_tail(text: str, pos: int, sort_size: int) -> Optional[tuple[list, int]]:
+    """
+    Decodes `"sort":[...]}` of a hit at pos. Returns the sort values and
+    the position after the hit or None if pos is not the end of a hit.
+    """
+    try:
+        sort, end = _decoder.raw_decode(text, pos + len(_SORT) - 1)
+    except json.JSONDecodeError:
+        return None
+
+    if len(sort) != sort_size or text[end : end + 1] != "}":
+        return None
+    if text[end + 1 : end + 2] not in (",", "]"):
+        return None
+    return sort, end + 1
+
+
+def _is_balanced(text: str, start: int, end: int) -> bool:
+    """
+    Tells whether every object opened in text[start:end] is closed there.
+    Only the end of `_source` is balanced, a nested `"sort"` key is not.
+    """
+    chunk = text[start:end]
+    if '\\"' in chunk:
+        structure = _STRING_RE.sub("", chunk)
+    else:
+        # without escaped quotes every other part is inside a string
+        structure = "".join(chunk.split('"')[::2])
+    return structure.count("{") == structure.count("}")
+
+
+def parse_raw_response(text: str, sort_size: int, with_fields: bool = False) -> dict:
+    """
+    Parses a search response keeping `_source` of every hit as it was received.
+
+    Relies on the layout of hits produced by Elasticsearch:
+    {<metadata>,"_source":{...}[,"fields":{...}],"sort":[...]}.
+    Hits are returned as {"_source": <partial source built from fields>,
+    "_raw_source": <source JSON>, "sort": [...]}.
+    """
+    start = text.find(_HITS)
+    if start < 0:
+        return json.loads(text)
+
+    hits = []
+    pos = start + len(_HITS)
+    while text[pos] != "]":
+        if text[pos] == ",":
+            pos += 1
+
+        source_pos = text.find(_SOURCE, pos)
+        if source_pos < 0 or text.find(_SORT, pos, source_pos) >= 0:
+            raise ValueError(f"hit without _source at {pos}")
+        source_start = source_pos + len(_SOURCE)
+
+        sort_pos = source_start
+        while True:
+            sort_pos = text.find(_SORT, sort_pos + 1)
+            if sort_pos < 0:
+                raise ValueError(f"end of hit at {pos} not found")
+            tail = _parse_hit_tail(text, sort_pos, sort_size)
+            if tail is not None and _is_balanced(text, source_start, sort_pos):
+                break
+        sort, pos = tail
+
+        source_end = sort_pos
+        source = {}
+        if with_fields:
+            fields_pos = text.rfind(_FIELDS, source_start, sort_pos)
+            if fields_pos >= 0:
+                try:
+                    fields, end = _decoder.raw_decode(
+                        text, fields_pos + len(_FIELDS) - 1
+                    )
+                except json.JSONDecodeError:
+                    end = -1
+                if end == sort_pos:
+                    source = fields_to_source(fields)
+                    source_end = fields_pos
+
+        hits.append(
+            {
+                "_source": source,
+                RAW_SOURCE_FIELD: text[source_start:source_end],
+                "sort": sort,
+            }
+        )
+
+    result = json.loads(text[:start] + '"hits":[' + text[pos:])
+    result["hits"]["hits"] = hits
+    return result
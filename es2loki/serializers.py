@@ -0,0 +1,103 @@
+import json
+import math
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _finite(obj: Any) -> Any:
+    """Replaces NaN and infinities with None as orjson does"""
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+class JsonSerializer:
+    """
+    Standard library JSON encoder. By default produces the same output as
+    `json.dumps` (ASCII with `", "` and `": "` separators). Compact output is
+    UTF-8 without spaces and with NaN and infinities encoded as `null`,
+    the same as with the faster encoders.
+    """
+
+    name = "json"
+
+    def __init__(self, sort_keys: bool = True, compact: bool = False):
+        self.sort_keys = sort_keys
+        self.compact = compact
+
+    def dumps(self, obj: Any) -> str:
+        if not self.compact:
+            return json.dumps(obj, sort_keys=self.sort_keys)
+        try:
+            return self._dumps_compact(obj)
+        except ValueError:
+            # out of range floats
+            return self._dumps_compact(_finite(obj))
+
+    def _dumps_compact(self, obj: Any) -> str:
+        return json.dumps(
+            obj,
+            sort_keys=self.sort_keys,
+            separators=(",", ":"),
+            ensure_ascii=False,
+            allow_nan=False,
+        )
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        return self.dumps(obj).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonSerializer(JsonSerializer):
+    """
+    Parses with orjson. Encodes with orjson only in compact mode, since it
+    cannot produce the default `json.dumps` output.
+    """
+
+    name = "orjson"
+
+    def __init__(self, sort_keys: bool = True, compact: bool = False):
+        super().__init__(sort_keys=sort_keys, compact=compact)
+        self._option = orjson.OPT_SORT_KEYS if sort_keys else 0
+
+    def dumps(self, obj: Any) -> str:
+        if not self.compact:
+            return JsonSerializer.dumps(self, obj)
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def dumps_bytes(self, obj: Any) -> bytes:
+        if not self.compact:
+            return JsonSerializer.dumps(self, obj).encode("utf-8")
+        try:
+            return orjson.dumps(obj, option=self._option)
+        except TypeError:
+            # e.g. integers over 64 bits or non-string keys
+            return JsonSerializer.dumps(self, obj).encode("utf-8")
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+def make_serializer(
+    name: str = "auto", sort_keys: bool = True, compact: bool = False
+) -> JsonSerializer:
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_ENCODER=orjson requires orjson to be installed")
+        return OrjsonSerializer(sort_keys=sort_keys, compact=compact)
+    if name == "json":
+        return JsonSerializer(sort_keys=sort_keys, compact=compact)
+    raise ValueError("Unknown JSON_ENCODER. Possible values are: (auto, orjson, json)")
@@ -0,0 +1,334 @@
+import asyncio
+import functools
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from es2loki.aio import wait_task
+from es2loki.utils import size_str
+
+# metadata size, payload size, crc32 of metadata and payload
+HEADER = struct.Struct("<III")
+SEGMENT_SUFFIX = ".spool"
+
+
+class SpooledBatch:
+    """Stands in for a batch of which only the encoded payload is spooled"""
+
+    def __init__(self, meta: dict):
+        self.total_docs = meta["lines"]
+        self.total_size = meta["size"]
+        self.streams_count = meta["streams"]
+
+    def get_printable_stats(self) -> str:
+        return (
+            f"spooled batch of {self.streams_count} streams, "
+            f"{self.total_docs} entries, {size_str(self.total_size)}"
+        )
+
+
+class Segment:
+    def __init__(self, id_: int, path: str):
+        self.id = id_
+        self.path = path
+        self.size = 0
+        self.records = 0
+        self.read = 0
+        self.sealed = True
+        # the latest job of records read from this segment
+        self.last_job = -1
+
+
+def parse_record(buf, offset: int) -> Optional[tuple[dict, bytes, int]]:
+    """
+    Returns metadata and payload of the record at offset and the offset of
+    the next record or None if there is no complete valid record at offset
+    """
+    if offset + HEADER.size > len(buf):
+        return None
+    meta_size, payload_size, crc = HEADER.unpack_from(buf, offset)
+    start = offset + HEADER.size
+    end = start + meta_size + payload_size
+    if end > len(buf):
+        return None
+    with memoryview(buf) as view:
+        if zlib.crc32(view[start:end]) != crc:
+            return None
+        meta = json.loads(bytes(view[start : start + meta_size]))
+        payload = bytes(view[start + meta_size : end])
+    return meta, payload, end
+
+
+class Spool:
+    """
+    Append-only on-disk queue of encoded Loki payloads.
+
+    Every part of a batch is appended as a record with its metadata
+    ({"part", "parts", "state", ...}) to segment files of about `segment_size`
+    bytes, and records are read back in the same order through mmap.
+    A segment is deleted when all of its records have been read and their
+    jobs are acknowledged (see `mark` and `release`), so segments left by
+    a stopped or crashed run are replayed by the next one.
+
+    Files are written, synced and closed by a single writer thread, so that
+    the event loop does not wait for the disk and records keep their order.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 64 * 1024 * 1024,
+        max_size: int = 1024 * 1024 * 1024,
+    ):
+        self.directory = directory
+        self.segment_size = segment_size
+        # at least one sealed segment is over the limit, so that it can be released
+        self.max_size = max(max_size, 2 * segment_size)
+        self.logger = logging.getLogger("spool")
+
+        self._segments: dict[int, Segment] = {}
+        self._next_id = 0
+        self._size = 0
+        self._file = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spool")
+        self._write_lock = asyncio.Lock()
+        self._finished = False
+        self._written = asyncio.Event()
+        self._released = asyncio.Event()
+
+        self._read_segment: Optional[Segment] = None
+        self._read_offset = 0
+        self._map: Optional[mmap.mmap] = None
+
+    @property
+    def size(self) -> int:
+        """Bytes on disk"""
+        return self._size
+
+    @property
+    def pending(self) -> int:
+        """Records which have not been read yet"""
+        return sum(s.records - s.read for s in self._segments.values())
+
+    def _segment_path(self, id_: int) -> str:
+        return os.path.join(self.directory, f"{id_:010d}{SEGMENT_SUFFIX}")
+
+    def purge(self):
+        """Removes all segments, e.g. when the transfer starts over"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                os.remove(os.path.join(self.directory, name))
+        self.logger.warning("removed spooled records in %s", self.directory)
+
+    def open(self) -> Optional[dict]:
+        """
+        Loads segments left by a previous run. A torn record at the end of
+        the last segment is truncated along with the parts of a batch which
+        has not been spooled completely. Returns metadata of the last
+        spooled record or None if the spool is empty.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        ids = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+        # position after the last complete batch
+        complete: tuple[Optional[Segment], int, int] = (None, 0, 0)
+        last_meta = None
+        for id_ in ids:
+            segment = Segment(id_, self._segment_path(id_))
+            with open(segment.path, "rb") as f:
+                data = f.read()
+            offset = 0
+            while True:
+                record = parse_record(data, offset)
+                if record is None:
+                    break
+                meta, _, offset = record
+                segment.records += 1
+                if meta["part"] == meta["parts"] - 1:
+                    complete = (segment, offset, segment.records)
+                    last_meta = meta
+            segment.size = len(data)
+            self._segments[id_] = segment
+            self._next_id = id_ + 1
+
+        # drop everything after the last complete batch
+        last_segment, offset, records = complete
+        for segment in reversed(list(self._segments.values())):
+            if segment is last_segment:
+                if segment.size > offset:
+                    self.logger.warning(
+                        "truncating %s from %d to %d bytes",
+                        segment.path,
+                        segment.size,
+                        offset,
+                    )
+                    os.truncate(segment.path, offset)
+                    segment.size = offset
+                    segment.records = records
+                break
+            self.logger.warning("removing incomplete segment %s", segment.path)
+            os.remove(segment.path)
+            del self._segments[segment.id]
+
+        self._size = sum(s.size for s in self._segments.values())
+        if self._segments:
+            self.logger.info(
+                "%d records (%s) in %d segments left to push",
+                self.pending,
+                size_str(self._size),
+                len(self._segments),
+            )
+        return last_meta
+
+    async def wait_for_space(self, stop_event: asyncio.Event):
+        """
+        Waits until the spool is below max_size. Called before the first
+        part of a batch only, so that a batch is never split by waiting.
+        """
+        while self._size >= self.max_size and not stop_event.is_set():
+            self._released.clear()
+            await wait_task(self._released.wait(), event=stop_event)
+
+    async def append(self, meta: dict, payload: bytes):
+        """Writes a record. It may be read once it is written completely"""
+        meta_bytes = json.dumps(meta, separators=(",", ":")).encode()
+        crc = zlib.crc32(payload, zlib.crc32(meta_bytes))
+        record = HEADER.pack(len(meta_bytes), len(payload), crc) + meta_bytes + payload
+
+        async with self._write_lock:
+            segment = self._segments.get(self._next_id - 1)
+            if self._file is None or segment.size >= self.segment_size:
+                segment = await self._rotate()
+            # unbuffered, a crash loses at most the record being written
+            await self._run_writer(self._file.write, record)
+
+        segment.size += len(record)
+        segment.records += 1
+        self._size += len(record)
+        self._written.set()
+
+    async def _run_writer(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, fn, *args)
+
+    @staticmethod
+    def _close_file(file):
+        os.fsync(file.fileno())
+        file.close()
+
+    async def _seal(self):
+        if self._file is None:
+            return
+        file, self._file = self._file, None
+        await self._run_writer(self._close_file, file)
+        self._segments[self._next_id - 1].sealed = True
+
+    async def _rotate(self) -> Segment:
+        await self._seal()
+        segment = Segment(self._next_id, self._segment_path(self._next_id))
+        segment.sealed = False
+        self._file = await self._run_writer(
+            functools.partial(open, segment.path, "ab", buffering=0)
+        )
+        self._segments[segment.id] = segment
+        self._next_id += 1
+        return segment
+
+    async def finish(self):
+        """Seals the last segment. `read` returns None once it is read"""
+        async with self._write_lock:
+            await self._seal()
+        self._finished = True
+        self._written.set()
+
+    def close(self):
+        # waits for the writes in progress
+        self._writer.shutdown(wait=True)
+        if self._file is not None:
+            self._close_file(self._file)
+            self._file = None
+            self._segments[self._next_id - 1].sealed = True
+        self._unmap()
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _next_record(self) -> Optional[tuple[dict, bytes, Segment]]:
+        segment = self._read_segment
+        if segment is None or segment.read == segment.records:
+            if segment is not None and not segment.sealed:
+                # the segment is being written
+                return None
+            segment = next(
+                (s for s in self._segments.values() if s.read < s.records), None
+            )
+            if segment is None:
+                return None
+            self._unmap()
+            self._read_segment = segment
+            self._read_offset = 0
+
+        if self._map is None or len(self._map) < segment.size:
+            # the segment has grown since it was mapped
+            self._unmap()
+            with open(segment.path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        record = parse_record(self._map, self._read_offset)
+        if record is None:
+            raise ValueError(
+                f"corrupted record at {self._read_offset} of {segment.path}"
+            )
+        meta, payload, self._read_offset = record
+        segment.read += 1
+        return meta, payload, segment
+
+    async def read(
+        self, stop_event: asyncio.Event
+    ) -> Optional[tuple[dict, bytes, Segment]]:
+        """
+        Returns the next record with its segment, waiting for it to be
+        written, or None once the spool is finished and everything is read
+        """
+        while not stop_event.is_set():
+            self._written.clear()
+            record = self._next_record()
+            if record is not None:
+                return record
+            if self._finished:
+                return None
+            await wait_task(self._written.wait(), event=stop_event)
+        return None
+
+    @staticmethod
+    def mark(segment: Segment, job: int):
+        """Records the job a record read from the segment has been pushed with"""
+        segment.last_job = job
+
+    def release(self, watermark: int):
+        """Removes read segments with all of their jobs up to watermark done"""
+        for segment in list(self._segments.values()):
+            if not segment.sealed or segment.read < segment.records:
+                break
+            if segment.last_job > watermark:
+                break
+            if segment is self._read_segment:
+                self._unmap()
+                self._read_segment = None
+            os.remove(segment.path)
+            del self._segments[segment.id]
+            self._size -= segment.size
+            self._released.set()
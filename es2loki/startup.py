@@ -0,0 +1,59 @@
+import logging
+import os
+import time
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def process_age() -> Optional[float]:
+    """Seconds since the process has started or None where it is unknown"""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as f:
+            # fields after the command name, starttime is the 22nd field
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", encoding="ascii") as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """
+    Measures startup phases of a transfer (some of them run concurrently)
+    and the time until the first batch is acknowledged by Loki. Created at
+    the start of BaseTransfer.__init__, so that the time before it is spent
+    on interpreter startup and imports.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.before_init = process_age()
+        self.phases: dict[str, float] = {}
+        self.reported = False
+
+    def add(self, name: str, started: float):
+        self.phases[name] = time.monotonic() - started
+
+    async def timed(self, name: str, aw: Awaitable[T]) -> T:
+        started = time.monotonic()
+        try:
+            return await aw
+        finally:
+            self.add(name, started)
+
+    def get_printable_stats(self) -> str:
+        parts = []
+        if self.before_init is not None:
+            parts.append(f"imports: {self.before_init:.3f}s")
+        parts.extend(f"{name}: {took:.3f}s" for name, took in self.phases.items())
+        parts.append(f"total: {time.monotonic() - self.started:.3f}s")
+        return " ".join(parts)
+
+    def report(self, logger: logging.Logger, event: str):
+        """Logs the phases once, when the transfer reaches the event"""
+        if self.reported:
+            return
+        self.reported = True
+        logger.info("startup until %s: %s", event, self.get_printable_stats())
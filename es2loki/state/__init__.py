@@ -20,3 +20,6 @@ class StateStore:
 
     async def cleanup(self):
         pass
+
+    async def close(self):
+        pass
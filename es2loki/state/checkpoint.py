@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Hashable, Optional
+
+from es2loki.aio import wait_task
+from es2loki.profiler import StageProfiler
+from es2loki.state import State, StateStore
+
+
+class Checkpointer:
+    """
+    Saves acknowledged states in the background, coalescing them: a state
+    is saved `interval` seconds after it is added or as soon as `max_jobs`
+    jobs have been acknowledged since the last save, only the latest state
+    of every key (a state store) is saved. With `interval` of 0 states are
+    saved as soon as possible.
+    """
+
+    def __init__(
+        self,
+        interval: float = 1.0,
+        max_jobs: int = 100,
+        on_saved: Optional[Callable[[int, dict], None]] = None,
+        profiler: Optional[StageProfiler] = None,
+    ):
+        self.interval = interval
+        self.max_jobs = max_jobs
+        self.on_saved = on_saved
+        self.profiler = profiler
+        self.logger = logging.getLogger("checkpointer")
+        self.saves = 0
+
+        self._unsaved: dict[Hashable, tuple[StateStore, State, int]] = {}
+        self._jobs = 0
+        self._watermark = -1
+        self._pending = asyncio.Event()
+        self._due = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    def add(
+        self,
+        key: Hashable,
+        store: StateStore,
+        state: State,
+        transferred: int,
+        watermark: int,
+    ):
+        """Schedules saving of the state acknowledged up to watermark"""
+        self._unsaved[key] = (store, state, transferred)
+        self._jobs += 1
+        self._watermark = watermark
+        self._pending.set()
+        if not self.interval or 0 < self.max_jobs <= self._jobs:
+            self._due.set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            await self._pending.wait()
+            if not self._due.is_set():
+                await wait_task(asyncio.sleep(self.interval), event=self._due)
+            if not await self.flush() and not self._closing:
+                await wait_task(asyncio.sleep(1.0), event=self._due)
+
+    async def flush(self) -> bool:
+        """Saves pending states. Returns False if any of them failed"""
+        async with self._lock:
+            unsaved, watermark = self._unsaved, self._watermark
+            self._unsaved = {}
+            self._jobs = 0
+            self._pending.clear()
+            self._due.clear()
+            if not unsaved:
+                return True
+
+            started = time.perf_counter()
+            failed = {}
+            for key, (store, state, transferred) in unsaved.items():
+                try:
+                    await store.save(state, transferred)
+                except Exception as e:
+                    self.logger.exception("error saving state: %s", e)
+                    failed[key] = (store, state, transferred)
+            if self.profiler is not None:
+                self.profiler.lap("state_save", started)
+
+            if failed:
+                # states added in the meantime are newer
+                for key, item in failed.items():
+                    self._unsaved.setdefault(key, item)
+                self._pending.set()
+                return False
+
+            self.saves += 1
+            if self.on_saved is not None:
+                self.on_saved(watermark, unsaved)
+            return True
+
+    async def close(self):
+        """Stops the background task and saves what is left"""
+        self._closing = True
+        self._pending.set()
+        self._due.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
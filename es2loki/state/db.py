@@ -1,10 +1,35 @@
 import asyncio
+import logging
+from typing import Optional
 
-from tortoise import Model, Tortoise, fields
+from tortoise import BaseDBAsyncClient, Model, Tortoise, connections, fields
 
 from es2loki.state import State, StateStore
 
 
+async def init_db(
+    url: str, stop_event: asyncio.Event, logger: logging.Logger
+) -> Optional[BaseDBAsyncClient]:
+    """
+    Initializes Tortoise and creates the state table, retrying until it
+    succeeds or the event is set. Returns the default connection.
+    """
+    while not stop_event.is_set():
+        try:
+            await Tortoise.init(db_url=url, modules={"models": ["es2loki.state.db"]})
+            await Tortoise.generate_schemas()
+            logger.info("connected successfully to db")
+            return connections.get("default")
+        except Exception as e:
+            logger.error("error creating db: %s", e)
+            await asyncio.sleep(1.0)
+    return None
+
+
+async def close_db():
+    await Tortoise.close_connections()
+
+
 class StateModel(Model):
     class Meta:
         table = "state"
@@ -24,35 +49,41 @@ class StateModel(Model):
 
 
 class DBStateStore(StateStore):
+    """
+    Keeps states in a table of a database supported by Tortoise ORM.
+    A store given a `connection` (e.g. opened once by an orchestrator for
+    all of its jobs) uses it and leaves it open on close.
+    """
+
     def __init__(
         self,
         *,
         name: str,
         url: str = "postgres://127.0.0.1:5432/es2loki",
-        dry_run: bool = False
+        dry_run: bool = False,
+        connection: Optional[BaseDBAsyncClient] = None
     ):
         super().__init__(dry_run=dry_run)
         self._url = url
         self.name = name
+        self._connection = connection
+        self._owns_connection = False
 
-    async def connect(self, stop_event: asyncio.Event):
-        while not stop_event.is_set():
-            try:
-                await Tortoise.init(
-                    db_url=self._url, modules={"models": ["es2loki.state.db"]}
-                )
-                await Tortoise.generate_schemas()
-                self.logger.error("connected successfully to db")
-                return
-            except Exception as e:
-                self.logger.error("error creating db: %s", e)
-                await asyncio.sleep(1.0)
+    async def connect(self, stop_event: asyncio.Event) -> bool:
+        self._connection = await init_db(self._url, stop_event, self.logger)
+        self._owns_connection = self._connection is not None
+        return self._owns_connection
 
     async def init(self, stop_event: asyncio.Event):
-        await self.connect(stop_event)
+        if self._connection is None:
+            await self.connect(stop_event)
 
     async def load(self) -> State:
-        row = await StateModel.filter(name=self.name).get_or_none()
+        row = (
+            await StateModel.filter(name=self.name)
+            .using_db(self._connection)
+            .get_or_none()
+        )
         if row is None:
             return State()
         return row.to_state()
@@ -68,11 +99,23 @@ class DBStateStore(StateStore):
             self.logger.info("[DRY_RUN] saving state to db")
         else:
             self.logger.info("saving state to db")
-            await m.save(update_fields=["timestamp", "log_offset", "transferred"])
+            # a single INSERT ... ON CONFLICT (name) DO UPDATE
+            await StateModel.bulk_create(
+                [m],
+                on_conflict=["name"],
+                update_fields=["timestamp", "value", "transferred"],
+                using_db=self._connection,
+            )
 
     async def cleanup(self):
         if self.dry_run:
             self.logger.info("[DRY_RUN] cleaning up state %s", self.name)
         else:
             self.logger.info("cleaning up state %s", self.name)
-            await StateModel.filter(name=self.name).delete()
+            await StateModel.filter(name=self.name).using_db(self._connection).delete()
+
+    async def close(self):
+        if not self._owns_connection:
+            return
+        self._owns_connection = False
+        await close_db()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+import urllib.parse
+from typing import Optional, TextIO
+
+from es2loki.state import State, StateStore
+
+
+class FileStateStore(StateStore):
+    """
+    Keeps the state in a local journal file: every save appends a JSON line
+    which is fsynced at most every `fsync_interval` seconds, the journal is
+    compacted to its last line once it grows over `max_size` bytes.
+    """
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        directory: str = "state",
+        fsync_interval: float = 1.0,
+        max_size: int = 1024 * 1024,
+        dry_run: bool = False,
+    ):
+        super().__init__(dry_run=dry_run)
+        self.name = name
+        self.directory = directory
+        self.path = os.path.join(
+            directory, urllib.parse.quote(name, safe="") + ".state"
+        )
+        self.fsync_interval = fsync_interval
+        self.max_size = max_size
+        self._f: Optional[TextIO] = None
+        self._synced_at = 0.0
+        self._dirty = False
+
+    async def init(self, stop_event: asyncio.Event):
+        os.makedirs(self.directory, exist_ok=True)
+
+    async def load(self) -> State:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return State()
+
+        for line in reversed(lines):
+            try:
+                return State(**json.loads(line))
+            except ValueError:
+                # the line torn by a crash
+                continue
+        return State()
+
+    def _open(self):
+        if self._f is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._f = open(self.path, "a", encoding="utf-8")
+            if self._f.tell() and not self._ends_with_newline():
+                # a line torn by a crash must not be joined with the next one
+                self._f.write("\n")
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _sync(self):
+        os.fsync(self._f.fileno())
+        self._synced_at = time.monotonic()
+        self._dirty = False
+
+    def _compact(self, line: str):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self._f.close()
+        os.replace(tmp_path, self.path)
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._synced_at = time.monotonic()
+        self._dirty = False
+
+    async def save(self, state: State, transferred_docs: int):
+        if self.dry_run:
+            self.logger.info("[DRY_RUN] saving state to %s", self.path)
+            return
+
+        line = json.dumps(
+            {
+                "timestamp": state.timestamp,
+                "transferred": transferred_docs,
+                "value": state.value,
+            }
+        )
+        line += "\n"
+
+        self._open()
+        self._f.write(line)
+        # the line survives a crash of the process, fsync covers the host
+        self._f.flush()
+        self._dirty = True
+        loop = asyncio.get_running_loop()
+        if self._f.tell() >= self.max_size:
+            await loop.run_in_executor(None, self._compact, line)
+        elif time.monotonic() - self._synced_at >= self.fsync_interval:
+            await loop.run_in_executor(None, self._sync)
+
+    async def cleanup(self):
+        if self.dry_run:
+            self.logger.info("[DRY_RUN] cleaning up state %s", self.name)
+            return
+
+        self.logger.info("cleaning up state %s", self.name)
+        await self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        if self._f is None:
+            return
+        if self._dirty:
+            self._sync()
+        self._f.close()
+        self._f = None
@@ -1,12 +1,12 @@
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import Optional, Union
 
 
 @dataclass
 class State:
     timestamp: Optional[str] = None
     transferred: int = 0
-    value: list = field(default_factory=list)
+    value: Union[list, dict] = field(default_factory=list)
 
     @property
     def iszero(self):
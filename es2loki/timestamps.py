@@ -0,0 +1,165 @@
+import datetime
+from typing import Optional, Union
+
+NS_PER_SECOND = 1_000_000_000
+NS_PER_DAY = 24 * 60 * 60 * NS_PER_SECOND
+
+# multipliers converting a fraction of a second of N digits to nanoseconds
+FRACTION_NS = {n: 10 ** (9 - n) for n in range(1, 10)}
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+EPOCH_DATE = EPOCH.date()
+
+
+def datetime_to_ns(dt: datetime.datetime) -> int:
+    """
+    Converts datetime to integer nanoseconds since epoch keeping microseconds.
+    Naive datetimes are treated as UTC.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    delta = dt - EPOCH
+    return (
+        delta.days * NS_PER_DAY
+        + delta.seconds * NS_PER_SECOND
+        + delta.microseconds * 1000
+    )
+
+
+def ns_to_datetime(ns: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=ns // 1000)
+
+
+class TimestampParser:
+    """
+    Parses timestamps in the common ES formats straight to integer nanoseconds:
+    ISO-8601 (with `Z`, an offset or naive which is treated as UTC), epoch millis
+    and epoch nanos (as numbers or strings). The `YYYY-MM-DDTHH:MM:SS` prefix
+    is cached, so for the usual case only the fraction of a second is parsed.
+    """
+
+    def __init__(self, cache_size: int = 4096):
+        self.cache_size = cache_size
+        self._seconds: dict[str, int] = {}
+        self._days: dict[str, int] = {}
+        self._months: dict[int, str] = {}
+
+    def parse(self, value: Union[str, int, float, datetime.datetime]) -> Optional[int]:
+        cls = value.__class__
+        if cls is str:
+            if not value:
+                return None
+            if value.isdigit():
+                return self._parse_epoch(int(value))
+            return self.parse_iso(value)
+
+        if cls is int or cls is float:
+            return self._parse_epoch(value)
+
+        if isinstance(value, datetime.datetime):
+            return datetime_to_ns(value)
+
+        raise ValueError(f"unsupported timestamp value: {value!r}")
+
+    @staticmethod
+    def _parse_epoch(value: Union[int, float]) -> int:
+        # millis cover dates till year 5138, nanos start from year 1973
+        if value >= 10**17:
+            return int(value)
+        if value >= 10**14:
+            return int(value * 1000)
+        return int(value * 1_000_000)
+
+    def parse_iso(self, value: str) -> int:
+        prefix = value[:19]
+        ns = self._seconds.get(prefix)
+        if ns is None:
+            try:
+                ns = self._parse_iso_full(prefix)
+            except (ValueError, IndexError):
+                return self._parse_iso_slow(value)
+
+            if len(self._seconds) >= self.cache_size:
+                self._seconds.clear()
+            self._seconds[prefix] = ns
+
+        # fast path for the usual `Z` and `.fffZ`-like suffixes
+        suffix = value[19:]
+        if not suffix or suffix == "Z":
+            return ns
+        if suffix[0] == "." and suffix[-1] == "Z":
+            fraction = suffix[1:-1]
+            if fraction.isdigit() and len(fraction) <= 9:
+                return ns + int(fraction) * FRACTION_NS[len(fraction)]
+
+        try:
+            return self._parse_iso_full(value)
+        except (ValueError, IndexError):
+            return self._parse_iso_slow(value)
+
+    def _parse_iso_full(self, value: str) -> int:
+        ns = self._parse_date(value[:10])
+
+        length = len(value)
+        if length == 10:
+            return ns
+
+        if value[10] not in "T " or value[13] != ":" or value[16] != ":":
+            raise ValueError(value)
+
+        seconds = int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])
+        ns += seconds * NS_PER_SECOND
+
+        pos = 19
+        if pos < length and value[pos] in ".,":
+            end = pos + 1
+            while end < length and value[end].isdigit():
+                end += 1
+            fraction = value[pos + 1 : end]
+            if not fraction:
+                raise ValueError(value)
+            ns += int(fraction[:9].ljust(9, "0"))
+            pos = end
+
+        if pos == length or value[pos:] == "Z":
+            return ns
+
+        sign = value[pos]
+        if sign not in "+-":
+            raise ValueError(value)
+
+        offset = value[pos + 1 :].replace(":", "")
+        if len(offset) not in (2, 4) or not offset.isdigit():
+            raise ValueError(value)
+
+        offset_seconds = int(offset[:2]) * 3600 + int(offset[2:] or 0) * 60
+        if sign == "+":
+            return ns - offset_seconds * NS_PER_SECOND
+        return ns + offset_seconds * NS_PER_SECOND
+
+    def _parse_date(self, date: str) -> int:
+        ns = self._days.get(date)
+        if ns is None:
+            day = datetime.date.fromisoformat(date)
+            ns = (day - EPOCH_DATE).days * NS_PER_DAY
+            if len(self._days) >= self.cache_size:
+                self._days.clear()
+            self._days[date] = ns
+        return ns
+
+    @staticmethod
+    def _parse_iso_slow(value: str) -> int:
+        dt = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        return datetime_to_ns(dt)
+
+    def month(self, ns: int) -> str:
+        """Returns `YYYYMM` of the timestamp"""
+        days = ns // NS_PER_DAY
+        month = self._months.get(days)
+        if month is None:
+            day = EPOCH_DATE + datetime.timedelta(days=days)
+            month = f"{day.year:04d}{day.month:02d}"
+            if len(self._months) >= self.cache_size:
+                self._months.clear()
+            self._months[days] = month
+        return month
@@ -0,0 +1,39 @@
+import pickle
+import signal
+from typing import TYPE_CHECKING
+
+from es2loki.loki import LokiBatch
+
+if TYPE_CHECKING:
+    from es2loki.commands.transfer import BaseTransfer
+
+# copies of the transfers whose documents the worker has transformed, by job
+_transfers: dict[str, "BaseTransfer"] = {}
+
+
+def init_worker():
+    """Initializer of a transform worker process"""
+    # shutdown is driven by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.set_wakeup_fd(-1)
+
+
+def transform_hits(
+    hits: list[dict], batch_cls: type[LokiBatch], job: str, transfer: bytes
+) -> LokiBatch:
+    """
+    Transforms a page of ES hits into a batch of streams grouped by labels
+    that can be merged into the main process batch. The hooks of the user's
+    BaseTransfer subclass are run on a copy of the `job`'s transfer, which
+    is unpickled from `transfer` once per worker, as workers may be shared
+    by jobs of an orchestrator.
+    """
+    job_transfer = _transfers.get(job)
+    if job_transfer is None:
+        job_transfer = _transfers[job] = pickle.loads(transfer)
+
+    batch = batch_cls()
+    for doc in hits:
+        job_transfer.transform_doc(doc, batch)
+    return batch
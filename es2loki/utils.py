@@ -1,5 +1,7 @@
 import gzip
 import io
+import os
+import sys
 
 
 def seconds_to_str(seconds: int) -> str:
@@ -44,9 +46,47 @@ def size_str(size: int) -> str:
     return f"{size:.2f}b"
 
 
+INTERVAL_UNITS_MS = {
+    "ms": 1,
+    "s": 1000,
+    "m": 60 * 1000,
+    "h": 60 * 60 * 1000,
+    "d": 24 * 60 * 60 * 1000,
+}
+
+
+def interval_to_ms(interval: str) -> int:
+    """
+    Converts ES fixed interval to milliseconds
+    500ms -> 500
+    30s -> 30000
+    1d -> 86400000
+    """
+    for unit in ("ms", "s", "m", "h", "d"):
+        value = interval[: -len(unit)]
+        if interval.endswith(unit) and value.isdigit():
+            return int(value) * INTERVAL_UNITS_MS[unit]
+    raise ValueError(f"unsupported interval: {interval}")
+
+
 def gzip_encode(content: bytes) -> bytes:
     out = io.BytesIO()
     f = gzip.GzipFile(fileobj=out, mode="w", compresslevel=5)
     f.write(content)
     f.close()
     return out.getvalue()
+
+
+def current_rss() -> int:
+    """
+    Resident set size of the process in bytes.
+    Falls back to the peak RSS where /proc is not available
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
@@ -0,0 +1,48 @@
+import asyncio
+
+from es2loki.aio import Prefetch
+
+
+class Source:
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.closed = False
+        self.cancelled = False
+        self.items = iter(range(3))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> int:
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        try:
+            return next(self.items)
+        except StopIteration:
+            raise StopAsyncIteration()
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_prefetch_yields_all_items():
+    async def run():
+        return [item async for item in Prefetch(Source())]
+
+    assert asyncio.run(run()) == [0, 1, 2]
+
+
+def test_prefetch_is_cancelled_on_close():
+    async def run():
+        source = Source(delay=60)
+        prefetch = Prefetch(source)
+        await asyncio.sleep(0)
+        await prefetch.aclose()
+        return source
+
+    source = asyncio.run(run())
+    assert source.cancelled
+    assert source.closed
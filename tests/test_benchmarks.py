@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+import aiohttp
+from aiohttp import web
+
+from benchmarks.docs import generate_hits
+from benchmarks.stand_ins import FakeElasticsearch
+from es2loki.raw import RAW_SOURCE_FIELD, parse_raw_response
+
+
+def test_hits_are_deterministic_and_sorted():
+    for kind in ("filebeat", "packetbeat"):
+        hits = list(generate_hits(kind, 100))
+
+        assert hits == list(generate_hits(kind, 100))
+        assert hits != list(generate_hits(kind, 100, seed=1))
+        sort_keys = [hit["sort"] for hit in hits]
+        assert sort_keys == sorted(sort_keys)
+
+
+def test_stand_in_pages_through_all_hits():
+    hits = list(generate_hits("filebeat", 25))
+
+    async def run() -> list[dict]:
+        es = FakeElasticsearch(hits)
+        runner = web.AppRunner(es.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 0).start()
+        url = f"http://127.0.0.1:{runner.addresses[0][1]}/idx/_search"
+
+        received = []
+        body = {"size": 10, "fields": [{"field": "host.name"}]}
+        try:
+            async with aiohttp.ClientSession() as session:
+                while True:
+                    async with session.post(url, json=body) as resp:
+                        text = await resp.text()
+                    # responses are laid out like the ones of ES
+                    page = parse_raw_response(text, sort_size=2, with_fields=True)
+                    page_hits = page["hits"]["hits"]
+                    if not page_hits:
+                        return received
+                    received.extend(page_hits)
+                    body["search_after"] = page_hits[-1]["sort"]
+        finally:
+            await runner.cleanup()
+
+    received = asyncio.run(run())
+    assert [hit["sort"] for hit in received] == [hit["sort"] for hit in hits]
+    for hit, expected in zip(received, hits):
+        assert json.loads(hit[RAW_SOURCE_FIELD]) == expected["_source"]
+        assert hit["_source"] == {"host": {"name": expected["_source"]["host"]["name"]}}
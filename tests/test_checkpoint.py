@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from es2loki import BaseTransfer
+from es2loki.state import State, StateStore
+from es2loki.state.checkpoint import Checkpointer
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.saved: list[tuple[State, int]] = []
+        self.failures = failures
+
+    async def load(self) -> State:
+        if not self.saved:
+            return State()
+        state, transferred = self.saved[-1]
+        return State(
+            timestamp=state.timestamp, transferred=transferred, value=state.value
+        )
+
+    async def save(self, state: State, transferred_docs: int):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk is full")
+        self.saved.append((state, transferred_docs))
+
+
+def test_states_are_coalesced():
+    async def run():
+        store = MemoryStateStore()
+        saved = []
+        checkpointer = Checkpointer(
+            interval=3600, max_jobs=3, on_saved=lambda w, s: saved.append(w)
+        )
+        checkpointer.start()
+        for job in range(3):
+            checkpointer.add(None, store, State(timestamp=str(job)), job + 1, job)
+        await asyncio.sleep(0.01)
+        await checkpointer.close()
+        return store, saved
+
+    store, saved = asyncio.run(run())
+    # only the latest state of 3 jobs is saved, once
+    assert store.saved == [(State(timestamp="2"), 3)]
+    assert saved == [2]
+
+
+def test_failed_save_is_retried_with_newer_state():
+    async def run():
+        store = MemoryStateStore(failures=1)
+        saved = []
+        checkpointer = Checkpointer(on_saved=lambda w, s: saved.append(w))
+
+        checkpointer.add(None, store, State(timestamp="0"), 1, 0)
+        assert not await checkpointer.flush()
+        # nothing is released until the state is saved
+        assert saved == []
+
+        checkpointer.add(None, store, State(timestamp="1"), 2, 1)
+        assert await checkpointer.flush()
+        return store, saved
+
+    store, saved = asyncio.run(run())
+    assert store.saved == [(State(timestamp="1"), 2)]
+    assert saved == [1]
+
+
+def test_failed_save_is_retried_on_close():
+    async def run():
+        store = MemoryStateStore(failures=1)
+        checkpointer = Checkpointer()
+        checkpointer.add(None, store, State(timestamp="0"), 1, 0)
+        assert not await checkpointer.flush()
+        await checkpointer.close()
+        return store
+
+    assert asyncio.run(run()).saved == [(State(timestamp="0"), 1)]
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.setenv("ELASTIC_INDEX", "idx")
+    monkeypatch.setenv("STATE_MODE", "none")
+
+
+def test_watermark_is_not_saved_ahead_of_completed_jobs(env):
+    async def run():
+        transfer = BaseTransfer()
+        await transfer.es.close()
+        store = MemoryStateStore()
+        transfer.state_store = store
+        transfer._pending_jobs = {
+            job: (State(timestamp=str(job), value=[job]), 10, None) for job in range(3)
+        }
+
+        # jobs 0 and 1 are acknowledged, job 2 is still being pushed
+        await transfer.on_loki_jobs_complete(1)
+        await transfer.checkpointer.flush()
+        return store, transfer
+
+    store, transfer = asyncio.run(run())
+    assert store.saved == [(State(timestamp="1", value=[1]), 20)]
+    assert list(transfer._pending_jobs) == [2]
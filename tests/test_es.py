@@ -0,0 +1,230 @@
+import asyncio
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig
+from elasticsearch import NotFoundError
+
+from es2loki.es import (
+    ElasticsearchScroller,
+    SlicedElasticsearchScroller,
+    is_pit_missing,
+    make_time_windows,
+    sort_fields,
+)
+
+
+def pit_missing_error() -> NotFoundError:
+    meta = ApiResponseMeta(
+        status=404,
+        http_version="1.1",
+        headers=HttpHeaders(),
+        duration=0.0,
+        node=NodeConfig("http", "localhost", 9200),
+    )
+    body = {
+        "error": {"root_cause": [{"type": "search_context_missing_exception"}]},
+        "status": 404,
+    }
+    return NotFoundError("search_context_missing_exception", meta, body)
+
+
+class FakeES:
+    """Serves `n` documents split into slices by id, expiring PITs on demand"""
+
+    def __init__(self, n: int):
+        self.docs = [
+            {"_id": str(i), "_source": {"@timestamp": i, "n": i}} for i in range(n)
+        ]
+        self.opened = []
+        self.closed = []
+        self.expire_after = None
+        self.searches = 0
+
+    async def open_point_in_time(self, index, keep_alive):
+        pit_id = f"pit{len(self.opened)}"
+        self.opened.append(pit_id)
+        return {"id": pit_id}
+
+    async def close_point_in_time(self, id):
+        self.closed.append(id)
+
+    async def search(self, size, pit, slice, sort, search_after=None, **kwargs):
+        self.searches += 1
+        if search_after is not None and len(search_after) != len(sort) + 1:
+            # ES adds the _shard_doc tiebreaker to searches over a point-in-time
+            raise ValueError("search_after has a different size than sort")
+        if self.searches == self.expire_after:
+            # every open PIT expires at once, as after a long pause
+            self.closed.extend(p for p in self.opened if p not in self.closed)
+        if pit["id"] in self.closed:
+            raise pit_missing_error()
+
+        hits = []
+        for doc in self.docs:
+            key = [doc["_source"]["@timestamp"], int(doc["_id"])]
+            if int(doc["_id"]) % slice["max"] != slice["id"]:
+                continue
+            if search_after is not None and key <= search_after:
+                continue
+            hits.append({**doc, "sort": key})
+            if len(hits) >= size:
+                break
+        return {
+            "hits": {"hits": hits},
+            "_shards": {"total": 1, "successful": 1, "failed": 0},
+            "pit_id": pit["id"],
+        }
+
+
+def make_scroller(
+    es: FakeES, stop_event: asyncio.Event, search_after=None
+) -> SlicedElasticsearchScroller:
+    return SlicedElasticsearchScroller(
+        es=es,
+        es_index="idx",
+        es_batch_size=3,
+        stop_event=stop_event,
+        make_sort=lambda: [{"@timestamp": "asc"}],
+        make_search_after=lambda: search_after,
+        timestamp_field="@timestamp",
+        slices=2,
+    )
+
+
+def test_is_pit_missing():
+    assert is_pit_missing(pit_missing_error())
+    assert is_pit_missing({"reason": {"type": "search_context_missing_exception"}})
+    assert not is_pit_missing(ValueError("search_context_missing_exception"))
+    assert not is_pit_missing({"reason": {"type": "es_rejected_execution"}})
+
+
+def test_expired_pit_is_reopened():
+    async def run():
+        es = FakeES(20)
+        es.expire_after = 4
+        docs = []
+        async for doc, _ in make_scroller(es, asyncio.Event()):
+            docs.append(int(doc["_id"]))
+        return es, docs
+
+    es, docs = asyncio.run(run())
+    # slices continue from their search_after, without gaps or duplicates
+    assert sorted(docs) == list(range(20))
+    # reopened once for both slices
+    assert es.opened == ["pit0", "pit1"]
+    assert es.closed == ["pit0", "pit1"]
+
+
+def test_pit_is_closed_on_stop():
+    async def run():
+        es = FakeES(20)
+        stop_event = asyncio.Event()
+        scroller = make_scroller(es, stop_event)
+        async for _ in scroller:
+            stop_event.set()
+        await scroller.aclose()
+        return es
+
+    es = asyncio.run(run())
+    assert es.closed == ["pit0"]
+
+
+def test_sliced_scroll_resumes_from_non_sliced_state():
+    async def run():
+        docs = []
+        async for doc, _ in make_scroller(FakeES(20), asyncio.Event(), [9]):
+            docs.append(int(doc["_id"]))
+        return docs
+
+    assert sorted(asyncio.run(run())) == list(range(10, 20))
+
+
+def test_scroller_close_cancels_background_fetch():
+    class SlowES:
+        async def search(self, **kwargs):
+            await asyncio.sleep(3600)
+
+    async def run():
+        scroller = ElasticsearchScroller(
+            es=SlowES(),
+            es_index="idx",
+            es_batch_size=10,
+            stop_event=asyncio.Event(),
+            make_sort=lambda: [{"@timestamp": "asc"}],
+            make_search_after=lambda: None,
+            timestamp_field="@timestamp",
+        )
+        assert scroller.prefetch()
+        task = scroller._buffer_refill_coro
+        await asyncio.sleep(0)
+        await scroller.aclose()
+        return task
+
+    assert asyncio.run(run()).cancelled()
+
+
+def test_hit_sort_size_counts_pit_tiebreaker():
+    def make(pit, sort):
+        return ElasticsearchScroller(
+            es=None,
+            es_index="idx",
+            es_batch_size=10,
+            stop_event=asyncio.Event(),
+            make_sort=lambda: sort,
+            make_search_after=lambda: None,
+            timestamp_field="@timestamp",
+            pit=pit,
+        )
+
+    sort = [{"@timestamp": "asc"}, {"log.offset": "asc"}]
+    assert make(None, sort)._hit_sort_size == 2
+    assert make({"id": "pit0"}, sort)._hit_sort_size == 3
+    assert make({"id": "pit0"}, sort + [{"_shard_doc": "asc"}])._hit_sort_size == 3
+
+
+class HistogramES:
+    def __init__(self, buckets: list[tuple[int, int]]):
+        self.buckets = buckets
+        self.queries = []
+
+    async def search(self, query, aggs, **kwargs):
+        self.queries.append(query)
+        buckets = [{"key": k, "doc_count": c} for k, c in self.buckets]
+        return {"aggregations": {"windows": {"buckets": buckets}}}
+
+
+def test_time_windows():
+    day = 24 * 3600 * 1000
+    es = HistogramES([(0, 10), (day, 1), (2 * day, 1), (5 * day, 10)])
+
+    windows = asyncio.run(
+        make_time_windows(
+            es, "idx", "@timestamp", "1d", max_date="1970-01-10", min_docs=2
+        )
+    )
+
+    assert [(w.start, w.end, w.docs) for w in windows] == [
+        ("1970-01-01T00:00:00+00:00", "1970-01-02T00:00:00+00:00", 10),
+        ("1970-01-02T00:00:00+00:00", "1970-01-04T00:00:00+00:00", 2),
+        ("1970-01-06T00:00:00+00:00", "1970-01-10", 10),
+    ]
+
+
+def test_last_time_window_is_open_ended():
+    day = 24 * 3600 * 1000
+    es = HistogramES([(0, 10), (day, 10)])
+
+    windows = asyncio.run(make_time_windows(es, "idx", "@timestamp", "1d"))
+
+    assert windows[-1].end is None
+    assert windows[-1].name == "1970-01-02T00:00:00+00:00.."
+
+
+def test_sort_fields():
+    sort = [
+        {"@timestamp": {"order": "asc"}},
+        {"log.offset": "asc"},
+        "host.name",
+        {"_shard_doc": "asc"},
+        "_doc",
+    ]
+    assert sort_fields(sort) == ["@timestamp", "log.offset", "host.name"]
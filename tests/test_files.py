@@ -0,0 +1,180 @@
+import asyncio
+import gzip
+import json
+from typing import Optional
+
+import pytest
+
+from es2loki.files import DONE, FileReader, FileScroller, expand_paths
+from es2loki.serializers import make_serializer
+from es2loki.state.types import State
+
+
+def doc(n: int) -> dict:
+    return {"@timestamp": f"2022-01-01T00:00:{n % 60:02d}Z", "n": n}
+
+
+def hit(n: int) -> dict:
+    return {"_index": "idx", "_id": str(n), "_source": doc(n)}
+
+
+@pytest.fixture
+def paths(tmp_path) -> list[str]:
+    """
+    Four files of 100 documents each: elasticdump hits, gzipped hits with
+    blank lines, search responses of 7 hits and bare documents
+    """
+    with open(tmp_path / "a.ndjson", "w") as f:
+        for n in range(0, 100):
+            f.write(json.dumps(hit(n)) + "\n")
+    with gzip.open(tmp_path / "b.ndjson.gz", "wt") as f:
+        for n in range(100, 200):
+            f.write(json.dumps(hit(n)) + "\n\n")
+    with open(tmp_path / "c.ndjson", "w") as f:
+        for n in range(200, 300, 7):
+            hits = [hit(i) for i in range(n, min(n + 7, 300))]
+            f.write(json.dumps({"took": 1, "hits": {"hits": hits}}) + "\n")
+    with open(tmp_path / "d.ndjson", "w") as f:
+        for n in range(300, 400):
+            f.write(json.dumps(doc(n)) + "\n")
+    return expand_paths([str(tmp_path / "*.ndjson"), str(tmp_path / "*.gz")])
+
+
+def read(
+    paths: list[str],
+    state: Optional[State] = None,
+    limit: Optional[int] = None,
+    workers: int = 1,
+    page_size: int = 1024,
+) -> list[tuple[int, State]]:
+    """Reads documents up to `limit` and stops as a transfer would"""
+
+    async def run():
+        stop_event = asyncio.Event()
+        scroller = FileScroller(
+            paths, stop_event, state=state, workers=workers, page_size=page_size
+        )
+        docs = []
+        async for hit_, doc_state in scroller:
+            docs.append((hit_["_source"]["n"], doc_state))
+            if limit is not None and len(docs) >= limit:
+                stop_event.set()
+        return docs
+
+    return asyncio.run(run())
+
+
+def saved(state: State) -> State:
+    """The state as it is loaded after being saved"""
+    value = json.loads(json.dumps(state.value))
+    return State(timestamp=state.timestamp, value=value, transferred=0)
+
+
+def test_expand_paths(paths, tmp_path):
+    assert [p.rsplit("/", 1)[1] for p in paths] == [
+        "a.ndjson",
+        "b.ndjson.gz",
+        "c.ndjson",
+        "d.ndjson",
+    ]
+    with pytest.raises(ValueError):
+        expand_paths([str(tmp_path / "*.missing")])
+
+
+def test_reader_positions(tmp_path):
+    path = tmp_path / "hits.ndjson"
+    lines = [
+        json.dumps(hit(0)),
+        json.dumps({"hits": {"hits": [hit(1), hit(2), hit(3)]}}),
+        json.dumps(hit(4)),
+    ]
+    path.write_text("\n".join(lines) + "\n")
+    second = len(lines[0]) + 1
+    third = second + len(lines[1]) + 1
+
+    reader = FileReader(str(path), [0, 0], make_serializer())
+    reader.open()
+    page, read_bytes, eof = reader.read_page(1024 * 1024)
+    reader.close()
+
+    assert eof
+    assert read_bytes == third + len(lines[2]) + 1
+    # a position points either after the line or to the next hit of the line
+    assert [(h["_source"]["n"], p) for h, p in page] == [
+        (0, [second, 0]),
+        (1, [second, 1]),
+        (2, [second, 2]),
+        (3, [third, 0]),
+        (4, [read_bytes, 0]),
+    ]
+
+
+def test_reader_resumes_inside_a_line(tmp_path):
+    path = tmp_path / "hits.ndjson"
+    path.write_text(
+        json.dumps({"hits": {"hits": [hit(1), hit(2), hit(3)]}})
+        + "\n"
+        + json.dumps(hit(4))
+        + "\n"
+    )
+
+    reader = FileReader(str(path), [0, 2], make_serializer())
+    reader.open()
+    page, _, _ = reader.read_page(1024 * 1024)
+    reader.close()
+
+    assert [h["_source"]["n"] for h, _ in page] == [3, 4]
+
+
+def test_all_documents_are_read(paths):
+    docs = read(paths)
+
+    assert [n for n, _ in docs] == list(range(400))
+    last = docs[-1][1]
+    assert last.timestamp == doc(399)["@timestamp"]
+    assert last.value["files"][paths[-1]][0] > 0
+
+
+def test_finished_files_are_completed_in_order(paths):
+    docs = read(paths)
+
+    # a file becomes `completed` once it and all files before it are finished
+    completed = [s.value["completed"] for _, s in docs]
+    assert completed[0] is None
+    assert completed[100] == paths[0]
+    assert completed[200] == paths[1]
+    assert paths[0] not in docs[200][1].value["files"]
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("cut", [1, 99, 100, 150, 201, 205, 299, 399])
+def test_resume_from_any_document(paths, workers, cut):
+    first = read(paths, limit=cut, workers=workers, page_size=256)[:cut]
+
+    rest = read(paths, state=saved(first[-1][1]), workers=workers, page_size=256)
+
+    read_first = [n for n, _ in first]
+    read_rest = [n for n, _ in rest]
+    # nothing is lost or read twice
+    assert sorted(read_first + read_rest) == list(range(400))
+
+
+def test_completed_transfer_reads_nothing(paths):
+    last = read(paths)[-1][1]
+    assert read(paths, state=saved(last)) == []
+
+
+def test_done_file_is_skipped(paths):
+    state = State(
+        timestamp="2022-01-01T00:00:00Z",
+        value={"completed": None, "files": {paths[1]: [DONE, 0]}},
+        transferred=0,
+    )
+    docs = [n for n, _ in read(paths, state=state)]
+    assert docs == list(range(100)) + list(range(200, 400))
+
+
+def test_state_of_another_source(paths):
+    state = State(timestamp="2022-01-01", value=["2022-01-01", 1], transferred=1)
+    with pytest.raises(ValueError):
+        read(paths, state=state)
@@ -0,0 +1,47 @@
+import pickle
+import subprocess
+import sys
+
+from es2loki.labels import LabelsInterner, StreamLabels, labels_to_str
+
+
+def test_least_recently_used_labels_are_evicted():
+    interner = LabelsInterner(max_size=2)
+    a = interner.intern({"job": "a"})
+    b = interner.intern({"job": "b"})
+    assert interner.intern({"job": "a"}) is a
+
+    interner.intern({"job": "c"})
+
+    assert interner.cardinality == 2
+    assert interner.evictions == 1
+    # a was used after b, so b is evicted
+    assert interner.intern({"job": "a"}) is a
+    b2 = interner.intern({"job": "b"})
+    assert b2 is not b
+    assert b2 != a and b2 == b and hash(b2) == hash(b)
+    assert (interner.hits, interner.misses, interner.evictions) == (2, 4, 2)
+
+
+def test_labels_are_unpickled_with_hash_of_this_process():
+    # string hashes are randomized per process
+    code = (
+        "import pickle, sys\n"
+        "from es2loki.labels import LabelsInterner\n"
+        "labels = LabelsInterner().intern({'job': 'test', 'host': 'a'})\n"
+        "sys.stdout.buffer.write(pickle.dumps(labels))\n"
+    )
+    data = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        env={"PYTHONHASHSEED": "1", "PYTHONPATH": ":".join(sys.path)},
+    ).stdout
+
+    labels = pickle.loads(data)
+
+    assert isinstance(labels, StreamLabels)
+    assert labels.labels_str == labels_to_str({"job": "test", "host": "a"})
+    local = LabelsInterner().intern({"job": "test", "host": "a"})
+    assert hash(labels) == hash(local)
+    assert labels in {local: 1}
@@ -0,0 +1,321 @@
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from aiohttp import web
+
+from es2loki.dead_letter import DeadLetter
+from es2loki.loki import (
+    Backoff,
+    Loki,
+    LokiBatch,
+    LokiPushError,
+    decode_batch,
+    parse_rate_limit,
+    parse_retry_after,
+)
+
+
+def test_backoff_delay_is_capped_for_any_attempt():
+    backoff = Backoff(base=0.5, max_delay=60)
+    for attempt in (0, 10, 1100, 10**6):
+        assert 0 < backoff.delay(attempt) <= 60
+
+
+def test_backoff_honors_retry_after():
+    assert Backoff(base=0.5, max_delay=1).delay(100, retry_after=30) == 30
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
+@pytest.mark.parametrize(
+    "body,limit",
+    [
+        ("Ingestion rate limit exceeded (limit: 4194304 bytes/sec) while", 4194304),
+        ("Per stream rate limit exceeded (limit: 3MB/sec) while", 3_000_000),
+        ("Per stream rate limit exceeded (limit: 1.5 MiB/sec) while", 1572864),
+        ("entry too far behind", None),
+    ],
+)
+def test_parse_rate_limit(body, limit):
+    assert parse_rate_limit(body) == limit
+
+
+async def _push_to_limited_loki(entries: list[str], max_body: int, throttled: int = 0):
+    """
+    Pushes entries to a Loki stand-in rejecting bodies over max_body
+    and the first `throttled` requests with 429
+    """
+    accepted = []
+    requests = 0
+
+    async def push(request):
+        nonlocal requests
+        requests += 1
+        body = await request.read()
+        if len(body) > max_body or requests <= throttled:
+            return web.Response(status=429, text="ingestion rate limit exceeded")
+        for stream in json.loads(body)["streams"]:
+            accepted.extend(value[1] for value in stream["values"])
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/loki/api/v1/push", push)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    dead_letter = DeadLetter()
+    loki = Loki(
+        url=f"http://127.0.0.1:{port}",
+        use_pb=False,
+        use_gzip=False,
+        backoff=Backoff(base=0, max_delay=0),
+        rate_limit_retries=2,
+        dead_letter=dead_letter,
+    )
+    batch = loki.make_batch()
+    for i, entry in enumerate(entries):
+        batch.push(labels={"job": "test"}, timestamp=i + 1, entry=entry)
+    try:
+        await loki.push(batch, stop_event=asyncio.Event())
+    finally:
+        await loki.session.close()
+        await runner.cleanup()
+    return accepted, dead_letter
+
+
+def test_batch_over_burst_is_split_after_rate_limit_retries():
+    entries = [f"line {i} " + "x" * 100 for i in range(20)]
+    accepted, dead_letter = asyncio.run(_push_to_limited_loki(entries, 1000))
+    assert sorted(accepted) == sorted(entries)
+    assert dead_letter.dropped == 0
+
+
+def test_rate_limited_entries_are_never_dropped():
+    entries = ["first", "second"]
+    accepted, dead_letter = asyncio.run(
+        _push_to_limited_loki(entries, 1000, throttled=10)
+    )
+    # split after 3 responses with 429, single entries are retried until accepted
+    assert accepted == entries
+    assert dead_letter.dropped == 0
+
+
+async def _push_to_picky_loki(entries: list[str], dead_letter: DeadLetter):
+    """Pushes entries to a Loki stand-in rejecting bodies with "bad" lines with 400"""
+    accepted = []
+    dropped = []
+
+    async def push(request):
+        streams = json.loads(await request.read())["streams"]
+        lines = [value[1] for stream in streams for value in stream["values"]]
+        if any(line.startswith("bad") for line in lines):
+            return web.Response(status=400, text="entry too far behind")
+        accepted.extend(lines)
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post("/loki/api/v1/push", push)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    loki = Loki(
+        url=f"http://127.0.0.1:{port}",
+        use_pb=False,
+        use_gzip=False,
+        dead_letter=dead_letter,
+    )
+    batch = loki.make_batch()
+    for i, entry in enumerate(entries):
+        batch.push(labels={"job": str(i % 3)}, timestamp=i + 1, entry=entry)
+    try:
+        await loki.push(batch, stop_event=asyncio.Event(), on_dropped=dropped.append)
+    finally:
+        dead_letter.close()
+        await loki.session.close()
+        await runner.cleanup()
+    return accepted, dropped
+
+
+def test_rejected_entry_is_isolated_to_dead_letter(tmp_path):
+    entries = [f"line {i}" for i in range(10)]
+    entries[6] = "bad line"
+    path = tmp_path / "dead_letter.jsonl"
+    dead_letter = DeadLetter(path=str(path))
+
+    accepted, dropped = asyncio.run(_push_to_picky_loki(entries, dead_letter))
+
+    assert sorted(accepted) == sorted(e for e in entries if e != "bad line")
+    assert dropped == [1]
+    assert dead_letter.dropped == 1
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["line"], r["status"], r["labels"]) for r in records] == [
+        ("bad line", 400, {"job": "0"})
+    ]
+
+
+def test_rejections_stop_once_dead_letter_is_full():
+    entries = ["bad 1", "line", "bad 2"]
+    dead_letter = DeadLetter(max_entries=1)
+
+    with pytest.raises(LokiPushError):
+        asyncio.run(_push_to_picky_loki(entries, dead_letter))
+    assert dead_letter.dropped == 1
+
+
+def test_base_batch_serializes_to_both_formats():
+    from es2loki.proto.logproto_pb2 import PushRequest
+
+    batch = LokiBatch()
+    batch.push(labels={"job": "test"}, timestamp=1_500_000_000, entry="line")
+
+    assert json.loads(batch.serialize()) == {
+        "streams": [{"stream": {"job": "test"}, "values": [["1500000000", "line"]]}]
+    }
+    req = PushRequest.FromString(batch.serialize_pb())
+    assert req.streams[0].labels == '{job="test"}'
+    assert req.streams[0].entries[0].timestamp.ToNanoseconds() == 1_500_000_000
+
+
+@pytest.mark.parametrize("use_pb", [True, False])
+def test_push_mode_batch_serializes_like_base_batch(use_pb):
+    loki = Loki(url="http://127.0.0.1:1", use_pb=use_pb, use_gzip=False)
+    batch = loki.make_batch()
+    base = LokiBatch()
+    for b in (batch, base):
+        b.push(labels={"job": "test"}, timestamp=1_500_000_000, entry="line 1")
+        b.push(labels={"job": "other"}, timestamp=1_500_000_001, entry="line 2")
+
+    assert type(batch) is not LokiBatch
+    if use_pb:
+        assert batch.serialize() == base.serialize_pb()
+    else:
+        assert batch.serialize() == base.serialize()
+
+
+def test_push_json_is_deprecated():
+    loki = Loki(url="http://127.0.0.1:1", dry_run=True, use_pb=False, use_gzip=False)
+    batch = loki.make_batch()
+    batch.push(labels={"job": "test"}, timestamp=1, entry="line")
+
+    with pytest.warns(DeprecationWarning):
+        status, _ = asyncio.run(loki.push_json(batch, stop_event=asyncio.Event()))
+    assert status == 200
+
+
+def make_batch(entries: list[tuple[str, str]]) -> LokiBatch:
+    batch = LokiBatch()
+    for i, (stream, line) in enumerate(entries):
+        batch.push(labels={"stream": stream}, timestamp=i, entry=line)
+    return batch
+
+
+def batch_lines(batch: LokiBatch) -> list[str]:
+    return [line for _, _, line in batch.iter_entries()]
+
+
+def test_cut_batch_by_size():
+    batch = make_batch([("a", "1" * 10), ("a", "2" * 10), ("b", "3" * 10)])
+
+    head, tail = batch.cut(25)
+
+    assert batch_lines(head) == ["1" * 10, "2" * 10]
+    assert batch_lines(tail) == ["3" * 10]
+    assert (head.total_size, head.total_docs) == (20, 2)
+    assert (tail.total_size, tail.total_docs) == (10, 1)
+
+
+def test_cut_keeps_entries_in_order():
+    batch = make_batch([("a", "1" * 10), ("b", "2" * 30), ("a", "3" * 10)])
+
+    head, tail = batch.cut(25)
+
+    # the rest of stream a stays in the batch, as its entries are ordered
+    assert batch_lines(head) == ["1" * 10, "3" * 10]
+    assert batch_lines(tail) == ["2" * 30]
+
+
+def test_cut_takes_min_docs():
+    batch = make_batch([("a", "1" * 10), ("a", "2" * 10)])
+
+    head, tail = batch.cut(5)
+    assert head.total_docs == 0
+    assert tail.total_docs == 2
+
+    head, tail = batch.cut(5, min_docs=1)
+    assert batch_lines(head) == ["1" * 10]
+    assert batch_lines(tail) == ["2" * 10]
+
+
+def assert_counters(batch: LokiBatch):
+    lines = batch_lines(batch)
+    assert batch.total_docs == len(lines)
+    assert batch.total_size == sum(len(line) for line in lines)
+
+
+def test_counters_follow_batch_changes():
+    batch = make_batch([("a", "1"), ("b", "22"), ("a", "333")])
+    assert (batch.total_docs, batch.total_size) == (3, 6)
+
+    batch.merge(make_batch([("b", "4444"), ("c", "55555")]))
+    assert_counters(batch)
+    assert (batch.total_docs, batch.total_size) == (5, 15)
+
+    parts = [part for _, part in batch.split(3)]
+    for part in parts:
+        assert_counters(part)
+    assert sum(part.total_size for part in parts) == 15
+
+    for part in batch.bisect():
+        assert_counters(part)
+    # a single stream is bisected by entries
+    for part in make_batch([("a", "1"), ("a", "22"), ("a", "333")]).bisect():
+        assert_counters(part)
+
+
+@pytest.mark.parametrize("executor_cls", [ThreadPoolExecutor, ProcessPoolExecutor])
+@pytest.mark.parametrize(
+    "use_pb,use_gzip", [(True, False), (False, True), (False, False)]
+)
+def test_batch_encoded_in_executor(executor_cls, use_pb, use_gzip):
+    entries = [("a", "line 1"), ("b", "line 2"), ("a", "line 3")]
+
+    async def encode(executor=None) -> bytes:
+        loki = Loki(
+            url="http://127.0.0.1:1",
+            use_pb=use_pb,
+            use_gzip=use_gzip,
+            executor=executor,
+        )
+        batch = loki.make_batch()
+        for i, (stream, line) in enumerate(entries):
+            batch.push(labels={"stream": stream}, timestamp=i + 1, entry=line)
+        return await loki.encode(batch)
+
+    with executor_cls(max_workers=1) as executor:
+        data = asyncio.run(encode(executor))
+
+    batch = decode_batch(data, use_pb=use_pb, use_gzip=use_gzip)
+    assert [
+        (labels.labels["stream"], ts, line) for labels, ts, line in batch.iter_entries()
+    ] == [
+        ("a", 1, "line 1"),
+        ("a", 3, "line 3"),
+        ("b", 2, "line 2"),
+    ]
+    if not use_gzip:
+        # gzip output has a timestamp
+        assert data == asyncio.run(encode())
@@ -0,0 +1,76 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from es2loki.metrics import Counter, Gauge, Histogram, MetricsServer, Registry
+
+
+def test_render_counter_and_gauge():
+    registry = Registry()
+    pushes = registry.add(Counter("pushes_total", "Loki pushes", ("status",)))
+    registry.add(Gauge("progress", "Progress", fn=lambda: 0.5))
+    pushes.inc(status="204")
+    pushes.inc(2, status="204")
+    pushes.inc(status='a "b"\n')
+
+    assert registry.render() == (
+        "# HELP pushes_total Loki pushes\n"
+        "# TYPE pushes_total counter\n"
+        'pushes_total{status="204"} 3\n'
+        'pushes_total{status="a \\"b\\"\\n"} 1\n'
+        "# HELP progress Progress\n"
+        "# TYPE progress gauge\n"
+        "progress 0.5\n"
+    )
+
+
+def test_labeled_gauge_reads_values_on_render():
+    values = {("a",): 1}
+    gauge = Gauge("lag", "Lag", ("stage",), fn=lambda: values)
+    values[("b",)] = 2.0
+
+    assert gauge.render().splitlines()[2:] == ['lag{stage="a"} 1', 'lag{stage="b"} 2']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency", "Latency", buckets=(1, 0.1))
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert histogram.render().splitlines()[2:] == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        "latency_sum 5.65",
+        "latency_count 4",
+    ]
+
+
+def test_metric_is_registered_once():
+    registry = Registry()
+    registry.add(Counter("docs_total", "Documents"))
+
+    with pytest.raises(ValueError):
+        registry.add(Gauge("docs_total", "Documents"))
+
+
+def test_server_serves_registry():
+    registry = Registry()
+    registry.add(Counter("docs_total", "Documents")).inc(5)
+
+    async def run():
+        server = MetricsServer(registry, host="127.0.0.1", port=0)
+        await server.start()
+        port = server._runner.addresses[0][1]
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                    return resp.status, resp.headers["Content-Type"], await resp.text()
+        finally:
+            await server.stop()
+
+    status, content_type, text = asyncio.run(run())
+    assert status == 200
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "docs_total 5\n" in text
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from es2loki import BaseTransfer, TransferOrchestrator
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("STATE_MODE", "none")
+    monkeypatch.setenv("JOBS_CONCURRENCY", "2")
+
+
+class FakeJob(BaseTransfer):
+    started: list[str] = []
+    running = 0
+    max_running = 0
+
+    async def execute(self):
+        cls = FakeJob
+        cls.started.append(self.es_index)
+        cls.running += 1
+        cls.max_running = max(cls.max_running, cls.running)
+        try:
+            await asyncio.sleep(0.01)
+            if self.es_index == "bad":
+                raise ValueError("bad index")
+            self.transferred_docs = self.total_docs = len(self.es_index)
+        finally:
+            cls.running -= 1
+
+
+def test_jobs_run_in_order_with_limited_concurrency():
+    FakeJob.started = []
+    FakeJob.max_running = 0
+    orchestrator = TransferOrchestrator(FakeJob, indices=["a", "bb", "bad", "ccc"])
+
+    with pytest.raises(RuntimeError, match="1 of 4 jobs failed: bad"):
+        asyncio.run(orchestrator.execute())
+
+    assert FakeJob.started == ["a", "bb", "bad", "ccc"]
+    assert FakeJob.max_running == 2
+    assert orchestrator.done == {"a", "bb", "ccc"}
+    assert list(orchestrator.failed) == ["bad"]
+    assert orchestrator.finished == {
+        "a": (1, 1),
+        "bb": (2, 2),
+        "bad": (0, 0),
+        "ccc": (3, 3),
+    }
+    assert orchestrator._job_counts() == {
+        "pending": 0,
+        "running": 0,
+        "done": 3,
+        "failed": 1,
+    }
+
+
+def test_jobs_share_clients():
+    jobs = []
+
+    class SharingJob(BaseTransfer):
+        async def execute(self):
+            jobs.append(self)
+
+    orchestrator = TransferOrchestrator(SharingJob, indices=["a", "b", "c"])
+    asyncio.run(orchestrator.execute())
+
+    assert len(jobs) == 3
+    assert all(job.es is jobs[0].es for job in jobs)
+    assert all(job.loki.session is jobs[0].loki.session for job in jobs)
+    assert orchestrator.shared.loki_session.closed
+
+
+@pytest.mark.parametrize("indices", [[], [" ", ""], ["a", "a"]])
+def test_invalid_indices(indices):
+    with pytest.raises(ValueError):
+        TransferOrchestrator(BaseTransfer, indices=indices)
+
+
+def test_indices_from_env(monkeypatch):
+    monkeypatch.setenv("ELASTIC_INDICES", "logs-a-*,logs-b-*; logs-c-* ;")
+
+    orchestrator = TransferOrchestrator()
+
+    assert orchestrator.indices == ["logs-a-*,logs-b-*", "logs-c-*"]
@@ -0,0 +1,67 @@
+from es2loki.page_size import PageSizeController
+
+# index.max_result_window of ES, the largest page a search may request
+ES_MAX_RESULT_WINDOW = 10000
+
+
+def test_initial_size_is_clamped():
+    assert PageSizeController(size=50, min_size=100).size == 100
+    assert PageSizeController(size=50000).size == ES_MAX_RESULT_WINDOW
+
+
+def test_grows_up_to_max_result_window():
+    page_size = PageSizeController(size=1000)
+    sizes = []
+    for _ in range(20):
+        page_size.on_success(docs=page_size.size, latency=0.1, nbytes=1000)
+        sizes.append(page_size.size)
+
+    assert sizes[:3] == [1500, 2250, 3375]
+    assert max(sizes) == ES_MAX_RESULT_WINDOW
+    assert page_size.changes["grow"] == 6
+
+
+def test_short_page_does_not_grow():
+    page_size = PageSizeController(size=1000)
+    page_size.on_success(docs=10, latency=0.1)
+    assert page_size.size == 1000
+
+
+def test_no_growth_near_targets():
+    page_size = PageSizeController(size=1000, target_latency=1.0)
+    page_size.on_success(docs=1000, latency=0.8)
+    assert page_size.size == 1000
+
+
+def test_shrinks_to_targets():
+    page_size = PageSizeController(size=4000, target_latency=1.0, target_bytes=1000)
+
+    page_size.on_success(docs=4000, latency=2.0)
+    assert (page_size.size, page_size.last_reason) == (2000, "latency")
+
+    page_size.on_success(docs=2000, latency=0.5, nbytes=4000)
+    assert (page_size.size, page_size.last_reason) == (500, "bytes")
+
+
+def test_never_below_min_size():
+    page_size = PageSizeController(size=1000, min_size=100)
+    for on_error in (
+        page_size.on_timeout,
+        page_size.on_partial_shards,
+        page_size.on_rejected,
+    ):
+        for _ in range(10):
+            on_error()
+        assert page_size.size == 100
+
+    page_size.on_success(docs=100, latency=1000.0)
+    assert page_size.size == 100
+
+
+def test_halved_over_max_memory(monkeypatch):
+    monkeypatch.setattr("es2loki.page_size.current_rss", lambda: 2000)
+    page_size = PageSizeController(size=1000, max_memory=1000)
+
+    page_size.on_success(docs=1000, latency=0.1)
+
+    assert (page_size.size, page_size.last_reason) == (500, "memory")
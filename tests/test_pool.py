@@ -0,0 +1,129 @@
+import asyncio
+import logging
+
+from es2loki.aio.pool import AsyncPool, CompletionTracker
+
+
+def test_watermark_follows_sequential_jobs():
+    tracker = CompletionTracker()
+    assert tracker.watermark == -1
+
+    job = tracker.new_job()
+    assert tracker.watermark == -1
+    assert tracker.part_done(job)
+    assert tracker.watermark == 0
+
+
+def test_out_of_order_completion():
+    tracker = CompletionTracker()
+    jobs = [tracker.new_job() for _ in range(3)]
+
+    assert not tracker.part_done(jobs[2])
+    assert not tracker.part_done(jobs[1])
+    assert tracker.watermark == -1
+
+    assert tracker.part_done(jobs[0])
+    assert tracker.watermark == 2
+
+
+def test_job_with_parts_waits_for_all_of_them():
+    tracker = CompletionTracker()
+    first = tracker.new_job(parts=2)
+    second = tracker.new_job()
+
+    assert not tracker.part_done(first)
+    assert not tracker.part_done(second)
+    assert tracker.watermark == -1
+
+    assert tracker.part_done(first)
+    assert tracker.watermark == 1
+
+
+def test_failed_part_holds_watermark():
+    tracker = CompletionTracker()
+    first = tracker.new_job(parts=2)
+    jobs = [tracker.new_job() for _ in range(3)]
+
+    # the second part of the first job never completes
+    tracker.part_done(first)
+    for job in jobs:
+        tracker.part_done(job)
+    assert tracker.watermark == -1
+
+
+def test_empty_job_is_done_at_once():
+    tracker = CompletionTracker()
+    tracker.new_job()
+    tracker.new_job(parts=0)
+    assert tracker.watermark == -1
+
+    tracker.part_done(0)
+    assert tracker.watermark == 1
+
+
+def test_pool_reports_watermark_and_skips_failed_jobs():
+    watermarks = []
+
+    async def worker(i):
+        if i == 1:
+            raise ValueError("failed")
+        await asyncio.sleep(0.001 * (3 - i))
+
+    async def on_complete(watermark):
+        watermarks.append(watermark)
+
+    async def main():
+        pool = AsyncPool(
+            num_workers=3,
+            name="test",
+            logger=logging.getLogger("test"),
+            worker_co=worker,
+            partitioned=True,
+            on_complete=on_complete,
+        )
+        pool.start()
+        for i in range(3):
+            await pool.push(i, partition=i, job=pool.new_job())
+        await pool.join()
+        return pool
+
+    pool = asyncio.run(main())
+    assert pool.exceptions
+    # job 1 has failed, so job 2 is never acknowledged
+    assert watermarks == [0]
+    assert pool.completed_watermark == 0
+
+
+def test_partition_items_are_processed_in_order():
+    processed = {0: [], 1: [], 2: []}
+    running = 0
+    max_running = 0
+
+    async def worker(item):
+        nonlocal running, max_running
+        partition, i = item
+        running += 1
+        max_running = max(max_running, running)
+        # later items of a partition are faster, so they would overtake earlier ones
+        await asyncio.sleep(0.001 * (10 - i))
+        processed[partition].append(i)
+        running -= 1
+
+    async def main():
+        pool = AsyncPool(
+            num_workers=3,
+            name="test",
+            logger=logging.getLogger("test"),
+            worker_co=worker,
+            partitioned=True,
+        )
+        pool.start()
+        for i in range(10):
+            for partition in processed:
+                await pool.push((partition, i), partition=partition)
+        await pool.join()
+
+    asyncio.run(main())
+    assert processed == {partition: list(range(10)) for partition in processed}
+    # partitions are pushed concurrently
+    assert max_running == 3
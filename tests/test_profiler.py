@@ -0,0 +1,66 @@
+import asyncio
+import os
+import signal
+import time
+
+import pytest
+
+from es2loki.metrics import Histogram
+from es2loki.profiler import StageProfiler
+
+
+def test_snapshot_merges_sources():
+    profiler = StageProfiler()
+    profiler.add("encode_line", 1.5)
+    started = profiler.lap("batch_push", time.perf_counter() - 0.5)
+    profiler.add_source(lambda: {"loki_push": 2.0})
+
+    assert started <= time.perf_counter()
+    stages = profiler.snapshot()
+    assert stages["encode_line"] == 1.5
+    assert stages["batch_push"] >= 0.5
+    assert stages["loki_push"] == 2.0
+
+
+def test_format_breakdown():
+    assert StageProfiler.format_breakdown(
+        {"es_fetch": 1.0, "loki_push": 3.0}, elapsed=4.0, docs=1000
+    ) == (
+        "1000 docs in 04s, loki_push 3.000s (75.0% 3000.0us/doc), "
+        "es_fetch 1.000s (25.0% 1000.0us/doc)"
+    )
+
+
+@pytest.mark.skipif(os.name == "nt", reason="SIGUSR1 is not available")
+def test_event_loop_lag_is_measured():
+    profiler = StageProfiler(lag_interval=0.01)
+    profiler.lag = Histogram("lag", "Event loop lag")
+
+    async def run():
+        profiler.start(docs=lambda: 0)
+        assert signal.getsignal(signal.SIGUSR1) is not signal.SIG_DFL
+        await asyncio.sleep(0.02)
+        # blocks the event loop
+        time.sleep(0.1)
+        await asyncio.sleep(0.02)
+        await profiler.stop()
+        # stopping twice does nothing
+        await profiler.stop()
+
+    asyncio.run(run())
+    assert profiler._lag_max >= 0.05
+    assert profiler.lag._count >= 2
+    assert signal.getsignal(signal.SIGUSR1) is signal.SIG_DFL
+
+
+def test_dump_is_written_on_second_toggle(tmp_path):
+    profiler = StageProfiler(dump_dir=str(tmp_path))
+
+    profiler.toggle_dump()
+    sum(range(1000))
+    profiler.toggle_dump()
+
+    assert sorted(path.suffix for path in tmp_path.iterdir()) == [
+        ".prof",
+        ".tracemalloc",
+    ]
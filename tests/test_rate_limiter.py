@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from es2loki.aio import rate_limiter
+from es2loki.aio.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+def test_burst_is_available_at_once(clock):
+    bucket = TokenBucket(rate=100, burst=200, clock=clock)
+
+    assert asyncio.run(bucket.acquire(200)) == 0
+    assert asyncio.run(bucket.acquire(50)) == pytest.approx(0.5)
+
+
+def test_amount_over_burst_is_charged_in_full(clock):
+    bucket = TokenBucket(rate=100, burst=200, clock=clock)
+
+    # waits for the burst only, the rest is a debt
+    assert asyncio.run(bucket.acquire(1000)) == 0
+    assert bucket.tokens == pytest.approx(-800)
+
+    # the next acquire waits for the debt to be repaid
+    assert asyncio.run(bucket.acquire(100)) == pytest.approx(9)
+    assert clock.now == pytest.approx(9)
+
+
+def test_average_rate_is_kept_for_large_amounts(clock):
+    bucket = TokenBucket(rate=100, burst=100, clock=clock)
+
+    async def run():
+        for _ in range(10):
+            await bucket.acquire(500)
+
+    asyncio.run(run())
+    # 5000 tokens at 100/s: the first 100 are in the bucket,
+    # the debt of the last 400 delays the next acquire
+    assert clock.now == pytest.approx(45)
+    assert bucket.tokens == pytest.approx(-400)
+
+
+def test_refill_is_capped_by_burst(clock):
+    bucket = TokenBucket(rate=100, burst=200, clock=clock)
+    asyncio.run(bucket.acquire(200))
+
+    clock.now += 60
+    assert bucket.tokens == pytest.approx(200)
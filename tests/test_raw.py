@@ -0,0 +1,114 @@
+import json
+
+import pytest
+
+from es2loki.raw import RAW_SOURCE_FIELD, parse_raw_response
+
+
+def make_response(hits: list[dict]) -> str:
+    return json.dumps(
+        {
+            "took": 1,
+            "timed_out": False,
+            "hits": {"total": {"value": len(hits)}, "hits": hits},
+        },
+        separators=(",", ":"),
+    )
+
+
+def make_hit(i: int, source: dict, sort: list, fields: dict = None) -> dict:
+    hit = {"_index": "idx", "_id": str(i), "_score": None, "_source": source}
+    if fields is not None:
+        hit["fields"] = fields
+    hit["sort"] = sort
+    return hit
+
+
+def test_sources_are_kept_verbatim():
+    sources = [{"message": "a", "n": 1}, {"message": "b", "n": 2}]
+    text = make_response(
+        [make_hit(i, s, ["2022-01-01", i]) for i, s in enumerate(sources)]
+    )
+
+    result = parse_raw_response(text, 2)
+
+    hits = result["hits"]["hits"]
+    assert [json.loads(h[RAW_SOURCE_FIELD]) for h in hits] == sources
+    assert [h["sort"] for h in hits] == [["2022-01-01", 0], ["2022-01-01", 1]]
+    assert result["hits"]["total"] == {"value": 2}
+
+
+def test_point_in_time_tiebreaker():
+    # searches over a point-in-time append the `_shard_doc` value to sort
+    text = make_response(
+        [make_hit(i, {"n": i}, ["2022-01-01", i, 1000 + i]) for i in range(3)]
+    )
+
+    hits = parse_raw_response(text, 3)["hits"]["hits"]
+
+    assert [h["sort"] for h in hits] == [["2022-01-01", i, 1000 + i] for i in range(3)]
+    assert [json.loads(h[RAW_SOURCE_FIELD]) for h in hits] == [
+        {"n": i} for i in range(3)
+    ]
+
+
+def test_unexpected_sort_size():
+    text = make_response([make_hit(0, {"n": 0}, ["2022-01-01", 0, 1000])])
+    with pytest.raises(ValueError):
+        parse_raw_response(text, 2)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        'quoted "text"',
+        "braces } ] { [",
+        'fake tail "}],"sort":["x",1]},{',
+        'escaped \\" and \\\\',
+        ',"sort":["2022-01-01",0]}',
+        ',"fields":{"a":["b"]}',
+    ],
+)
+def test_sources_with_special_characters(message: str):
+    sources = [{"message": message, "nested": {"m": message}}, {"message": "next"}]
+    text = make_response(
+        [make_hit(i, s, ["2022-01-01", i]) for i, s in enumerate(sources)]
+    )
+
+    hits = parse_raw_response(text, 2)["hits"]["hits"]
+
+    assert [json.loads(h[RAW_SOURCE_FIELD]) for h in hits] == sources
+    assert [h["sort"] for h in hits] == [["2022-01-01", 0], ["2022-01-01", 1]]
+
+
+def test_fields_are_split_from_source():
+    source = {"message": ',"fields":{"x":[1]}', "host": {"name": "a"}}
+    text = make_response(
+        [make_hit(0, source, ["2022-01-01", 0], fields={"host.name": ["a"]})]
+    )
+
+    hit = parse_raw_response(text, 2, with_fields=True)["hits"]["hits"][0]
+
+    assert json.loads(hit[RAW_SOURCE_FIELD]) == source
+    assert hit["_source"] == {"host": {"name": "a"}}
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        {"sort": ["2022-01-01", 5], "n": 0},
+        {"n": 0, "sort": ["2022-01-01", 5]},
+        {"order": {"id": 1, "sort": ["2022-01-01", 5]}, "n": 0},
+        {"items": [{"id": 1, "sort": ["2022-01-01", 5]}, {"_index": "idx"}]},
+    ],
+)
+def test_source_with_nested_sort_key(source: dict):
+    sources = [source, {"message": "next"}]
+    text = make_response(
+        [make_hit(i, s, ["2022-01-01", i]) for i, s in enumerate(sources)]
+    )
+
+    hits = parse_raw_response(text, 2)["hits"]["hits"]
+
+    assert [json.loads(h[RAW_SOURCE_FIELD]) for h in hits] == sources
+    assert [h["sort"] for h in hits] == [["2022-01-01", 0], ["2022-01-01", 1]]
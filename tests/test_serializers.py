@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from es2loki.serializers import JsonSerializer, make_serializer
+
+DOC = {
+    "c": [1, 2, {"z": None, "a": True}],
+    "b": 'привет "quoted" \\ {braces}',
+    "a": {"nested": 1.5, "int": 2**40},
+    "nan": float("nan"),
+    "inf": [float("inf"), float("-inf")],
+}
+
+
+def test_default_format_is_json_dumps():
+    serializer = make_serializer("json")
+    doc = {k: v for k, v in DOC.items() if k not in ("nan", "inf")}
+    assert serializer.dumps(doc) == json.dumps(doc, sort_keys=True)
+    assert serializer.dumps({"x": float("nan")}) == '{"x": NaN}'
+
+
+def test_compact_format():
+    serializer = make_serializer("json", compact=True)
+    assert serializer.dumps({"c": [1, 2], "b": "п"}) == '{"b":"п","c":[1,2]}'
+    assert serializer.dumps({"x": float("nan")}) == '{"x":null}'
+
+
+def test_unsorted_keys():
+    serializer = JsonSerializer(sort_keys=False, compact=True)
+    assert serializer.dumps({"b": 1, "a": 2}) == '{"b":1,"a":2}'
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("sort_keys", [False, True])
+def test_backends_give_the_same_output(compact, sort_keys):
+    pytest.importorskip("orjson")
+    stdlib = make_serializer("json", sort_keys=sort_keys, compact=compact)
+    fast = make_serializer("orjson", sort_keys=sort_keys, compact=compact)
+    assert fast.dumps(DOC) == stdlib.dumps(DOC)
+    assert fast.dumps_bytes(DOC) == stdlib.dumps_bytes(DOC)
+
+
+def test_orjson_falls_back_on_unsupported_values():
+    pytest.importorskip("orjson")
+    doc = {"big": 2**70, "nan": float("nan")}
+    stdlib = make_serializer("json", compact=True)
+    fast = make_serializer("orjson", compact=True)
+    assert (
+        fast.dumps(doc)
+        == stdlib.dumps(doc)
+        == '{"big":1180591620717411303424,"nan":null}'
+    )
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+from es2loki.spool import HEADER, Spool
+
+
+def meta(batch: int, part: int = 0, parts: int = 1) -> dict:
+    return {
+        "part": part,
+        "parts": parts,
+        "batch": batch,
+        "state": {"timestamp": str(batch), "value": [batch]},
+    }
+
+
+def write(spool: Spool, records: list[tuple[dict, bytes]], finish: bool = True):
+    async def run():
+        spool.open()
+        for m, payload in records:
+            await spool.append(m, payload)
+        if finish:
+            await spool.finish()
+
+    asyncio.run(run())
+
+
+def read_all(spool: Spool) -> list[tuple[dict, bytes]]:
+    async def run():
+        await spool.finish()
+        records = []
+        while True:
+            record = await spool.read(asyncio.Event())
+            if record is None:
+                return records
+            m, payload, _ = record
+            records.append((m, payload))
+
+    return asyncio.run(run())
+
+
+def segments(directory) -> list[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+
+def test_records_are_read_in_order(tmp_path):
+    records = [(meta(i), f"payload {i}".encode() * 100) for i in range(20)]
+    spool = Spool(str(tmp_path), segment_size=4096)
+    write(spool, records)
+    assert len(segments(tmp_path)) > 1
+
+    assert read_all(spool) == records
+    spool.close()
+
+
+def test_replay_after_crash(tmp_path):
+    records = [(meta(i), b"x" * 100) for i in range(10)]
+    # the process dies without sealing the segment
+    write(Spool(str(tmp_path)), records, finish=False)
+
+    spool = Spool(str(tmp_path))
+    assert spool.open() == records[-1][0]
+    assert spool.pending == 10
+    assert read_all(spool) == records
+    spool.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    records = [(meta(i), b"x" * 100) for i in range(3)]
+    write(Spool(str(tmp_path)), records)
+    (path,) = segments(tmp_path)
+    size = os.path.getsize(path)
+    record_size = size // 3
+    os.truncate(path, size - record_size // 2)
+
+    spool = Spool(str(tmp_path))
+    assert spool.open() == records[1][0]
+    assert os.path.getsize(path) == 2 * record_size
+    assert read_all(spool) == records[:2]
+    spool.close()
+
+
+def test_record_with_crc_mismatch_is_dropped(tmp_path):
+    records = [(meta(i), b"x" * 100) for i in range(3)]
+    write(Spool(str(tmp_path)), records)
+    (path,) = segments(tmp_path)
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b"y")
+
+    spool = Spool(str(tmp_path))
+    assert spool.open() == records[1][0]
+    assert read_all(spool) == records[:2]
+    spool.close()
+
+
+def test_incomplete_batch_is_dropped(tmp_path):
+    records = [
+        (meta(0), b"a"),
+        (meta(1, part=0, parts=2), b"b"),
+        (meta(1, part=1, parts=2), b"c"),
+        (meta(2, part=0, parts=2), b"d"),
+    ]
+    write(Spool(str(tmp_path), segment_size=HEADER.size), records)
+
+    spool = Spool(str(tmp_path))
+    assert spool.open() == records[2][0]
+    # the segment holding only a part of the last batch is removed
+    assert len(segments(tmp_path)) == 3
+    assert read_all(spool) == records[:3]
+    spool.close()
+
+
+def test_purge(tmp_path):
+    write(Spool(str(tmp_path)), [(meta(0), b"a")])
+
+    spool = Spool(str(tmp_path))
+    spool.purge()
+    assert spool.open() is None
+    assert spool.pending == 0
+    spool.close()
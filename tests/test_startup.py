@@ -0,0 +1,60 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+
+from es2loki.startup import StartupTimer, process_age
+
+LAZY_MODULES = [
+    "elasticsearch",
+    "tortoise",
+    "snappy",
+    "google.protobuf",
+    "aiohttp.web",
+    "dateutil",
+]
+
+
+def test_heavy_modules_are_imported_lazily():
+    # a fresh interpreter, as other tests have imported them already
+    code = (
+        "import json, sys, es2loki; "
+        f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    assert json.loads(out) == []
+
+
+def test_phases_are_timed_and_reported_once(caplog):
+    timer = StartupTimer()
+
+    async def run():
+        await asyncio.gather(
+            timer.timed("connect", asyncio.sleep(0.02)),
+            timer.timed("state", asyncio.sleep(0.01)),
+        )
+
+    asyncio.run(run())
+    assert list(timer.phases) == ["state", "connect"]
+    assert timer.phases["connect"] >= 0.02
+
+    logger = logging.getLogger("test")
+    with caplog.at_level(logging.INFO, logger="test"):
+        timer.report(logger, "the first push")
+        timer.report(logger, "exit")
+    assert len(caplog.records) == 1
+    assert caplog.records[0].getMessage().startswith("startup until the first push:")
+
+
+def test_process_age():
+    age = process_age()
+    assert age is None or age >= 0
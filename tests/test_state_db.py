@@ -0,0 +1,49 @@
+import asyncio
+import logging
+
+from es2loki.state import State
+from es2loki.state.db import DBStateStore, close_db, init_db
+
+
+def test_store_saves_and_loads(tmp_path):
+    async def run():
+        store = DBStateStore(name="idx", url=f"sqlite://{tmp_path}/state.db")
+        await store.init(asyncio.Event())
+        assert (await store.load()).iszero
+        await store.save(State(timestamp="2022-01-01", value=[1, 2]), 10)
+        await store.save(State(timestamp="2022-01-02", value=[3, 4]), 20)
+        state = await store.load()
+        await store.close()
+        return state
+
+    state = asyncio.run(run())
+    assert (state.timestamp, state.value, state.transferred) == (
+        "2022-01-02",
+        [3, 4],
+        20,
+    )
+
+
+def test_shared_connection(tmp_path):
+    async def job(name: str, connection) -> State:
+        store = DBStateStore(name=name, connection=connection)
+        await store.init(asyncio.Event())
+        await store.save(State(timestamp=name, value=[name]), len(name))
+        state = await store.load()
+        # the connection is left open for the other jobs
+        await store.close()
+        return state
+
+    async def run():
+        connection = await init_db(
+            f"sqlite://{tmp_path}/state.db", asyncio.Event(), logging.getLogger()
+        )
+        try:
+            return await asyncio.gather(
+                *(job(f"job-{i}", connection) for i in range(3))
+            )
+        finally:
+            await close_db()
+
+    states = asyncio.run(run())
+    assert [s.timestamp for s in states] == ["job-0", "job-1", "job-2"]
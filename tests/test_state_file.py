@@ -0,0 +1,74 @@
+import asyncio
+
+from es2loki.state import State
+from es2loki.state.file import FileStateStore
+
+
+def save_states(store: FileStateStore, states: list[State]):
+    async def run():
+        await store.init(asyncio.Event())
+        for state in states:
+            await store.save(state, state.transferred)
+        await store.close()
+
+    asyncio.run(run())
+
+
+def load_state(store: FileStateStore) -> State:
+    return asyncio.run(store.load())
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    store = FileStateStore(name="idx", directory=str(tmp_path))
+    save_states(
+        store,
+        [
+            State(timestamp="2022-01-01", transferred=1, value=[1]),
+            State(timestamp="2022-01-02", transferred=2, value=[2]),
+        ],
+    )
+    # the process crashed in the middle of appending the next line
+    with open(store.path, "a", encoding="utf-8") as f:
+        f.write('{"timestamp": "2022-01-03", "transf')
+
+    assert load_state(store) == State(timestamp="2022-01-02", transferred=2, value=[2])
+
+    # the next run appends after the torn line
+    store = FileStateStore(name="idx", directory=str(tmp_path))
+    save_states(store, [State(timestamp="2022-01-04", transferred=4, value=[4])])
+    assert load_state(store) == State(timestamp="2022-01-04", transferred=4, value=[4])
+
+
+def test_compaction_keeps_latest_state(tmp_path):
+    store = FileStateStore(name="idx", directory=str(tmp_path), max_size=1000)
+    states = [
+        State(timestamp=f"2022-01-01T00:00:{i:02d}", transferred=i, value=[i, "x"])
+        for i in range(60)
+    ]
+    save_states(store, states)
+
+    with open(store.path, encoding="utf-8") as f:
+        lines = f.readlines()
+    assert len(lines) < len(states)
+    assert sum(len(line) for line in lines) < 1000
+    assert load_state(store) == states[-1]
+
+
+def test_stores_of_different_names(tmp_path):
+    stores = [
+        FileStateStore(name=name, directory=str(tmp_path))
+        for name in ("logs-*", "logs/2022")
+    ]
+    for i, store in enumerate(stores):
+        save_states(store, [State(timestamp=str(i), transferred=i, value=[i])])
+
+    assert [load_state(store).timestamp for store in stores] == ["0", "1"]
+
+
+def test_cleanup_removes_state(tmp_path):
+    store = FileStateStore(name="idx", directory=str(tmp_path))
+    save_states(store, [State(timestamp="2022-01-01", transferred=1, value=[1])])
+
+    asyncio.run(store.cleanup())
+
+    assert load_state(store).iszero
@@ -0,0 +1,97 @@
+import datetime
+
+import pytest
+from dateutil.parser import isoparse
+
+from es2loki.timestamps import TimestampParser, datetime_to_ns
+
+
+def reference_ns(value: str) -> int:
+    """Nanoseconds of an ISO timestamp parsed by dateutil (microsecond precision)"""
+    dt = isoparse(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return datetime_to_ns(dt)
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "2022-11-03T10:20:30Z",
+        "2022-11-03T10:20:30",
+        "2022-11-03T10:20:30.1Z",
+        "2022-11-03T10:20:30.12Z",
+        "2022-11-03T10:20:30.123Z",
+        "2022-11-03T10:20:30.123456Z",
+        "2022-11-03T10:20:30.000001Z",
+        "2022-11-03T10:20:30.500",
+        "2022-11-03T10:20:30+00:00",
+        "2022-11-03T10:20:30+03:00",
+        "2022-11-03T10:20:30-05:30",
+        "2022-11-03T10:20:30+0530",
+        "2022-11-03T10:20:30.123+02:00",
+        "2022-11-03T01:20:30.123456-11:00",
+        "2022-12-31T23:59:59.999Z",
+        "2022-11-03",
+        "1969-12-31T23:59:59.5Z",
+        "2000-02-29T12:00:00Z",
+    ],
+)
+def test_iso_matches_dateutil(value: str):
+    assert TimestampParser().parse(value) == reference_ns(value)
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["2022-11-03T10:20:30.123Z", "2022-11-03T10:20:30.123+02:00"],
+)
+def test_cached_prefix_gives_the_same_result(value: str):
+    parser = TimestampParser()
+    parser.parse("2022-11-03T10:20:30Z")
+    assert parser.parse(value) == reference_ns(value)
+
+
+def test_nanoseconds_are_kept():
+    parser = TimestampParser()
+    base = reference_ns("2022-11-03T10:20:30Z")
+
+    assert parser.parse("2022-11-03T10:20:30.123456789Z") == base + 123456789
+    assert parser.parse("2022-11-03T10:20:30.000000001Z") == base + 1
+    assert parser.parse("2022-11-03T10:20:30.123456789+01:00") == (
+        base - 3600 * 10**9 + 123456789
+    )
+
+
+@pytest.mark.parametrize(
+    "value",
+    [1667470830123, "1667470830123", 1667470830.123 * 1000],
+)
+def test_epoch_millis(value):
+    ns = TimestampParser().parse(value)
+    assert ns // 1000 == reference_ns("2022-11-03T10:20:30.123Z") // 1000
+
+
+def test_epoch_nanos():
+    assert TimestampParser().parse(1667470830123456789) == (
+        reference_ns("2022-11-03T10:20:30Z") + 123456789
+    )
+
+
+def test_datetime():
+    dt = datetime.datetime(2022, 11, 3, 10, 20, 30, 123456, datetime.timezone.utc)
+    assert TimestampParser().parse(dt) == reference_ns("2022-11-03T10:20:30.123456Z")
+
+
+def test_empty_value():
+    assert TimestampParser().parse("") is None
+
+
+def test_invalid_value():
+    with pytest.raises(ValueError):
+        TimestampParser().parse("not a timestamp")
+
+
+def test_month():
+    parser = TimestampParser()
+    assert parser.month(reference_ns("2022-11-30T23:59:59Z")) == "202211"
+    assert parser.month(reference_ns("2022-12-01T00:00:00Z")) == "202212"
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from es2loki import BaseTransfer
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("ELASTIC_INDEX", "idx")
+    monkeypatch.setenv("STATE_MODE", "none")
+
+
+def make_transfer() -> BaseTransfer:
+    async def run():
+        transfer = BaseTransfer()
+        await transfer.es.close()
+        return transfer
+
+    return asyncio.run(run())
+
+
+def test_source_includes_keep_timestamp_and_sort_fields(monkeypatch):
+    monkeypatch.setenv("ELASTIC_SOURCE_INCLUDES", "message,log.offset")
+
+    transfer = make_transfer()
+
+    assert transfer.make_es_source_includes() == [
+        "message",
+        "log.offset",
+        "@timestamp",
+    ]
+
+
+def test_all_source_fields_by_default():
+    assert make_transfer().make_es_source_includes() is None
+
+
+def test_dropped_entries_are_not_counted_as_transferred():
+    async def run():
+        transfer = BaseTransfer()
+        await transfer.es.close()
+        transfer.total_docs = 3
+
+        async def push(batch, stop_event, data=None, on_dropped=None):
+            on_dropped(1)
+            return 200, 100
+
+        transfer.loki.push = push
+        batch = transfer.loki.make_batch()
+        for i in range(3):
+            batch.push(labels={"job": "test"}, timestamp=i + 1, entry=f"line {i}")
+        await transfer.send_to_loki(batch, None)
+        return transfer
+
+    transfer = asyncio.run(run())
+    assert transfer.transferred_docs == 2
+    assert transfer.dropped_docs == 1
+    assert transfer._progress() == 100.0
+
+
+def test_total_docs_refresh_follows_growing_index(monkeypatch):
+    monkeypatch.setenv("ELASTIC_COUNT_MODE", "remaining")
+    monkeypatch.setenv("ELASTIC_COUNT_INTERVAL", "60")
+    sleep = asyncio.sleep
+    monkeypatch.setattr(asyncio, "sleep", lambda delay: sleep(0))
+
+    async def run():
+        transfer = BaseTransfer()
+        await transfer.es.close()
+        # resumed after 100 documents
+        transfer._acked_docs = 100
+        transfer._acked_timestamp = "2022-01-01"
+        calls = []
+
+        class FakeES:
+            async def count(self, index, body=None):
+                calls.append(
+                    (transfer.total_docs, body["query"]["range"]["@timestamp"]["gte"])
+                )
+                if len(calls) == 1:
+                    raise ConnectionError("es is not available")
+                if len(calls) == 2:
+                    return {"count": 50}
+                if len(calls) == 3:
+                    # 30 documents are added, 50 more are acknowledged
+                    transfer._acked_docs = 150
+                    transfer._acked_timestamp = "2022-01-02"
+                    return {"count": 80}
+                transfer.stop_event.set()
+                return {"count": 30}
+
+        transfer.es = FakeES()
+        await transfer._refresh_total_docs()
+        return transfer, calls
+
+    transfer, calls = asyncio.run(run())
+    # the error is retried, the total counts acknowledged and remaining documents
+    assert calls == [
+        (0, "2022-01-01"),
+        (0, "2022-01-01"),
+        (150, "2022-01-01"),
+        (180, "2022-01-02"),
+    ]
+    assert transfer.total_docs == 180
+
+
+def test_push_error_stops_profiler_and_closes_spool(monkeypatch, tmp_path):
+    with open(tmp_path / "docs.ndjson", "w") as f:
+        for n in range(10):
+            f.write(f'{{"@timestamp": "2022-01-01T00:00:0{n}Z", "n": {n}}}\n')
+    monkeypatch.setenv("SOURCE_FILES", str(tmp_path / "docs.ndjson"))
+    monkeypatch.setenv("SPOOL_DIR", str(tmp_path / "spool"))
+    monkeypatch.setenv("PROFILE", "1")
+
+    async def run():
+        transfer = BaseTransfer()
+
+        async def warm_up():
+            pass
+
+        async def push(batch, stop_event, data=None, on_dropped=None):
+            raise RuntimeError("loki is broken")
+
+        transfer.warm_up = warm_up
+        transfer.loki.push = push
+        with pytest.raises(RuntimeError, match="loki is broken"):
+            await transfer.execute()
+        return transfer
+
+    transfer = asyncio.run(run())
+    assert transfer._spool_feeder.done()
+    assert transfer._eta_calc.done()
+    assert transfer.profiler._tasks == []
+    assert transfer.spool._writer._shutdown
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import aiohttp
+import pytest
+
+from es2loki import BaseTransfer
+from es2loki.commands.orchestrator import SharedResources
+from es2loki.loki import LokiBatch
+from es2loki.transform import init_worker, transform_hits
+
+
+@pytest.fixture(autouse=True)
+def env(monkeypatch):
+    monkeypatch.setenv("ELASTIC_INDEX", "idx")
+    monkeypatch.setenv("STATE_MODE", "none")
+    monkeypatch.setenv("LOKI_PUSH_MODE", "pb")
+
+
+def make_hits(n: int) -> list[dict]:
+    return [
+        {
+            "_source": {
+                "@timestamp": f"2022-01-01T00:00:{i:02d}Z",
+                "message": "m" * 100,
+            }
+        }
+        for i in range(n)
+    ]
+
+
+class IndexLabelTransfer(BaseTransfer):
+    def extract_doc_labels(self, source: dict) -> dict:
+        return {"index": self.es_index}
+
+
+def test_shared_workers_transform_with_hooks_of_each_job():
+    async def run():
+        shared = SharedResources(
+            loki_session=aiohttp.ClientSession(),
+            es_concurrency=asyncio.Semaphore(1),
+            loki_concurrency=asyncio.Semaphore(1),
+        )
+        transfers = [
+            IndexLabelTransfer(command_kwargs={"es_index": index, "shared": shared})
+            for index in ("a", "b")
+        ]
+
+        copy = pickle.loads(pickle.dumps(transfers[0]))
+        assert not hasattr(copy, "shared")
+        assert not hasattr(copy, "_command_kwargs")
+
+        # spawned workers get the transfer pickled, like forked ones do
+        executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+        )
+        try:
+            loop = asyncio.get_running_loop()
+            batches = []
+            for transfer in transfers + transfers:
+                batches.append(
+                    await loop.run_in_executor(
+                        executor,
+                        transform_hits,
+                        make_hits(10),
+                        LokiBatch,
+                        transfer.es_index,
+                        pickle.dumps(transfer),
+                    )
+                )
+        finally:
+            executor.shutdown()
+            await shared.close()
+        return batches
+
+    batches = asyncio.run(run())
+    assert [b.total_docs for b in batches] == [10] * 4
+    assert [
+        {labels.labels["index"] for labels, _, _ in b.iter_entries()} for b in batches
+    ] == [{"a"}, {"b"}, {"a"}, {"b"}]
+
+
+def test_merged_chunks_are_cut_at_batch_size(monkeypatch):
+    monkeypatch.setenv("LOKI_BATCH_SIZE", "1000")
+
+    async def run():
+        transfer = BaseTransfer()
+        pushed = []
+
+        async def push_batch(batch, state, window=None):
+            pushed.append((batch.total_size, state))
+
+        transfer.push_batch = push_batch
+        for state in range(3):
+            chunk = LokiBatch()
+            for hit in make_hits(15):
+                transfer.transform_doc(hit, chunk)
+            await transfer.process_es_chunk(chunk, state)
+        await transfer.flush_batch()
+        await transfer.es.close()
+        return pushed
+
+    pushed = asyncio.run(run())
+    assert all(size <= 1000 for size, _ in pushed)
+    line_size = len(json.dumps(make_hits(1)[0]["_source"], sort_keys=True))
+    assert sum(size for size, _ in pushed) == 45 * line_size
+    # batches cut in the middle of a chunk keep the state of the previous one
+    assert [state for _, state in pushed] == [None, None, 0, 0, 1, 1, 1, 2]